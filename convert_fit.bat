@@ -14,17 +14,16 @@ if errorlevel 1 (
     exit /b 1
 )
 
-REM Installa dipendenze se necessario
-echo Verifica dipendenze...
-pip show fitparse >nul 2>&1
-if errorlevel 1 (
-    echo Installazione fitparse...
-    pip install fitparse
-)
-
 REM Avvia l'applicazione
 if "%1"=="" (
     REM Se non ci sono parametri, prova la versione GUI
+    REM (la CLI verifica da sola le dipendenze)
+    echo Verifica dipendenze...
+    python -c "import fitparse" >nul 2>&1
+    if errorlevel 1 (
+        echo Installazione fitparse...
+        pip install fitparse
+    )
     echo Avvio interfaccia grafica...
     python fit_to_txt_converter.py
     if errorlevel 1 (
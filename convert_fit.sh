@@ -12,15 +12,16 @@ if ! command -v python3 &> /dev/null; then
     exit 1
 fi
 
-# Verifica/installa dipendenze
-echo "Verifica dipendenze..."
-if ! python3 -c "import fitparse" 2>/dev/null; then
-    echo "Installazione fitparse..."
-    pip3 install fitparse --break-system-packages || pip3 install fitparse
-fi
-
 # Se non ci sono parametri, prova la versione GUI
 if [ $# -eq 0 ]; then
+    # Verifica/installa dipendenze (la CLI le verifica da sola, senza
+    # avviare un interprete in più)
+    echo "Verifica dipendenze..."
+    if ! python3 -c "import fitparse" 2>/dev/null; then
+        echo "Installazione fitparse..."
+        pip3 install fitparse --break-system-packages || pip3 install fitparse
+    fi
+    
     echo "Avvio interfaccia grafica..."
     python3 fit_to_txt_converter.py 2>/dev/null
     
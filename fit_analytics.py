@@ -0,0 +1,484 @@
+"""
+Statistiche dell'attività
+Calcolate con NumPy sull'intera serie dei record (non sul campione del
+.txt): migliori medie su finestre da 5 s a 60 min, tempo nelle zone di
+frequenza cardiaca e potenza, normalized power, parziali per km o miglio,
+dislivello con smoothing e tempo in movimento. Le medie mobili usano le
+somme cumulative, quindi il costo non dipende dalla larghezza della finestra
+"""
+
+from typing import Dict, List, Optional
+
+from fit_export import RecordColumns
+
+# Lunghezza dei parziali in metri
+SPLIT_UNITS = {'km': 1000.0, 'mi': 1609.344}
+
+# Finestre delle migliori medie, in secondi
+BEST_WINDOWS = (5, 10, 30, 60, 300, 600, 1200, 1800, 3600)
+
+# Limiti superiori delle zone, in frazione di FC massima (5 zone) e di FTP
+# (7 zone di Coggan); l'ultima zona non ha limite
+HR_ZONES = (0.6, 0.7, 0.8, 0.9)
+POWER_ZONES = (0.55, 0.75, 0.90, 1.05, 1.20, 1.50)
+
+# Buchi fino a questi secondi tra due record (es. registrazione "smart")
+# vengono riempiti con l'ultimo valore; quelli più lunghi sono pause
+MAX_GAP = 5
+
+# Velocità minima (m/s) per considerare l'atleta in movimento
+MOVING_SPEED = 0.5
+
+# Finestra (secondi) della media mobile centrata sull'altitudine: toglie
+# il rumore del GPS e del barometro prima di sommare le salite
+ELEVATION_SMOOTHING = 15
+
+# Distanza minima (m) del parziale finale incompleto
+MIN_SPLIT = 10.0
+
+# Finestra della normalized power e stima della FTP dai migliori 20 minuti
+NP_WINDOW = 30
+FTP_WINDOW = 1200
+FTP_FROM_BEST = 0.95
+
+# Oltre questa durata (es. timestamp errati) le statistiche non vengono calcolate
+MAX_DURATION = 7 * 86400
+
+
+class AnalyticsSettings:
+    """
+    Parametri delle statistiche, validati alla creazione
+
+    Args:
+        hr_max: Frequenza cardiaca massima per le zone (default: la
+            massima registrata nell'attività)
+        ftp: Functional threshold power in watt per zone, IF e TSS
+            (default: 95% della migliore media su 20 minuti)
+        split_unit: 'km' oppure 'mi'
+    """
+
+    def __init__(self, hr_max: Optional[float] = None, ftp: Optional[float] = None,
+                 split_unit: str = 'km'):
+        if hr_max is not None and hr_max <= 0:
+            raise ValueError("la frequenza cardiaca massima deve essere positiva")
+        if ftp is not None and ftp <= 0:
+            raise ValueError("la FTP deve essere positiva")
+        if split_unit not in SPLIT_UNITS:
+            raise ValueError(f"Unità dei parziali non supportata: {split_unit}")
+        self.hr_max = hr_max
+        self.ftp = ftp
+        self.split_unit = split_unit
+
+    def to_dict(self) -> Dict:
+        """Argomenti per ricreare le impostazioni (es. nei processi di un pool)"""
+        return {'hr_max': self.hr_max, 'ftp': self.ftp, 'split_unit': self.split_unit}
+
+
+def check_analytics_dependencies():
+    """Verifica che NumPy sia installato"""
+    try:
+        import numpy  # noqa: F401
+    except ImportError:
+        raise RuntimeError("Le statistiche richiedono il modulo 'numpy': "
+                           "pip install numpy") from None
+
+
+class _Series:
+    """
+    Colonne dei record ricampionate a 1 Hz
+
+    Ogni secondo prende il valore dell'ultimo record; nelle pause (buchi
+    oltre MAX_GAP) i valori mancano e 'recorded' è False. Le posizioni dei
+    record nella griglia restano in 'index' per le colonne derivate.
+    """
+
+    def __init__(self, columns: RecordColumns):
+        import numpy as np
+
+        self.count = columns.count
+        times = _numeric(columns, 'timestamp')
+        self.valid = ~np.isnan(times) if times is not None else np.zeros(self.count, bool)
+        self.size = 0
+        if not self.valid.any():
+            return
+
+        # Record fuori ordine: il tempo non torna mai indietro
+        times = np.maximum.accumulate(np.where(self.valid, times, -np.inf))[self.valid]
+        seconds = np.floor(times - times[0]).astype(np.int64)
+        self.start = float(times[0])
+        self.size = int(seconds[-1]) + 1
+        if self.size > MAX_DURATION:
+            self.size = 0
+            return
+
+        grid = np.arange(self.size)
+        last = np.searchsorted(seconds, grid, side='right') - 1
+        gaps = np.diff(seconds, append=seconds[-1] + 1)
+        self.recorded = (seconds[last] == grid) | (gaps[last] <= MAX_GAP)
+        self.index = seconds
+        self._last = last
+        self._columns = columns
+
+    def __bool__(self):
+        return self.size > 0
+
+    def resample(self, *names: str):
+        """Prima colonna disponibile tra names sulla griglia (NaN nelle pause), None se assente"""
+        import numpy as np
+
+        for name in names:
+            values = _numeric(self._columns, name)
+            if values is None:
+                continue
+            values = values[self.valid]
+            if np.isnan(values).all():
+                continue
+            return np.where(self.recorded, values[self._last], np.nan)
+        return None
+
+
+def _numeric(columns: RecordColumns, name: str):
+    import numpy as np
+
+    column = columns.columns.get(name)
+    if column is None or column.kind == 'str':
+        return None
+    return np.frombuffer(column.values, dtype=np.float64)[:columns.count]
+
+
+def _cumulative(values):
+    """Somme cumulative di valori e di valori validi, con uno zero iniziale"""
+    import numpy as np
+
+    valid = ~np.isnan(values)
+    sums = np.concatenate(([0.0], np.cumsum(np.where(valid, values, 0.0))))
+    counts = np.concatenate(([0], np.cumsum(valid)))
+    return sums, counts
+
+
+def rolling_mean(values, window: int, cumulative=None):
+    """
+    Media mobile su finestre di 'window' campioni (NaN se la finestra ha
+    valori mancanti), in O(n) qualunque sia la finestra
+
+    Args:
+        cumulative: Risultato di _cumulative(values), se già calcolato
+    """
+    import numpy as np
+
+    sums, counts = cumulative if cumulative is not None else _cumulative(values)
+    total = sums[window:] - sums[:-window]
+    complete = (counts[window:] - counts[:-window]) == window
+    return np.where(complete, total / window, np.nan)
+
+
+def _best(values, windows=BEST_WINDOWS) -> Dict[int, float]:
+    """Migliore media per ogni finestra non più lunga dell'attività"""
+    import numpy as np
+
+    # Le somme cumulative servono a tutte le finestre: si calcolano una volta
+    cumulative = _cumulative(values)
+    best = {}
+    for window in windows:
+        if window > len(values):
+            break
+        means = rolling_mean(values, window, cumulative)
+        if not np.isnan(means).all():
+            best[window] = float(np.nanmax(means))
+    return best
+
+
+def _zone_times(values, reference: float, bounds) -> List[int]:
+    """Secondi in ogni zona (limiti = bounds * reference)"""
+    import numpy as np
+
+    values = values[~np.isnan(values)]
+    zones = np.searchsorted(np.asarray(bounds) * reference, values, side='right')
+    return np.bincount(zones, minlength=len(bounds) + 1).tolist()
+
+
+def _zones(values, reference: float, bounds):
+    """Zona (da 1) di ogni valore, NaN dove il valore manca"""
+    import numpy as np
+
+    zones = np.searchsorted(np.asarray(bounds) * reference, values, side='right') + 1.0
+    return np.where(np.isnan(values), np.nan, zones)
+
+
+def _smooth(values, window: int):
+    """Media mobile centrata; i valori mancanti vengono prima interpolati"""
+    import numpy as np
+
+    valid = ~np.isnan(values)
+    if not valid.any():
+        return values
+    positions = np.arange(len(values))
+    filled = np.interp(positions, positions[valid], values[valid])
+    if len(filled) <= window:
+        return filled
+    kernel = np.ones(window) / window
+    padded = np.pad(filled, (window // 2, window - 1 - window // 2), mode='edge')
+    return np.convolve(padded, kernel, mode='valid')
+
+
+def analyze(columns: RecordColumns, settings: Optional[AnalyticsSettings] = None,
+            derived: bool = False) -> Dict:
+    """
+    Statistiche di un'attività a partire dalle colonne dei record
+
+    Args:
+        columns: Record raccolti con fit_export.collect_records
+        settings: FC massima, FTP e unità dei parziali
+        derived: Se True aggiunge a columns le colonne derivate per record:
+            moving, hr_zone, power_zone, altitude_smooth, split
+
+    Returns:
+        Dizionario serializzabile in JSON (vuoto se i record non hanno
+        timestamp); le grandezze sono in unità SI (s, m, m/s, W, bpm)
+    """
+    import numpy as np
+
+    settings = settings or AnalyticsSettings()
+    series = _Series(columns)
+    if not series:
+        return {}
+
+    power = series.resample('power')
+    heart_rate = series.resample('heart_rate')
+    speed = series.resample('enhanced_speed', 'speed')
+    distance = series.resample('distance')
+    altitude = series.resample('enhanced_altitude', 'altitude')
+
+    # Distanza e velocità si ricavano l'una dall'altra se manca una delle due
+    if distance is None and speed is not None:
+        distance = np.cumsum(np.nan_to_num(speed))
+    if distance is not None:
+        distance = np.fmax.accumulate(distance)
+        if np.isnan(distance).all():
+            distance = None
+        elif speed is None:
+            speed = np.where(series.recorded, np.diff(distance, prepend=distance[0]), np.nan)
+
+    stats = {
+        'start': series.start,
+        'duration': series.size,
+        'recorded_time': int(series.recorded.sum()),
+        'split_unit': settings.split_unit,
+    }
+
+    moving = None
+    if speed is not None:
+        moving = series.recorded & (np.nan_to_num(speed) >= MOVING_SPEED)
+        stats['moving_time'] = int(moving.sum())
+    if distance is not None:
+        stats['distance'] = float(np.nanmax(distance))
+
+    # Nelle pause potenza e velocità contano come zero, la FC come mancante
+    if power is not None:
+        power_or_zero = np.nan_to_num(power)
+        stats['best_power'] = _best(power_or_zero)
+        if series.size >= NP_WINDOW:
+            smoothed = rolling_mean(power_or_zero, NP_WINDOW)
+            stats['normalized_power'] = float(np.mean(smoothed ** 4) ** 0.25)
+        ftp = settings.ftp
+        stats['ftp_estimated'] = ftp is None
+        if ftp is None and FTP_WINDOW in stats['best_power']:
+            ftp = FTP_FROM_BEST * stats['best_power'][FTP_WINDOW]
+        if ftp:
+            stats['ftp'] = float(ftp)
+            stats['power_zones'] = _zone_times(power, ftp, POWER_ZONES)
+            if 'normalized_power' in stats:
+                intensity = stats['normalized_power'] / ftp
+                stats['intensity_factor'] = intensity
+                stats['training_stress_score'] = (series.size * stats['normalized_power']
+                                                  * intensity / (ftp * 3600) * 100)
+    if heart_rate is not None:
+        stats['best_heart_rate'] = _best(heart_rate)
+        hr_max = settings.hr_max or float(np.nanmax(heart_rate))
+        stats['hr_max'] = float(hr_max)
+        stats['hr_max_estimated'] = settings.hr_max is None
+        stats['hr_zones'] = _zone_times(heart_rate, hr_max, HR_ZONES)
+    if speed is not None:
+        stats['best_speed'] = _best(np.nan_to_num(speed))
+
+    smooth_altitude = None
+    climbs = None
+    if altitude is not None:
+        smooth_altitude = _smooth(altitude, ELEVATION_SMOOTHING)
+        steps = np.diff(smooth_altitude, prepend=smooth_altitude[0])
+        climbs = np.fmax(steps, 0.0)
+        stats['elevation_gain'] = float(climbs.sum())
+        stats['elevation_loss'] = float(-np.fmin(steps, 0.0).sum())
+
+    if distance is not None:
+        stats['splits'] = _splits(series, distance, settings, heart_rate, power, climbs)
+
+    if derived:
+        _add_derived(columns, series, stats, moving, smooth_altitude, distance, settings)
+    return stats
+
+
+def _splits(series: _Series, distance, settings: AnalyticsSettings,
+            heart_rate, power, climbs) -> List[Dict]:
+    """Parziali: confini trovati con searchsorted, medie dalle somme cumulative"""
+    import numpy as np
+
+    length = SPLIT_UNITS[settings.split_unit]
+    total = float(np.nanmax(distance))
+    marks = np.arange(1, int(total // length) + 1) * length
+    bounds = np.concatenate(([0], np.searchsorted(np.nan_to_num(distance), marks),
+                             [series.size]))
+    split_distance = [length] * len(marks) + [total - len(marks) * length]
+    if split_distance[-1] < MIN_SPLIT and len(marks):
+        # Niente parziale finale di pochi metri: il tempo va all'ultimo completo
+        bounds = np.delete(bounds, -2)
+        split_distance.pop()
+    starts, ends = bounds[:-1], bounds[1:]
+
+    columns = {}
+    for name, values in (('heart_rate', heart_rate), ('power', power)):
+        if values is not None:
+            sums, counts = _cumulative(values)
+            valid = counts[ends] - counts[starts]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                columns[name] = np.where(valid > 0, (sums[ends] - sums[starts]) / valid, np.nan)
+    if climbs is not None:
+        sums = np.concatenate(([0.0], np.cumsum(climbs)))
+        columns['elevation_gain'] = sums[ends] - sums[starts]
+
+    splits = []
+    for i, (start, end) in enumerate(zip(starts.tolist(), ends.tolist())):
+        split = {'split': i + 1, 'distance': float(split_distance[i]), 'time': end - start}
+        for name, values in columns.items():
+            value = float(values[i])
+            split[name] = None if value != value else value
+        splits.append(split)
+    return splits
+
+
+def _add_derived(columns: RecordColumns, series: _Series, stats: Dict, moving,
+                 smooth_altitude, distance, settings: AnalyticsSettings):
+    """Aggiunge le colonne derivate per record (NaN per i record senza timestamp)"""
+    import numpy as np
+
+
+    def per_record(grid_values):
+        values = np.full(columns.count, np.nan)
+        values[series.valid] = grid_values[series.index]
+        return values
+
+    if moving is not None:
+        columns.add_column('moving', 'int', per_record(moving.astype(np.float64)))
+    if 'hr_max' in stats:
+        heart_rate = _numeric(columns, 'heart_rate')
+        columns.add_column('hr_zone', 'int', _zones(heart_rate, stats['hr_max'], HR_ZONES))
+    if 'ftp' in stats:
+        power = _numeric(columns, 'power')
+        columns.add_column('power_zone', 'int', _zones(power, stats['ftp'], POWER_ZONES))
+    if smooth_altitude is not None:
+        columns.add_column('altitude_smooth', 'float', per_record(smooth_altitude))
+    if distance is not None:
+        length = SPLIT_UNITS[settings.split_unit]
+        columns.add_column('split', 'int', per_record(np.floor(distance / length) + 1))
+
+
+def _window_label(seconds: int) -> str:
+    return f"{seconds} s" if seconds < 60 else f"{seconds // 60} min"
+
+
+def _duration(seconds: float) -> str:
+    seconds = int(round(seconds))
+    return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def _pace(speed: float, unit: str) -> str:
+    """Passo (min:ss per km o miglio) da una velocità in m/s"""
+    if not speed or speed <= 0:
+        return "-"
+    seconds = int(round(SPLIT_UNITS[unit] / speed))
+    return f"{seconds // 60}:{seconds % 60:02d}/{unit}"
+
+
+def _speed(speed: float, unit: str) -> str:
+    label = 'km/h' if unit == 'km' else 'mph'
+    return f"{speed * 3600 / SPLIT_UNITS[unit]:.1f} {label}"
+
+
+def _zone_lines(times: List[int], bounds) -> List[str]:
+    total = sum(times) or 1
+    limits = [f"<{bounds[0]:.0%}"]
+    limits += [f"{low:.0%}-{high:.0%}" for low, high in zip(bounds, bounds[1:])]
+    limits += [f">={bounds[-1]:.0%}"]
+    lines = []
+    for i, (seconds, limit) in enumerate(zip(times, limits), 1):
+        lines.append(f"  Z{i} {limit:<9} {_duration(seconds):>8}  {seconds / total:6.1%}\n")
+    return lines
+
+
+def format_analytics(stats: Dict) -> str:
+    """Sezione STATISTICHE ATTIVITÀ del .txt"""
+    parts = ["\n\nSTATISTICHE ATTIVITÀ\n", "-" * 30 + "\n"]
+    if not stats:
+        parts.append("Non disponibili: i record non hanno timestamp\n")
+        return "".join(parts)
+
+    unit = stats['split_unit']
+    length = SPLIT_UNITS[unit] / 1000
+    line = f"Durata: {_duration(stats['duration'])}"
+    if 'moving_time' in stats:
+        line += f" (in movimento {_duration(stats['moving_time'])})"
+    parts.append(line + "\n")
+    if 'distance' in stats:
+        parts.append(f"Distanza: {stats['distance'] / 1000 / length:.2f} {unit}\n")
+    if 'elevation_gain' in stats:
+        parts.append(f"Dislivello: +{stats['elevation_gain']:.0f} m / "
+                     f"-{stats['elevation_loss']:.0f} m\n")
+    if 'normalized_power' in stats:
+        line = f"Normalized power: {stats['normalized_power']:.0f} W"
+        if 'intensity_factor' in stats:
+            line += (f" (IF {stats['intensity_factor']:.2f}, "
+                     f"TSS {stats['training_stress_score']:.0f})")
+        parts.append(line + "\n")
+
+    bests = [(key, stats[key]) for key in ('best_power', 'best_heart_rate', 'best_speed')
+             if stats.get(key)]
+    if bests:
+        parts.append("\nMigliori medie:\n")
+        windows = sorted(set().union(*(best for _, best in bests)))
+        for window in windows:
+            cells = []
+            for key, best in bests:
+                value = best.get(window)
+                if value is None:
+                    cells.append("-")
+                elif key == 'best_power':
+                    cells.append(f"{value:.0f} W")
+                elif key == 'best_heart_rate':
+                    cells.append(f"{value:.0f} bpm")
+                else:
+                    cells.append(f"{_speed(value, unit)} ({_pace(value, unit)})")
+            parts.append(f"  {_window_label(window):>6}: " + " | ".join(cells) + "\n")
+
+    if 'hr_zones' in stats:
+        source = "stimata" if stats['hr_max_estimated'] else "impostata"
+        parts.append(f"\nTempo nelle zone FC (FC max {stats['hr_max']:.0f} bpm, {source}):\n")
+        parts.extend(_zone_lines(stats['hr_zones'], HR_ZONES))
+    if 'power_zones' in stats:
+        source = "stimata" if stats['ftp_estimated'] else "impostata"
+        parts.append(f"\nTempo nelle zone di potenza (FTP {stats['ftp']:.0f} W, {source}):\n")
+        parts.extend(_zone_lines(stats['power_zones'], POWER_ZONES))
+
+    if stats.get('splits'):
+        parts.append(f"\nParziali ({unit}):\n")
+        for split in stats['splits']:
+            speed = split['distance'] / split['time'] if split['time'] else 0
+            line = (f"  {split['split']:>3}  {split['distance'] / 1000 / length:5.2f} {unit}  "
+                    f"{_duration(split['time']):>8}  {_pace(speed, unit)}")
+            if split.get('heart_rate') is not None:
+                line += f"  {split['heart_rate']:.0f} bpm"
+            if split.get('power') is not None:
+                line += f"  {split['power']:.0f} W"
+            if split.get('elevation_gain') is not None:
+                line += f"  +{split['elevation_gain']:.0f} m"
+            parts.append(line + "\n")
+    return "".join(parts)
@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+"""
+Benchmark della conversione FIT
+Misura convert_batch su un corpus di file .fit (reale o generato con
+fit_synth) e salva il risultato in JSON, così esecuzioni diverse possono
+essere confrontate per trovare regressioni di prestazioni
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+from contextlib import redirect_stdout
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from fit_to_txt_converter_cli import FitToTxtConverterCLI, __version__
+from fit_constants import DEFAULT_MESSAGES, ENGINES
+from fit_core import format_report
+from fit_stream import decode, summarize_fields
+from fit_input import INPUT_MODES
+from fit_export import EXPORT_FORMATS, collect_records, estimate_capacity, write_columns
+from fit_synth import add_corpus_arguments, corpus_options, write_corpus
+
+# Versione del formato del risultato JSON
+RESULT_FORMAT = 1
+
+STAGES = ('parse', 'categorize', 'format', 'write')
+
+# Metriche confrontate da 'compare': (sezione, chiave, True se più alto è meglio)
+COMPARED_METRICS = [
+    ('batch', 'files_per_s', True),
+    ('batch', 'records_per_s', True),
+    ('batch', 'mb_per_s', True),
+    ('stages', 'parse', False),
+    ('stages', 'categorize', False),
+    ('stages', 'format', False),
+    ('stages', 'write', False),
+    ('peak_rss_mb', 'self', False),
+    ('peak_rss_mb', 'children', False),
+]
+
+
+def find_fit_files(corpus: Path) -> List[Path]:
+    """File .fit del corpus (un file singolo o una cartella, non ricorsivo)"""
+    if corpus.is_file():
+        return [corpus]
+    return sorted(p for p in corpus.iterdir() if p.is_file() and p.suffix.lower() == '.fit')
+
+
+def peak_rss_mb() -> Dict[str, Optional[float]]:
+    """Picco di memoria residente del processo e dei processi figli (pool)"""
+    try:
+        import resource
+    except ImportError:
+        return {'self': None, 'children': None}
+
+    # ru_maxrss è in kB su Linux e in byte su macOS
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return {
+        'self': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, 1),
+        'children': round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale, 1),
+    }
+
+
+def measure_stages(converter: FitToTxtConverterCLI, fit_files: List[Path],
+                   output_dir: Path) -> Tuple[Dict[str, float], int, int]:
+    """
+    Tempi delle singole fasi della conversione, file per file
+
+    Nella conversione normale le fasi sono intrecciate (i messaggi vengono
+    categorizzati mentre il file viene letto), quindi qui vengono eseguite
+    una dopo l'altra sugli stessi dati:
+
+    - parse: decodifica dei messaggi in una lista
+    - categorize: sessione/lap/campione dei record (o colonne per i formati
+      colonnari)
+    - format: generazione del testo .txt in memoria (0 per i formati
+      colonnari, che formattano durante la scrittura)
+    - write: scrittura su disco
+
+    Returns:
+        Tupla (secondi per fase, numero di record, file falliti)
+    """
+    stages = dict.fromkeys(STAGES, 0.0)
+    records = failed = 0
+    clock = time.perf_counter
+    options = converter.options
+
+    for fit_file in fit_files:
+        out_file = output_dir / options.output_name(fit_file)
+        try:
+            t0 = clock()
+            if options.output_format == 'txt':
+                messages = decode(fit_file, list, options.engine, options.messages,
+                                  options.input_mode)
+                t1 = clock()
+                session_data, lap_data, summary = summarize_fields(messages)
+                t2 = clock()
+                text = format_report(fit_file.name, session_data, lap_data, summary)
+                t3 = clock()
+                with open(out_file, 'w', encoding='utf-8') as f:
+                    f.write(text)
+                t4 = clock()
+                records += summary.count
+            else:
+                messages = decode(fit_file, list, options.engine, {'record'},
+                                  options.input_mode)
+                t1 = clock()
+                columns = collect_records(messages, estimate_capacity(fit_file))
+                t2 = t3 = clock()
+                write_columns(columns, out_file, options.output_format)
+                t4 = clock()
+                records += columns.count
+        except Exception:
+            failed += 1
+            continue
+
+        stages['parse'] += t1 - t0
+        stages['categorize'] += t2 - t1
+        stages['format'] += t3 - t2
+        stages['write'] += t4 - t3
+
+    return {name: round(seconds, 4) for name, seconds in stages.items()}, records, failed
+
+
+def run_benchmark(corpus: Path, engine: str = 'fitparse', jobs: int = 1,
+                  input_mode: str = 'mmap', output_format: str = 'txt',
+                  messages=None, repeat: int = 3) -> Dict:
+    """
+    Esegue il benchmark su un corpus
+
+    convert_batch viene eseguito `repeat` volte e per il throughput si usa
+    l'esecuzione più veloce; il picco di memoria è misurato subito dopo,
+    prima della misura delle singole fasi (che tiene tutti i messaggi di un
+    file in memoria).
+
+    Returns:
+        Risultato serializzabile in JSON
+    """
+    fit_files = find_fit_files(corpus)
+    if not fit_files:
+        raise ValueError(f"Nessun file .fit trovato in {corpus}")
+
+    converter = FitToTxtConverterCLI(verbose=False, output_format=output_format,
+                                     engine=engine, messages=messages,
+                                     input_mode=input_mode)
+    total_bytes = sum(f.stat().st_size for f in fit_files)
+
+    runs = []
+    failed = 0
+    with tempfile.TemporaryDirectory(prefix='fit_benchmark_') as tmp:
+        out_dir = Path(tmp)
+        for _ in range(max(1, repeat)):
+            # convert_batch stampa il progresso anche in modalità silenziosa
+            with redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                _, failed = converter.convert_batch(corpus, out_dir, jobs=jobs)
+                runs.append(round(time.perf_counter() - start, 4))
+        rss = peak_rss_mb()
+
+        stages, records, _ = measure_stages(converter, fit_files, out_dir)
+
+    best = min(runs)
+    return {
+        'format': RESULT_FORMAT,
+        'version': __version__,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'platform': {
+            'python': platform.python_version(),
+            'system': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'options': {
+            'engine': engine,
+            'jobs': jobs,
+            'input_mode': input_mode,
+            'output_format': output_format,
+            'messages': sorted(converter.options.messages),
+            'repeat': len(runs),
+        },
+        'corpus': {
+            'path': str(corpus),
+            'files': len(fit_files),
+            'bytes': total_bytes,
+            'records': records,
+        },
+        'batch': {
+            'runs': runs,
+            'seconds': best,
+            'failed': failed,
+            'files_per_s': round(len(fit_files) / best, 2) if best else None,
+            'records_per_s': round(records / best, 1) if best else None,
+            'mb_per_s': round(total_bytes / best / 1e6, 3) if best else None,
+        },
+        'stages': stages,
+        'peak_rss_mb': rss,
+    }
+
+
+def print_result(result: Dict):
+    corpus, batch = result['corpus'], result['batch']
+    options = result['options']
+    print(f"Corpus: {corpus['files']} file, {corpus['bytes'] / 1e6:.1f} MB, "
+          f"{corpus['records']} record")
+    print(f"Opzioni: engine={options['engine']} jobs={options['jobs']} "
+          f"input-mode={options['input_mode']} formato={options['output_format']}")
+    print("-" * 40)
+    print(f"Tempo batch (migliore di {len(batch['runs'])}): {batch['seconds']:.3f} s")
+    print(f"File/s:    {batch['files_per_s']}")
+    print(f"Record/s:  {batch['records_per_s']}")
+    print(f"MB/s:      {batch['mb_per_s']}")
+    if batch['failed']:
+        print(f"Falliti:   {batch['failed']} file")
+    print("-" * 40)
+    print("Fasi (secondi, somma su tutti i file):")
+    for name in STAGES:
+        print(f"  {name:<11} {result['stages'][name]:.3f}")
+    rss = result['peak_rss_mb']
+    if rss['self'] is not None:
+        print(f"Picco RSS: {rss['self']} MB (processi figli: {rss['children']} MB)")
+
+
+def compare_results(base: Dict, new: Dict, max_regression: Optional[float] = None) -> bool:
+    """
+    Stampa il confronto tra due risultati
+
+    Returns:
+        False se un throughput del batch peggiora più di max_regression (%)
+    """
+    ok = True
+    print(f"{'metrica':<26} {'base':>12} {'nuovo':>12} {'variazione':>11}")
+    for section, key, higher_is_better in COMPARED_METRICS:
+        old_value = base.get(section, {}).get(key)
+        new_value = new.get(section, {}).get(key)
+        if old_value is None or new_value is None:
+            continue
+        if old_value:
+            change = (new_value - old_value) / old_value * 100
+            change_text = f"{change:+.1f}%"
+        else:
+            change = 0.0
+            change_text = "-"
+        print(f"{section + '.' + key:<26} {old_value:>12} {new_value:>12} {change_text:>11}")
+
+        worse = -change if higher_is_better else change
+        if max_regression is not None and section == 'batch' and worse > max_regression:
+            ok = False
+
+    if base.get('options') != new.get('options'):
+        print("\nAttenzione: i due risultati usano opzioni diverse")
+    if base.get('corpus', {}).get('bytes') != new.get('corpus', {}).get('bytes'):
+        print("Attenzione: i due risultati usano corpus diversi")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark della conversione di file .fit',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Esempi:
+  # Genera un corpus sintetico di 20 attività da 2 ore
+  %(prog)s generate corpus/ --files 20 --duration 7200
+
+  # Misura un corpus e salva il risultato
+  %(prog)s run corpus/ --engine fast -j 4 --json base.json
+
+  # Senza corpus: ne genera uno temporaneo con le opzioni indicate
+  %(prog)s run --files 5 --sample-rate 4 --dev-fields 3 --hrv 1
+
+  # Confronta due esecuzioni (exit code 1 se il throughput cala oltre il 10%%)
+  %(prog)s compare base.json nuovo.json --max-regression 10
+        """
+    )
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    generate = commands.add_parser('generate', help='Genera un corpus di file .fit sintetici')
+    generate.add_argument('output', type=str, help='Cartella in cui scrivere i file')
+    add_corpus_arguments(generate)
+
+    run = commands.add_parser('run', help='Esegue il benchmark')
+    run.add_argument('corpus', type=str, nargs='?', default=None,
+                     help='File .fit o cartella (default: corpus sintetico temporaneo)')
+    run.add_argument('--engine', choices=ENGINES, default='fitparse',
+                     help='Motore di decodifica (default: fitparse)')
+    run.add_argument('-j', '--jobs', type=int, default=1,
+                     help='Numero di processi paralleli (default: 1)')
+    run.add_argument('--input-mode', choices=INPUT_MODES, default='mmap',
+                     help='Lettura dei file (default: mmap)')
+    run.add_argument('-f', '--format', choices=['txt'] + list(EXPORT_FORMATS), default='txt',
+                     help='Formato di output (default: txt)')
+    run.add_argument('--messages', type=str, default=','.join(sorted(DEFAULT_MESSAGES)),
+                     help='Messaggi da decodificare, separati da virgola')
+    run.add_argument('--repeat', type=int, default=3,
+                     help='Esecuzioni del batch, vale la più veloce (default: 3)')
+    run.add_argument('--json', type=str, default=None,
+                     help='Salva il risultato in questo file JSON ("-" per stdout)')
+    add_corpus_arguments(run)
+
+    compare = commands.add_parser('compare', help='Confronta due risultati JSON')
+    compare.add_argument('base', type=str, help='Risultato di riferimento')
+    compare.add_argument('new', type=str, help='Nuovo risultato')
+    compare.add_argument('--max-regression', type=float, default=None,
+                         help='Esci con codice 1 se il throughput cala più di questa percentuale')
+
+    args = parser.parse_args()
+
+    try:
+        if args.command == 'generate':
+            paths = write_corpus(Path(args.output), args.files, args.seed,
+                                 **corpus_options(args))
+            size = sum(p.stat().st_size for p in paths)
+            print(f"Generati {len(paths)} file in {args.output} ({size / 1e6:.1f} MB)")
+
+        elif args.command == 'run':
+            messages = [name.strip() for name in args.messages.split(',') if name.strip()]
+            with tempfile.TemporaryDirectory(prefix='fit_corpus_') as tmp:
+                corpus = Path(args.corpus) if args.corpus else Path(tmp)
+                if args.corpus is None:
+                    write_corpus(corpus, args.files, args.seed, **corpus_options(args))
+                result = run_benchmark(corpus, args.engine, args.jobs, args.input_mode,
+                                       args.format, messages, args.repeat)
+            if args.corpus is None:
+                result['corpus']['path'] = None
+                result['corpus']['synthetic'] = dict(corpus_options(args), files=args.files,
+                                                     seed=args.seed)
+
+            if args.json == '-':
+                json.dump(result, sys.stdout, indent=2)
+                print()
+            else:
+                print_result(result)
+                if args.json:
+                    with open(args.json, 'w', encoding='utf-8') as f:
+                        json.dump(result, f, indent=2)
+                    print(f"\nRisultato salvato in {args.json}")
+
+        else:
+            with open(args.base, encoding='utf-8') as f:
+                base = json.load(f)
+            with open(args.new, encoding='utf-8') as f:
+                new = json.load(f)
+            if not compare_results(base, new, args.max_regression):
+                print(f"\nRegressione oltre il {args.max_regression}%")
+                sys.exit(1)
+
+    except (ValueError, OSError) as e:
+        print(f"Errore: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+"""
+Cache dei risultati di conversione
+Lo stesso file .fit arriva spesso più volte (nuove sincronizzazioni,
+esportazioni duplicate, upload ripetuti): il risultato viene salvato in un
+file SQLite indicizzato per SHA-256 del contenuto e opzioni di output, così
+le copie successive non vengono decodificate di nuovo
+"""
+
+import json
+import time
+import sqlite3
+import hashlib
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from fit_constants import DEFAULT_CACHE_SIZE
+
+# Da incrementare quando cambia il contenuto dei file di output, così i
+# risultati salvati dalle versioni precedenti non vengono più usati
+CACHE_FORMAT = 2
+
+# Secondi di attesa quando un altro processo sta scrivendo nella cache
+LOCK_TIMEOUT = 30.0
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS results ("
+    " key TEXT PRIMARY KEY, data BLOB NOT NULL, records INTEGER NOT NULL,"
+    " size INTEGER NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)",
+    "CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)",
+    # Dimensione totale dei risultati tenuta aggiornata dai trigger: put()
+    # non deve sommare tutta la tabella per decidere se eliminare
+    "CREATE TRIGGER IF NOT EXISTS results_insert AFTER INSERT ON results BEGIN"
+    " UPDATE stats SET value = value + NEW.size WHERE name = 'bytes'; END",
+    "CREATE TRIGGER IF NOT EXISTS results_update AFTER UPDATE OF size ON results BEGIN"
+    " UPDATE stats SET value = value + NEW.size - OLD.size WHERE name = 'bytes'; END",
+    "CREATE TRIGGER IF NOT EXISTS results_delete AFTER DELETE ON results BEGIN"
+    " UPDATE stats SET value = value - OLD.size WHERE name = 'bytes'; END",
+)
+
+_COUNTERS = ('hits', 'misses', 'stores', 'evictions')
+
+# Un'istanza per processo per ogni cache usata nei processi di un pool
+_shared: Dict[Tuple, "ResultCache"] = {}
+
+
+def cache_key(content, output_options: Dict) -> str:
+    """
+    Chiave di un risultato: SHA-256 del contenuto del file .fit più le
+    opzioni che cambiano l'output (vedi ConversionOptions.output_options)
+    """
+    digest = hashlib.sha256(content).hexdigest()
+    options = json.dumps(output_options, sort_keys=True, separators=(',', ':'))
+    return f"{digest}:{CACHE_FORMAT}:{options}"
+
+
+class ResultCache:
+    """
+    Cache su file SQLite, condivisibile tra processi
+
+    Ogni risultato ricorda l'ultimo accesso: quando la dimensione totale
+    supera max_size vengono eliminati i risultati usati meno di recente, e
+    quelli non usati da più di max_age secondi non vengono più restituiti.
+    Hit, miss, salvataggi ed eliminazioni sono contati nel file stesso,
+    quindi le statistiche comprendono tutti i processi e le esecuzioni.
+
+    Gli errori di SQLite (es. disco pieno) non interrompono la conversione:
+    la cache si comporta come se il risultato non ci fosse.
+
+    Args:
+        path: File SQLite (creato se non esiste)
+        max_size: Byte massimi dei risultati salvati
+        max_age: Secondi dopo l'ultimo accesso oltre cui un risultato
+            scade (None = nessun limite)
+    """
+
+    def __init__(self, path, max_size: int = DEFAULT_CACHE_SIZE, max_age: Optional[float] = None):
+        if max_size <= 0:
+            raise ValueError("la dimensione massima della cache deve essere positiva")
+        if max_age is not None and max_age <= 0:
+            raise ValueError("la durata massima della cache deve essere positiva")
+        self.path = Path(path)
+        self.max_size = max_size
+        self.max_age = max_age
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(self.path), timeout=LOCK_TIMEOUT, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        with self._transaction():
+            for statement in _SCHEMA:
+                self._db.execute(statement)
+            self._db.executemany("INSERT OR IGNORE INTO stats (name, value) VALUES (?, 0)",
+                                 [(name,) for name in _COUNTERS])
+            # Le cache create prima dei trigger partono dalla somma attuale
+            self._db.execute("INSERT OR IGNORE INTO stats (name, value) "
+                             "SELECT 'bytes', COALESCE(SUM(size), 0) FROM results")
+
+    @classmethod
+    def shared(cls, path, max_size: int = DEFAULT_CACHE_SIZE,
+               max_age: Optional[float] = None) -> "ResultCache":
+        """Istanza unica per processo (es. nei processi del pool di conversione)"""
+        key = (str(path), max_size, max_age)
+        cache = _shared.get(key)
+        if cache is None:
+            cache = _shared[key] = cls(path, max_size, max_age)
+        return cache
+
+    def config(self) -> Dict:
+        """Argomenti per riaprire la cache in un altro processo (vedi shared)"""
+        return {'path': str(self.path), 'max_size': self.max_size, 'max_age': self.max_age}
+
+    @contextmanager
+    def _transaction(self):
+        """
+        Transazione in scrittura (BEGIN IMMEDIATE): i processi che usano la
+        stessa cache si mettono in coda invece di fallire a metà transazione
+        """
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        self._db.execute("COMMIT")
+
+    def get(self, key: str) -> Optional[Tuple[bytes, int]]:
+        """Risultato salvato (dati, numero di record) oppure None"""
+        now = time.time()
+        try:
+            with self._transaction():
+                row = self._db.execute("SELECT data, records, accessed FROM results WHERE key = ?",
+                                       (key,)).fetchone()
+                if row is not None and self.max_age is not None and row[2] < now - self.max_age:
+                    self._db.execute("DELETE FROM results WHERE key = ?", (key,))
+                    self._count('evictions')
+                    row = None
+                if row is None:
+                    self._count('misses')
+                    return None
+                self._db.execute("UPDATE results SET accessed = ? WHERE key = ?", (now, key))
+                self._count('hits')
+                return bytes(row[0]), row[1]
+        except sqlite3.Error:
+            return None
+
+    def put(self, key: str, data: bytes, records: int):
+        """Salva un risultato ed elimina i più vecchi se si supera max_size"""
+        if len(data) > self.max_size:
+            return
+        now = time.time()
+        try:
+            with self._transaction():
+                # Un upsert invece di INSERT OR REPLACE: la sostituzione
+                # implicita non attiva il trigger di eliminazione
+                self._db.execute("INSERT INTO results "
+                                 "(key, data, records, size, created, accessed) "
+                                 "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (key) DO UPDATE SET "
+                                 "data = excluded.data, records = excluded.records, "
+                                 "size = excluded.size, created = excluded.created, "
+                                 "accessed = excluded.accessed",
+                                 (key, data, records, len(data), now, now))
+                self._count('stores')
+                self._evict(now)
+        except sqlite3.Error:
+            pass
+
+    def evict(self):
+        """Applica subito i limiti di dimensione ed età"""
+        with self._transaction():
+            self._evict(time.time())
+
+    def _evict(self, now: float):
+        evicted = 0
+        if self.max_age is not None:
+            evicted += self._db.execute("DELETE FROM results WHERE accessed < ?",
+                                        (now - self.max_age,)).rowcount
+
+        excess = self._total_size() - self.max_size
+        if excess > 0:
+            victims = []
+            for key, size in self._db.execute("SELECT key, size FROM results ORDER BY accessed"):
+                victims.append((key,))
+                excess -= size
+                if excess <= 0:
+                    break
+            self._db.executemany("DELETE FROM results WHERE key = ?", victims)
+            evicted += len(victims)
+
+        if evicted:
+            self._count('evictions', evicted)
+
+    def _total_size(self) -> int:
+        return self._db.execute("SELECT value FROM stats WHERE name = 'bytes'").fetchone()[0]
+
+    def _count(self, name: str, amount: int = 1):
+        self._db.execute("UPDATE stats SET value = value + ? WHERE name = ?", (amount, name))
+
+    def stats(self) -> Dict:
+        """Contatori cumulativi e occupazione attuale della cache"""
+        counters = dict(self._db.execute("SELECT name, value FROM stats"))
+        entries = self._db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        lookups = counters.get('hits', 0) + counters.get('misses', 0)
+        stats = {name: counters.get(name, 0) for name in _COUNTERS}
+        stats.update({
+            'hit_rate': round(stats['hits'] / lookups, 4) if lookups else None,
+            'entries': entries,
+            'bytes': counters.get('bytes', 0),
+            'max_size': self.max_size,
+            'max_age': self.max_age,
+        })
+        return stats
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self) -> "ResultCache":
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
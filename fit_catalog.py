@@ -0,0 +1,326 @@
+"""
+Catalogo delle attività
+Durante la conversione il riepilogo di ogni file (sessione, lap e
+dispositivo) viene salvato in un database SQLite indicizzato, così trovare
+le attività di un anno, di uno sport o di un dispositivo, o i file
+duplicati, è una query di pochi millisecondi invece di una nuova lettura
+di migliaia di file
+"""
+
+import time
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Messaggi letti per il catalogo, oltre a quelli dell'output
+CATALOG_MESSAGES = frozenset(('file_id', 'session', 'lap'))
+
+# Da incrementare quando cambia lo schema: un catalogo di un'altra versione
+# viene ricreato (i dati si ricostruiscono con una nuova conversione)
+CATALOG_FORMAT = 1
+
+# Attività accumulate prima di scriverle in un'unica transazione
+CATALOG_BATCH = 500
+
+# Secondi di attesa quando un altro processo sta scrivendo nel catalogo
+LOCK_TIMEOUT = 30.0
+
+# Colonne delle attività: (colonna, messaggio, campi FIT in ordine di preferenza)
+ACTIVITY_COLUMNS = (
+    ('start_time', 'session', ('start_time',)),
+    ('sport', 'session', ('sport',)),
+    ('sub_sport', 'session', ('sub_sport',)),
+    ('total_distance', 'session', ('total_distance',)),
+    ('total_elapsed_time', 'session', ('total_elapsed_time',)),
+    ('total_timer_time', 'session', ('total_timer_time',)),
+    ('total_ascent', 'session', ('total_ascent',)),
+    ('total_calories', 'session', ('total_calories',)),
+    ('avg_speed', 'session', ('enhanced_avg_speed', 'avg_speed')),
+    ('max_speed', 'session', ('enhanced_max_speed', 'max_speed')),
+    ('avg_heart_rate', 'session', ('avg_heart_rate',)),
+    ('max_heart_rate', 'session', ('max_heart_rate',)),
+    ('avg_power', 'session', ('avg_power',)),
+    ('max_power', 'session', ('max_power',)),
+    ('manufacturer', 'file_id', ('manufacturer',)),
+    ('product', 'file_id', ('garmin_product', 'product')),
+    ('serial_number', 'file_id', ('serial_number',)),
+    ('time_created', 'file_id', ('time_created',)),
+)
+
+LAP_COLUMNS = ('start_time', 'total_distance', 'total_elapsed_time', 'total_timer_time',
+               'avg_speed', 'avg_heart_rate', 'max_heart_rate', 'avg_power', 'max_power')
+
+# Colonne delle attività fuori dai messaggi FIT
+_FILE_COLUMNS = ('path', 'name', 'size', 'mtime', 'output', 'records', 'converted')
+
+_COLUMNS = _FILE_COLUMNS + tuple(column for column, _, _ in ACTIVITY_COLUMNS)
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS activities (id INTEGER PRIMARY KEY, "
+    "path TEXT NOT NULL UNIQUE, name TEXT NOT NULL, size INTEGER, mtime REAL, output TEXT, "
+    "records INTEGER, converted REAL, start_time TEXT, sport TEXT, sub_sport TEXT, "
+    "total_distance REAL, total_elapsed_time REAL, total_timer_time REAL, total_ascent REAL, "
+    "total_calories REAL, avg_speed REAL, max_speed REAL, avg_heart_rate REAL, "
+    "max_heart_rate REAL, avg_power REAL, max_power REAL, manufacturer TEXT, product TEXT, "
+    "serial_number INTEGER, time_created TEXT)",
+    "CREATE INDEX IF NOT EXISTS activities_start ON activities (start_time)",
+    "CREATE INDEX IF NOT EXISTS activities_sport ON activities (sport, start_time)",
+    "CREATE INDEX IF NOT EXISTS activities_device ON activities (serial_number, start_time)",
+    "CREATE INDEX IF NOT EXISTS activities_distance ON activities (total_distance)",
+    "CREATE TABLE IF NOT EXISTS laps (activity_id INTEGER NOT NULL "
+    "REFERENCES activities (id) ON DELETE CASCADE, number INTEGER NOT NULL, "
+    "start_time TEXT, total_distance REAL, total_elapsed_time REAL, total_timer_time REAL, "
+    "avg_speed REAL, avg_heart_rate REAL, max_heart_rate REAL, avg_power REAL, max_power REAL, "
+    "PRIMARY KEY (activity_id, number))",
+)
+
+# Variabili al massimo per istruzione (limite delle versioni meno recenti di SQLite)
+_MAX_VARIABLES = 900
+
+
+def _value(value):
+    """Valore FIT come valore SQLite: date nel formato del file .txt, array come testo"""
+    if value is None or isinstance(value, (int, float, str)):
+        return value
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    return str(value)
+
+
+class ActivitySummary:
+    """
+    Riepilogo di un file per il catalogo, raccolto dai messaggi della
+    conversione stessa (vedi fit_core): file_id, la prima sessione e i lap
+
+    Contiene solo tipi semplici, quindi passa dai processi del pool al
+    processo principale.
+    """
+
+    __slots__ = ('file_id', 'session', 'laps')
+
+    def __init__(self):
+        self.file_id: Optional[Dict] = None
+        self.session: Optional[Dict] = None
+        self.laps: List[Dict] = []
+
+    def add(self, name: str, fields: List[Tuple[str, object]]):
+        """Registra un messaggio di fit_stream.decode (gli altri vengono ignorati)"""
+        if name == 'lap':
+            self.laps.append(dict(fields))
+        elif name == 'session':
+            # Le attività multisport hanno più sessioni: conta la prima
+            if self.session is None:
+                self.session = dict(fields)
+        elif name == 'file_id' and self.file_id is None:
+            self.file_id = dict(fields)
+
+    def consume(self, messages: Iterable):
+        """Registra tutti i messaggi (da usare come consume di fit_stream.decode)"""
+        for name, fields in messages:
+            self.add(name, fields)
+        return self
+
+    def activity_values(self) -> List:
+        """Valori delle colonne di ACTIVITY_COLUMNS"""
+        sources = {'session': self.session or {}, 'file_id': self.file_id or {}}
+        values = []
+        for column, message, names in ACTIVITY_COLUMNS:
+            fields = sources[message]
+            value = next((fields[name] for name in names if fields.get(name) is not None), None)
+            values.append(_value(value))
+        # Senza sessione (file interrotti) la data viene dal primo lap o dal file
+        if values[0] is None:
+            fallback = (self.laps[0].get('start_time') if self.laps else None) \
+                or sources['file_id'].get('time_created')
+            values[0] = _value(fallback)
+        return values
+
+    def lap_values(self) -> List[List]:
+        """Valori delle colonne di LAP_COLUMNS per ogni lap"""
+        rows = []
+        for lap in self.laps:
+            if lap.get('avg_speed') is None and lap.get('enhanced_avg_speed') is not None:
+                lap = dict(lap, avg_speed=lap['enhanced_avg_speed'])
+            rows.append([_value(lap.get(column)) for column in LAP_COLUMNS])
+        return rows
+
+
+class ActivityCatalog:
+    """
+    Catalogo SQLite delle attività convertite, una riga per file .fit
+
+    add() accumula le attività e le scrive a gruppi di CATALOG_BATCH con
+    executemany in un'unica transazione; flush() (o close()) scrive le
+    rimanenti. Un file riconvertito sostituisce la propria riga e i propri
+    lap. Le attività si cercano con find() e duplicates().
+
+    Args:
+        path: File SQLite (creato se non esiste)
+        readonly: Apre il catalogo solo in lettura (es. per le query)
+    """
+
+    def __init__(self, path, readonly: bool = False):
+        self.path = Path(path)
+        self.readonly = readonly
+        self._pending: List[Tuple[List, List[List]]] = []
+        if readonly:
+            if not self.path.is_file():
+                raise FileNotFoundError(f"catalogo non trovato: {self.path}")
+            self._db = sqlite3.connect(f"{self.path.resolve().as_uri()}?mode=ro", uri=True,
+                                       timeout=LOCK_TIMEOUT, isolation_level=None)
+        else:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(str(self.path), timeout=LOCK_TIMEOUT,
+                                       isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute("PRAGMA foreign_keys=ON")
+            with self._transaction():
+                if self._db.execute("PRAGMA user_version").fetchone()[0] != CATALOG_FORMAT:
+                    self._db.execute("DROP TABLE IF EXISTS laps")
+                    self._db.execute("DROP TABLE IF EXISTS activities")
+                    self._db.execute(f"PRAGMA user_version = {CATALOG_FORMAT}")
+                for statement in _SCHEMA:
+                    self._db.execute(statement)
+        self._db.row_factory = sqlite3.Row
+
+    @contextmanager
+    def _transaction(self):
+        """Transazione in scrittura (BEGIN IMMEDIATE, vedi fit_cache.ResultCache)"""
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        self._db.execute("COMMIT")
+
+    def add(self, fit_file: Path, summary: ActivitySummary, records: int = 0,
+            output: Optional[str] = None):
+        """
+        Aggiunge (o aggiorna) l'attività di un file convertito
+
+        Args:
+            output: Nome o path del file di output
+        """
+        fit_file = Path(fit_file)
+        try:
+            stat = fit_file.stat()
+            size, mtime = stat.st_size, stat.st_mtime
+        except OSError:
+            size = mtime = None
+        row = [str(fit_file.resolve()), fit_file.name, size, mtime,
+               str(output) if output is not None else None, records, time.time()]
+        row.extend(summary.activity_values())
+        self._pending.append((row, summary.lap_values()))
+        if len(self._pending) >= CATALOG_BATCH:
+            self.flush()
+
+    def flush(self):
+        """Scrive le attività accumulate in un'unica transazione"""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+        columns = ", ".join(_COLUMNS)
+        updates = ", ".join(f"{column} = excluded.{column}" for column in _COLUMNS[1:])
+        with self._transaction():
+            self._db.executemany(
+                f"INSERT INTO activities ({columns}) VALUES ({', '.join('?' * len(_COLUMNS))}) "
+                f"ON CONFLICT (path) DO UPDATE SET {updates}",
+                [row for row, _ in pending])
+
+            # I lap si sostituiscono tutti: prima gli id delle attività scritte
+            ids = {}
+            paths = [row[0] for row, _ in pending]
+            for start in range(0, len(paths), _MAX_VARIABLES):
+                chunk = paths[start:start + _MAX_VARIABLES]
+                ids.update((path, activity_id) for activity_id, path in self._db.execute(
+                    f"SELECT id, path FROM activities WHERE path IN ({', '.join('?' * len(chunk))})",
+                    chunk))
+            self._db.executemany("DELETE FROM laps WHERE activity_id = ?",
+                                 [(activity_id,) for activity_id in ids.values()])
+            self._db.executemany(
+                f"INSERT INTO laps (activity_id, number, {', '.join(LAP_COLUMNS)}) "
+                f"VALUES ({', '.join('?' * (len(LAP_COLUMNS) + 2))})",
+                [[ids[row[0]], number] + lap
+                 for row, laps in pending for number, lap in enumerate(laps, 1)])
+
+    def find(self, since: Optional[str] = None, until: Optional[str] = None,
+             sport: Optional[str] = None, device: Optional[int] = None,
+             min_distance: Optional[float] = None, max_distance: Optional[float] = None,
+             limit: Optional[int] = None, laps: bool = False) -> List[Dict]:
+        """
+        Attività in ordine di data di inizio
+
+        Args:
+            since, until: Data di inizio minima (inclusa) e massima (esclusa),
+                nel formato 'AAAA-MM-GG HH:MM:SS' o un suo prefisso
+            sport: Sport (es. 'cycling', 'running'), senza distinzione tra
+                maiuscole e minuscole
+            device: Numero di serie del dispositivo
+            min_distance, max_distance: Distanza in metri
+            laps: Aggiunge a ogni attività l'elenco dei lap
+        """
+        conditions, params = [], []
+        for condition, value in (("start_time >= ?", since), ("start_time < ?", until),
+                                 ("sport = ? COLLATE NOCASE", sport),
+                                 ("serial_number = ?", device),
+                                 ("total_distance >= ?", min_distance),
+                                 ("total_distance <= ?", max_distance)):
+            if value is not None:
+                conditions.append(condition)
+                params.append(value)
+        query = "SELECT * FROM activities"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY start_time, path"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        activities = [dict(row) for row in self._db.execute(query, params)]
+        if laps:
+            self._add_laps(activities)
+        return activities
+
+    def _add_laps(self, activities: List[Dict]):
+        by_id = {activity['id']: activity for activity in activities}
+        for activity in activities:
+            activity['laps'] = []
+        ids = list(by_id)
+        for start in range(0, len(ids), _MAX_VARIABLES):
+            chunk = ids[start:start + _MAX_VARIABLES]
+            for row in self._db.execute(
+                    f"SELECT * FROM laps WHERE activity_id IN ({', '.join('?' * len(chunk))}) "
+                    f"ORDER BY activity_id, number", chunk):
+                lap = dict(row)
+                by_id[lap.pop('activity_id')]['laps'].append(lap)
+
+    def duplicates(self) -> List[List[Dict]]:
+        """
+        Gruppi di file con la stessa attività: stesso dispositivo (numero di
+        serie) e stessa data di inizio, es. la stessa uscita esportata o
+        sincronizzata più volte
+        """
+        groups: Dict[Tuple, List[Dict]] = {}
+        for row in self._db.execute(
+                "SELECT a.* FROM activities a JOIN ("
+                " SELECT serial_number, start_time FROM activities"
+                " WHERE start_time IS NOT NULL"
+                " GROUP BY serial_number, start_time HAVING COUNT(*) > 1) d"
+                " ON a.start_time = d.start_time AND a.serial_number IS d.serial_number"
+                " ORDER BY a.start_time, a.serial_number, a.path"):
+            groups.setdefault((row['serial_number'], row['start_time']), []).append(dict(row))
+        return list(groups.values())
+
+    def close(self):
+        if not self.readonly:
+            self.flush()
+        self._db.close()
+
+    def __enter__(self) -> "ActivityCatalog":
+        return self
+
+    def __exit__(self, *_):
+        self.close()
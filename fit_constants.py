@@ -0,0 +1,29 @@
+"""
+Costanti condivise dai moduli del convertitore
+Modulo senza dipendenze, così la riga di comando può validare le opzioni
+senza importare fitparse
+"""
+
+# Motori di decodifica disponibili (vedi fit_stream.decode)
+ENGINES = ('fitparse', 'fast')
+
+# Messaggi decodificati di default: gli unici usati dal file .txt
+DEFAULT_MESSAGES = frozenset(('session', 'lap', 'record'))
+
+# Gestione dei file danneggiati (vedi fit_decoder.FastFitDecoder)
+RECOVERY_MODES = ('fail', 'partial', 'resync')
+
+# Campi mostrati per ogni record campione nel file .txt
+SUMMARY_FIELDS = frozenset(('timestamp', 'position_lat', 'position_long', 'altitude',
+                            'heart_rate', 'power', 'cadence', 'speed', 'distance'))
+
+# Messaggi sempre decodificati perché definiscono i developer field
+DEVELOPER_MESSAGES = frozenset(('developer_data_id', 'field_description'))
+
+# Servizio HTTP (fit_server): secondi massimi per richiesta, attesa nel pool
+# compresa, e dimensione massima del file .fit ricevuto
+SERVER_TIMEOUT = 30.0
+SERVER_MAX_BODY = 64 * 1024 * 1024
+
+# Dimensione massima di default della cache dei risultati (fit_cache)
+DEFAULT_CACHE_SIZE = 1024 * 1024 * 1024
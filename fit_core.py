@@ -0,0 +1,812 @@
+"""
+Motore di conversione condiviso da GUI e riga di comando
+Decodifica un file .fit, ne ricava il riepilogo (o le colonne dei record)
+e lo scrive su una destinazione: cartella, file o stream
+"""
+
+import io
+import sys
+import json
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from itertools import chain, islice
+from pathlib import Path
+from typing import IO, TYPE_CHECKING, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from fit_analytics import AnalyticsSettings
+from fit_catalog import CATALOG_MESSAGES, ActivitySummary
+from fit_constants import DEFAULT_MESSAGES, ENGINES, RECOVERY_MODES, SUMMARY_FIELDS
+from fit_export import (EXPORT_FORMATS, RecordColumns, collect_records, estimate_capacity,
+                        write_columns)
+from fit_input import INPUT_MODES, FitSource, Source, source_path, source_size
+from fit_limits import FileLimits
+from fit_merge import MergedActivity
+from fit_metrics import FileMetrics
+from fit_sampling import SamplingSettings
+from fit_sink import DirectorySink, OutputSink
+
+if TYPE_CHECKING:
+    import threading
+
+    from fit_cache import ResultCache
+    from fit_catalog import ActivityCatalog
+
+# Destinazione dell'output: cartella esistente (il nome del file viene dal
+# file .fit), path del file di output, destinazione di fit_sink oppure
+# stream già aperto
+Sink = Union[str, Path, IO, OutputSink]
+
+# Sezioni del file .txt, compilate una volta sola
+_HEADER = ("=== Conversione file FIT: {name} ===\n"
+           "Data conversione: {date}\n"
+           + "=" * 60 + "\n\n"
+           "INFORMAZIONI SESSIONE\n"
+           + "-" * 30 + "\n")
+_LAPS = "\n\nDATI LAP\n" + "-" * 30 + "\n"
+_LAP = "\nLap {}:\n"
+_RECORDS = ("\n\nPUNTI DATI REGISTRATI\n"
+            + "-" * 30 + "\n"
+            "Totale punti: {count}\n\n"
+            "Campi disponibili: {fields}\n\n")
+_HEAD = "Primi 10 record:\n"
+_SAMPLE = "Campione: {description}, {count} record:\n"
+_OMITTED = "\n... [record intermedi omessi] ...\n\nUltimi 10 record:\n"
+_MERGED = "(attività unita dai file: {})\n\n"
+_ISSUES = ("\n\nATTENZIONE: file danneggiato, decodifica parziale\n"
+           + "-" * 30 + "\n")
+
+# File affidati al pool per ogni processo: abbastanza da non lasciare
+# processi fermi, pochi rispetto a un archivio di milioni di file
+PARALLEL_WINDOW = 4
+
+# Secondi tra due controlli della richiesta di annullamento mentre si
+# attende il risultato di un processo (vedi convert_parallel)
+CANCEL_POLL = 0.1
+
+
+def check_dependencies(install: bool = True) -> bool:
+    """
+    Verifica che fitparse sia installato, senza importarlo
+
+    Args:
+        install: Se True e fitparse manca, prova a installarlo con pip
+
+    Returns:
+        True se fitparse è disponibile
+    """
+    from importlib.util import find_spec
+
+    if find_spec('fitparse') is not None:
+        return True
+    if not install:
+        return False
+
+    print("Installazione di fitparse in corso...")
+    import subprocess
+    subprocess.check_call([sys.executable, "-m", "pip", "install", "fitparse", "--break-system-packages"])
+    return find_spec('fitparse') is not None
+
+
+class ConversionOptions:
+    """
+    Opzioni di conversione, validate alla creazione
+
+    Args:
+        output_format: 'txt' per il riepilogo testuale oppure uno dei
+            formati colonnari di fit_export.EXPORT_FORMATS
+        engine: 'fitparse' oppure 'fast' (decoder interno, con fitparse
+            come ripiego per i file che non gestisce)
+        messages: Messaggi da decodificare, tra session, lap e record
+            (default: tutti e tre); gli altri vengono saltati senza
+            essere decodificati
+        input_mode: 'mmap' (default) oppure 'bulk', una sola lettura
+            con read-ahead, più adatta ai filesystem di rete
+        analytics: Se indicato, calcola le statistiche dell'attività (vedi
+            fit_analytics): sezione in più nel .txt, colonne derivate nei
+            formati colonnari; accetta anche il dizionario di to_dict()
+        on_error: Gestione dei file danneggiati (fit_constants.RECOVERY_MODES):
+            'fail' (default) scarta il file, 'partial' converte i messaggi
+            letti fino al punto danneggiato, 'resync' riprende la lettura
+            dopo il punto danneggiato (solo con engine='fast'); i punti
+            danneggiati vengono riportati nell'output
+        limits: Limiti per file (fit_limits.FileLimits o il suo to_dict())
+        catalog: Se True, raccoglie nello stesso passaggio il riepilogo per
+            il catalogo delle attività (ConversionResult.summary, vedi
+            fit_catalog); i messaggi in più non cambiano l'output
+        sampling: Campionamento dei record (fit_sampling.SamplingSettings
+            o il suo to_dict()) al posto dei primi e ultimi 10 del .txt;
+            nei formati colonnari vengono scritte solo le righe scelte
+    """
+
+    def __init__(self, output_format: str = 'txt', engine: str = 'fitparse',
+                 messages: Optional[Iterable[str]] = None, input_mode: str = 'mmap',
+                 analytics: Optional[Union[AnalyticsSettings, Dict]] = None,
+                 on_error: str = 'fail', limits: Optional[Union[FileLimits, Dict]] = None,
+                 catalog: bool = False,
+                 sampling: Optional[Union[SamplingSettings, Dict]] = None):
+        if output_format != 'txt' and output_format not in EXPORT_FORMATS:
+            raise ValueError(f"Formato non supportato: {output_format}")
+        if engine not in ENGINES:
+            raise ValueError(f"Motore non supportato: {engine}")
+        if input_mode not in INPUT_MODES:
+            raise ValueError(f"Modalità di input non supportata: {input_mode}")
+        messages = frozenset(messages) if messages is not None else DEFAULT_MESSAGES
+        unknown = messages - DEFAULT_MESSAGES
+        if unknown or not messages:
+            raise ValueError(f"Messaggi non supportati: {', '.join(sorted(unknown)) or 'nessuno'} "
+                             f"(validi: {', '.join(sorted(DEFAULT_MESSAGES))})")
+        if on_error not in RECOVERY_MODES:
+            raise ValueError(f"Gestione degli errori non supportata: {on_error}")
+        if on_error == 'resync' and engine != 'fast':
+            raise ValueError("la ripresa dopo i punti danneggiati (resync) richiede il motore 'fast'")
+        if isinstance(analytics, dict):
+            analytics = AnalyticsSettings(**analytics)
+        if isinstance(limits, dict):
+            limits = FileLimits(**limits)
+        if isinstance(sampling, dict):
+            sampling = SamplingSettings(**sampling)
+        self.output_format = output_format
+        self.engine = engine
+        self.messages = messages
+        self.input_mode = input_mode
+        self.analytics = analytics
+        self.on_error = on_error
+        self.limits = limits
+        self.catalog = catalog
+        self.sampling = sampling
+
+    def output_name(self, fit_file: Path) -> str:
+        """Nome del file di output per un file .fit"""
+        if self.output_format == 'txt':
+            return f"{fit_file.stem}.txt"
+        return fit_file.stem + EXPORT_FORMATS[self.output_format]
+
+    def output_options(self) -> Dict:
+        """Opzioni che influenzano il contenuto dei file di output"""
+        options = {'format': self.output_format, 'messages': sorted(self.messages)}
+        if self.analytics is not None:
+            options['analytics'] = self.analytics.to_dict()
+        if self.on_error != 'fail':
+            options['on_error'] = self.on_error
+        if self.sampling is not None:
+            options['sampling'] = self.sampling.to_dict()
+        return options
+
+    def to_dict(self) -> Dict:
+        """Argomenti per ricreare le opzioni (es. nei processi di un pool)"""
+        return {'output_format': self.output_format, 'engine': self.engine,
+                'messages': sorted(self.messages), 'input_mode': self.input_mode,
+                'analytics': self.analytics.to_dict() if self.analytics is not None else None,
+                'on_error': self.on_error,
+                'limits': self.limits.to_dict() if self.limits is not None else None,
+                'catalog': self.catalog,
+                'sampling': self.sampling.to_dict() if self.sampling is not None else None}
+
+
+class ConversionResult:
+    """
+    Esito della conversione di un file
+
+    Attributes:
+        source: Nome del file .fit
+        ok: True se l'output è stato scritto
+        output: Path del file scritto, o nome nell'archivio (None per gli
+            stream o in caso di errore)
+        error: Messaggio di errore
+        records: Numero di messaggi 'record' nel file
+        metrics: Tempi per fase e contatori (vedi fit_metrics.FileMetrics)
+        cached: True se il risultato viene dalla cache, senza decodifica
+        issues: Punti danneggiati del file convertito parzialmente
+            (dizionari con offset, error e skipped, vedi fit_decoder)
+        error_type: Tipo dell'errore (nome dell'eccezione)
+        summary: Riepilogo per il catalogo, con ConversionOptions.catalog
+            (fit_catalog.ActivitySummary)
+    """
+
+    __slots__ = ('source', 'ok', 'output', 'error', 'records', 'metrics', 'cached', 'issues',
+                 'error_type', 'summary')
+
+    def __init__(self, source: str, ok: bool, output: Optional[Path] = None,
+                 error: Optional[str] = None, records: int = 0,
+                 metrics: Optional[FileMetrics] = None, cached: bool = False,
+                 issues: Optional[List[Dict]] = None, error_type: Optional[str] = None):
+        self.source = source
+        self.ok = ok
+        self.output = output
+        self.error = error
+        self.records = records
+        self.metrics = metrics
+        self.cached = cached
+        self.issues = issues or []
+        self.error_type = error_type
+        self.summary: Optional[ActivitySummary] = None
+
+    def __repr__(self):
+        detail = self.output if self.ok else self.error
+        return f"ConversionResult({self.source!r}, ok={self.ok}, {detail!r})"
+
+
+def format_report(fit_name: str, session_data: Dict, lap_data: List[Dict], records,
+                  converted_at: Optional[datetime] = None,
+                  issues: Optional[List[Dict]] = None) -> str:
+    """
+    Testo del riepilogo .txt, costruito in un solo buffer
+
+    Args:
+        fit_name: Nome del file .fit mostrato nell'intestazione
+        session_data, lap_data, records: Risultato di fit_stream.summarize_fields
+        converted_at: Data di conversione (default: adesso)
+        issues: Punti danneggiati, per i file convertiti parzialmente
+    """
+    return (_format_header(fit_name, converted_at)
+            + _format_body(session_data, lap_data, records, issues))
+
+
+def _format_header(fit_name: str, converted_at: Optional[datetime] = None) -> str:
+    converted_at = converted_at or datetime.now()
+    return _HEADER.format(name=fit_name, date=converted_at.strftime('%Y-%m-%d %H:%M:%S'))
+
+
+def _format_body(session_data: Dict, lap_data: List[Dict], records,
+                 issues: Optional[List[Dict]] = None) -> str:
+    """Riepilogo senza intestazione: dipende solo dal contenuto del file (vedi fit_cache)"""
+    parts = []
+
+    # Informazioni sessione
+    parts.extend(f"{key}: {value}\n" for key, value in session_data.items())
+
+    # Dati lap
+    if lap_data:
+        parts.append(_LAPS)
+        for i, lap in enumerate(lap_data, 1):
+            parts.append(_LAP.format(i))
+            parts.extend(f"  {key}: {value}\n" for key, value in lap.items())
+
+    # Record (punti dati): primi e ultimi record come esempio, oppure il campione scelto
+    if records:
+        parts.append(_RECORDS.format(count=len(records), fields=", ".join(records.fields)))
+        if records.sampler is not None:
+            parts.append(_SAMPLE.format(description=records.sampler.description,
+                                        count=len(records.samples)))
+            parts.extend(f"  #{index + 1}" + _format_record(record)
+                         for index, record in records.samples)
+        else:
+            parts.append(_HEAD)
+            parts.extend(_format_record(record) for record in records.head)
+            if records.has_tail:
+                parts.append(_OMITTED)
+                parts.extend(_format_record(record) for record in records.tail)
+
+    # Punti danneggiati: il riepilogo sopra è incompleto
+    if issues:
+        parts.append(_ISSUES)
+        parts.extend(_format_issue(issue) for issue in issues)
+
+    return "".join(parts)
+
+
+def _format_issue(issue: Dict) -> str:
+    # Con fitparse i byte saltati non sono noti
+    skipped = f" ({issue['skipped']} byte saltati)" if issue['skipped'] is not None else ""
+    # Nelle attività unite (fit_merge) ogni punto indica il suo file
+    where = f"{issue['file']}, " if issue.get('file') else ""
+    return f"  {where}offset {issue['offset']}: {issue['error']}{skipped}\n"
+
+
+def _format_record(record: Dict) -> str:
+    return "  " + " | ".join([f"{key}={value}" for key, value in record.items()
+                              if key in SUMMARY_FIELDS]) + "\n"
+
+
+def convert(source: Source, sink: Sink, options: Optional[ConversionOptions] = None,
+            name: Optional[str] = None, metrics: Optional[FileMetrics] = None,
+            cache: Optional["ResultCache"] = None,
+            output_name: Optional[str] = None) -> ConversionResult:
+    """
+    Converte un file .fit
+
+    Gli errori di conversione non vengono sollevati ma riportati nel
+    risultato, così ogni front end decide come mostrarli.
+
+    Args:
+        source: Path al file .fit, contenuto in memoria o file-like
+            (vedi fit_input.FitSource), oppure un gruppo di file della stessa
+            attività da unire (fit_merge.MergedActivity)
+        sink: Cartella esistente, path del file di output, destinazione di
+            fit_sink (cartella con compressione o archivio) oppure stream
+            aperto (testuale o binario) su cui scrivere; i file vengono
+            sempre scritti in modo atomico
+        options: Opzioni di conversione (default: riepilogo .txt con fitparse)
+        name: Nome del file .fit quando source non è un path
+        metrics: Raccoglie tempi per fase e contatori (opzionale)
+        cache: Cache dei risultati (fit_cache.ResultCache), consultata prima
+            della decodifica; il file viene letto una volta sola anche per
+            calcolarne l'hash
+        output_name: Nome dell'output nella destinazione, già assegnato con
+            OutputSink.name() (default: assegnato qui)
+    """
+    options = options or ConversionOptions()
+    fit_path = source_path(source, name)
+    if metrics is None:
+        metrics = FileMetrics(str(fit_path), track_messages=False)
+    result = ConversionResult(fit_path.name, False, metrics=metrics)
+
+    limits = options.limits or FileLimits()
+    try:
+        metrics.bytes_in = source_size(source)
+        limits.check_size(metrics.bytes_in)
+        target = (sink, output_name)
+        with limits.enforce():
+            if cache is not None:
+                _convert_cached(source, target, options, fit_path, metrics, result, cache)
+            elif options.output_format == 'txt':
+                _convert_txt(source, target, options, fit_path, metrics, result)
+            else:
+                _convert_columns(source, target, options, fit_path, metrics, result)
+        result.ok = True
+    except Exception as e:
+        result.error = str(e)
+        result.error_type = type(e).__name__
+
+    metrics.issues = result.issues
+    metrics.error_type = result.error_type
+    metrics.finish(result.ok, result.error)
+    return result
+
+
+@contextmanager
+def _open_output(target: Tuple[Sink, Optional[str]], options: ConversionOptions,
+                 fit_path: Path, metrics: FileMetrics, result: ConversionResult):
+    """
+    Stream su cui scrivere l'output: binario per cartelle, file e archivi
+    (vedi fit_sink), lo stream stesso quando sink è uno stream
+    """
+    sink, output_name = target
+    if isinstance(sink, (str, Path)):
+        sink = Path(sink)
+        if sink.is_dir():
+            sink = DirectorySink(sink)
+        else:
+            sink, output_name = DirectorySink(sink.parent), sink.name
+    if not isinstance(sink, OutputSink):
+        yield sink
+        return
+
+    output_name = output_name or sink.name(fit_path, options.output_name(fit_path))
+    if sink.aggregate:
+        buffer = io.BytesIO()
+        yield buffer
+        data = buffer.getvalue()
+        sink.add(output_name, data, fit_path, result.records)
+        result.output = Path(output_name)
+        metrics.bytes_out = len(data)
+    else:
+        with sink.open(output_name) as f:
+            yield f
+        result.output = sink.path(output_name)
+        metrics.bytes_out = result.output.stat().st_size
+    metrics.output = output_name
+
+
+def _write(out: IO, data: Union[str, bytes]):
+    """Scrive testo o bytes su uno stream testuale o binario (testo in UTF-8)"""
+    if isinstance(out, io.TextIOBase):
+        out.write(data if isinstance(data, str) else data.decode('utf-8'))
+    else:
+        out.write(data.encode('utf-8') if isinstance(data, str) else data)
+
+
+def _convert_txt(source: Source, target: Tuple[Sink, Optional[str]], options: ConversionOptions,
+                 fit_path: Path, metrics: FileMetrics, result: ConversionResult):
+    body = _summarize(source, options, metrics, result)
+
+    with metrics.stage('format'):
+        text = _header(source, fit_path) + body
+
+    with metrics.stage('write'), _open_output(target, options, fit_path, metrics, result) as out:
+        _write(out, text)
+
+
+def _header(source: Source, fit_path: Path) -> str:
+    """Intestazione del .txt, con l'elenco dei file per le attività unite"""
+    header = _format_header(fit_path.name)
+    if isinstance(source, MergedActivity):
+        header += _MERGED.format(", ".join(path.name for path in source.paths))
+    return header
+
+
+def _decode(source: Source, consume, options: ConversionOptions, names,
+            result: ConversionResult):
+    """fit_stream.decode, oppure l'unione in ordine di tempo dei file di una MergedActivity"""
+    if isinstance(source, MergedActivity):
+        return source.decode(consume, options.engine, names, options.input_mode,
+                             options.on_error, result.issues)
+
+    from fit_stream import decode
+
+    return decode(source, consume, options.engine, names, options.input_mode,
+                  options.on_error, result.issues)
+
+
+def _summarize(source: Source, options: ConversionOptions, metrics: FileMetrics,
+               result: ConversionResult) -> str:
+    from fit_stream import summarize_fields
+
+    # Un solo passaggio sul file: dei record si tiene solo un campione, più
+    # le colonne complete se servono le statistiche e il riepilogo per il
+    # catalogo. Tutto viene ricreato se la decodifica riparte (vedi decode)
+    columns = None
+
+    def consume(messages):
+        nonlocal columns
+        messages = metrics.track(messages)
+        if options.catalog:
+            result.summary = ActivitySummary()
+            messages = _cataloging(messages, result.summary, options.messages)
+        if options.analytics:
+            columns = RecordColumns(estimate_capacity(source))
+            messages = _collecting(messages, columns)
+        sampler = options.sampling.sampler() if options.sampling is not None else None
+        return summarize_fields(messages, sampler)
+
+    names = options.messages | CATALOG_MESSAGES if options.catalog else options.messages
+    with metrics.stage('decode'):
+        session_data, lap_data, records = _decode(source, consume, options, names, result)
+    result.records = records.count
+    if result.issues and not (session_data or lap_data or records):
+        _unreadable(result.issues)
+
+    stats = None
+    if columns is not None:
+        from fit_analytics import analyze
+
+        columns.trim()
+
+        with metrics.stage('analyze'):
+            stats = analyze(columns, options.analytics)
+
+    with metrics.stage('format'):
+        body = _format_body(session_data, lap_data, records, result.issues)
+        if stats is not None:
+            from fit_analytics import format_analytics
+
+            body += format_analytics(stats)
+        return body
+
+
+def _collecting(messages: Iterable, columns: RecordColumns) -> Iterator:
+    """Passa i messaggi invariati, raccogliendo intanto i 'record' in columns"""
+    for name, fields in messages:
+        if name == 'record':
+            columns.append(fields)
+        yield name, fields
+
+
+def _sampling(messages: Iterable, sampler) -> Iterator:
+    """Passa i messaggi invariati, dando intanto i 'record' al campionatore"""
+    for name, fields in messages:
+        if name == 'record':
+            sampler.add(fields)
+        yield name, fields
+
+
+def _cataloging(messages: Iterable, summary: ActivitySummary, names) -> Iterator:
+    """Registra i messaggi in summary, passando oltre solo quelli in names"""
+    for message in messages:
+        summary.add(*message)
+        if message[0] in names:
+            yield message
+
+
+def _convert_columns(source: Source, target: Tuple[Sink, Optional[str]],
+                     options: ConversionOptions, fit_path: Path, metrics: FileMetrics,
+                     result: ConversionResult):
+    columns = _collect_columns(source, options, metrics, result)
+
+    with metrics.stage('write'), _open_output(target, options, fit_path, metrics, result) as out:
+        write_columns(columns, out, options.output_format)
+
+
+def _collect_columns(source: Source, options: ConversionOptions, metrics: FileMetrics,
+                     result: ConversionResult):
+    capacity = estimate_capacity(source)
+    sampler = None
+
+    def consume(messages):
+        nonlocal sampler
+        messages = metrics.track(messages)
+        if options.catalog:
+            result.summary = ActivitySummary()
+            messages = _cataloging(messages, result.summary, {'record'})
+        if options.sampling is not None:
+            sampler = options.sampling.sampler()
+            messages = _sampling(messages, sampler)
+        return collect_records(messages, capacity)
+
+    # L'esportazione colonnare usa solo i record, il resto viene saltato
+    names = {'record'} | CATALOG_MESSAGES if options.catalog else {'record'}
+    with metrics.stage('decode'):
+        columns = _decode(source, consume, options, names, result)
+    result.records = columns.count
+    if result.issues:
+        if not columns.count:
+            _unreadable(result.issues)
+        columns.metadata['fit_decode_issues'] = json.dumps(result.issues)
+
+    if options.analytics is not None:
+        from fit_analytics import analyze
+
+        with metrics.stage('analyze'):
+            stats = analyze(columns, options.analytics, derived=True)
+            columns.metadata['fit_analytics'] = json.dumps(stats)
+
+    # Statistiche e colonne derivate sono calcolate su tutti i record, poi
+    # restano solo le righe del campione
+    if sampler is not None:
+        columns.select(sampler.indices())
+        columns.metadata['fit_sampling'] = json.dumps({
+            'description': sampler.description, 'records': sampler.count,
+            'samples': columns.count})
+    return columns
+
+
+def _unreadable(issues: List[Dict]):
+    """Nessun messaggio leggibile prima del primo punto danneggiato: il file non è convertibile"""
+    from fit_decoder import FitCorrupt
+
+    raise FitCorrupt(f"file danneggiato all'offset {issues[0]['offset']}: {issues[0]['error']}")
+
+
+def _convert_cached(source: Source, target: Tuple[Sink, Optional[str]],
+                    options: ConversionOptions, fit_path: Path, metrics: FileMetrics,
+                    result: ConversionResult, cache: "ResultCache"):
+    """
+    Conversione che passa dalla cache dei risultati
+
+    Per il .txt viene salvato il riepilogo senza intestazione, che viene
+    ricreata con il nome del file e la data di ogni conversione; per i
+    formati colonnari il file di output così com'è. La chiave di
+    un'attività unita (fit_merge) è calcolata dal contenuto di tutti i suoi
+    file.
+    """
+    from fit_cache import cache_key
+
+    # Il contenuto viene letto una volta: lo stesso buffer serve per l'hash
+    # e per la decodifica (anche per i file-like non riposizionabili)
+    merged = isinstance(source, MergedActivity)
+    with (nullcontext() if merged else FitSource(source, options.input_mode)) as fit_source:
+        content = source if merged else fit_source.buffer
+        with metrics.stage('decode'):
+            key = cache_key(source.digest(options.input_mode) if merged else content,
+                            options.output_options())
+            hit = cache.get(key)
+        metrics.cache = 'hit' if hit is not None else 'miss'
+
+        if hit is not None:
+            data, result.records = hit
+            result.cached = True
+            if options.catalog:
+                # Il riepilogo non è in cache: si leggono solo i messaggi del catalogo
+                with metrics.stage('decode'):
+                    result.summary = _decode(
+                        content, lambda messages: ActivitySummary().consume(messages),
+                        options, CATALOG_MESSAGES, result)
+        elif options.output_format == 'txt':
+            data = _summarize(content, options, metrics, result).encode('utf-8')
+        else:
+            columns = _collect_columns(content, options, metrics, result)
+            with metrics.stage('format'):
+                output = io.BytesIO()
+                write_columns(columns, output, options.output_format)
+                data = output.getvalue()
+
+    # I risultati parziali non vanno in cache: il file viene riletto ogni volta
+    if hit is None and not result.issues:
+        with metrics.stage('write'):
+            cache.put(key, data, result.records)
+
+    if options.output_format == 'txt':
+        with metrics.stage('format'):
+            data = _header(source, fit_path) + data.decode('utf-8')
+
+    with metrics.stage('write'), _open_output(target, options, fit_path, metrics, result) as out:
+        _write(out, data)
+
+
+def convert_parallel(fit_files: Iterable[Path], output: Union[Path, OutputSink],
+                     options: ConversionOptions, jobs: int, collect_metrics: bool = False,
+                     cache: Optional["ResultCache"] = None,
+                     catalog: Optional["ActivityCatalog"] = None,
+                     cancel: Optional["threading.Event"] = None
+                     ) -> Iterator[Tuple[Path, bool, str, Optional[Dict]]]:
+    """
+    Converte i file in un pool di processi
+
+    fit_files può essere un iteratore (es. fit_discovery.discover): i file
+    vengono letti man mano e al pool ne vengono affidati al massimo
+    PARALLEL_WINDOW per processo, così la conversione inizia subito e la
+    memoria non cresce con il numero di file.
+
+    Se un worker termina in modo anomalo (es. crash dentro il parser) il
+    file coinvolto viene riprovato in un processo isolato e il pool viene
+    ricreato per i file rimanenti, così un solo file non blocca il batch.
+    Se il chiamante smette di iterare (o chiude il generatore), i file non
+    ancora avviati vengono annullati e si attendono solo quelli in corso.
+    Con una cache, ogni processo apre la propria connessione allo stesso file.
+
+    I nomi di output vengono assegnati qui, nell'ordine dei file. Con un
+    archivio (ArchiveSink) i processi restituiscono il risultato e solo il
+    processo principale lo scrive; nelle cartelle scrive ogni processo.
+    Allo stesso modo il catalogo delle attività viene aggiornato solo dal
+    processo principale, con i riepiloghi restituiti dai processi.
+
+    Args:
+        output: Cartella di output oppure destinazione di fit_sink
+        catalog: Catalogo delle attività (fit_catalog.ActivityCatalog) in
+            cui registrare i file convertiti
+        cancel: Evento impostato da un altro thread (es. il pulsante Annulla
+            della GUI) per interrompere la conversione: i file non ancora
+            avviati vengono annullati subito, senza attendere il prossimo
+            risultato, e il generatore termina
+
+    Yields:
+        Tuple (file .fit, successo, nome dell'output o messaggio di errore,
+        metriche del file se richieste o se il file non è stato convertito
+        del tutto) nello stesso ordine di fit_files
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    from concurrent.futures.process import BrokenProcessPool
+
+    sink = output if isinstance(output, OutputSink) else DirectorySink(output)
+    queue = iter(fit_files)
+    window = jobs * PARALLEL_WINDOW
+    if catalog is not None and not options.catalog:
+        options = ConversionOptions(**dict(options.to_dict(), catalog=True))
+    task_options = options.to_dict()
+    sink_config = None if sink.aggregate else sink.config()
+    cache_config = cache.config() if cache is not None else None
+
+    def task(fit_file: Path) -> Tuple:
+        # Il nome resta lo stesso se il file viene riprovato dopo un crash
+        name = sink.name(fit_file, options.output_name(fit_file))
+        return task_options, fit_file, sink_config, name, collect_metrics, cache_config
+
+    def finish(fit_file: Path, result: Tuple) -> Tuple[Path, bool, str, Optional[Dict]]:
+        ok, detail, metrics, payload, entry = result
+        if payload is not None:
+            data, records = payload
+            sink.add(detail, data, fit_file, records)
+        if catalog is not None and entry is not None:
+            summary, records = entry
+            catalog.add(fit_file, summary, records,
+                        detail if sink.aggregate else str(sink.path(detail)))
+        return fit_file, ok, detail, metrics
+
+    while True:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            def submit(fit_file: Path):
+                return fit_file, pool.submit(_convert_worker, *task(fit_file))
+
+            inflight = deque(submit(fit_file) for fit_file in islice(queue, window))
+            try:
+                while inflight:
+                    fit_file, future = inflight.popleft()
+                    try:
+                        result = _wait(future, cancel)
+                    except BrokenProcessPool:
+                        result = _convert_isolated(*task(fit_file))
+                        # I file già affidati al pool interrotto ripartono nel nuovo pool
+                        queue = chain([pending for pending, _ in inflight], queue)
+                        yield finish(fit_file, result)
+                        break
+                    if result is None:
+                        # Annullata: anche questo file, se non è ancora partito
+                        inflight.appendleft((fit_file, future))
+                        return
+
+                    yield finish(fit_file, result)
+                    for next_file in islice(queue, 1):
+                        try:
+                            inflight.append(submit(next_file))
+                        except BrokenProcessPool:
+                            # Il crash emergerà dal risultato di un file già inviato
+                            queue = chain([next_file], queue)
+                else:
+                    return
+            finally:
+                for _, future in inflight:
+                    future.cancel()
+
+
+def _wait(future, cancel: Optional["threading.Event"]) -> Optional[Tuple]:
+    """Risultato di un processo del pool, oppure None se cancel viene impostato prima"""
+    from concurrent.futures import TimeoutError as FutureTimeout
+
+    if cancel is None:
+        return future.result()
+    while True:
+        try:
+            return future.result(timeout=CANCEL_POLL)
+        except FutureTimeout:
+            if cancel.is_set():
+                return None
+
+
+def _convert_worker(options: Dict, fit_file: Path, sink_config: Optional[Dict], output_name: str,
+                    collect_metrics: bool = False, cache_config: Optional[Dict] = None
+                    ) -> Tuple[bool, str, Optional[Dict], Optional[Tuple[bytes, int]],
+                               Optional[Tuple[ActivitySummary, int]]]:
+    """
+    Converte un file dentro un processo del pool (nessun output a video)
+
+    Scrive nella cartella descritta da sink_config (DirectorySink.config);
+    con sink_config None restituisce invece l'output (dati, numero di
+    record) perché il processo principale lo aggiunga all'archivio.
+    Con options['catalog'] restituisce anche il riepilogo per il catalogo
+    (riepilogo, numero di record) dei file convertiti.
+    Le metriche vengono restituite anche senza collect_metrics per i file
+    non convertiti o convertiti in parte: tipo di errore e punti danneggiati
+    servono al processo principale (quarantena, riepilogo).
+    """
+    metrics = FileMetrics(str(fit_file), track_messages=collect_metrics)
+    payload = entry = None
+    try:
+        conversion_options = ConversionOptions(**options)
+        cache = shared_cache(cache_config)
+        if sink_config is None:
+            buffer = io.BytesIO()
+            result = convert(fit_file, buffer, conversion_options, metrics=metrics, cache=cache)
+            if result.ok:
+                payload = buffer.getvalue(), result.records
+                metrics.output, metrics.bytes_out = output_name, len(payload[0])
+        else:
+            result = convert(fit_file, DirectorySink(**sink_config), conversion_options,
+                             metrics=metrics, cache=cache, output_name=output_name)
+        ok, detail = result.ok, output_name if result.ok else result.error
+        if result.ok and result.summary is not None:
+            entry = result.summary, result.records
+    except Exception as e:
+        ok, detail = False, str(e)
+        metrics.error_type = type(e).__name__
+        metrics.finish(ok, detail)
+    report = collect_metrics or not ok or metrics.issues
+    return ok, detail, metrics.to_dict() if report else None, payload, entry
+
+
+def _convert_isolated(options: Dict, fit_file: Path, sink_config: Optional[Dict],
+                      output_name: str, collect_metrics: bool = False,
+                      cache_config: Optional[Dict] = None
+                      ) -> Tuple[bool, str, Optional[Dict], Optional[Tuple[bytes, int]],
+                                 Optional[Tuple[ActivitySummary, int]]]:
+    """Riprova un file in un processo dedicato dopo un crash del pool"""
+    from concurrent.futures import ProcessPoolExecutor
+    from concurrent.futures.process import BrokenProcessPool
+
+    try:
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            return pool.submit(_convert_worker, options, fit_file, sink_config, output_name,
+                               collect_metrics, cache_config).result()
+    except BrokenProcessPool:
+        detail = "processo di conversione terminato in modo anomalo"
+        file_metrics = FileMetrics(str(fit_file))
+        file_metrics.error_type = BrokenProcessPool.__name__
+        file_metrics.finish(False, detail)
+        return False, detail, file_metrics.to_dict(), None, None
+
+
+def shared_cache(config: Optional[Dict]) -> Optional["ResultCache"]:
+    """
+    Cache dei risultati del processo corrente, aperta alla prima richiesta
+
+    Se la cache non si può aprire (es. cartella non scrivibile) la
+    conversione procede senza.
+    """
+    if config is None:
+        return None
+    from fit_cache import ResultCache
+
+    try:
+        return ResultCache.shared(**config)
+    except Exception:
+        return None
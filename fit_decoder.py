@@ -0,0 +1,635 @@
+"""
+Decoder FIT veloce
+Legge direttamente header, messaggi di definizione e timestamp compressi
+senza passare dal modello a oggetti di fitparse (un DataMessage e un
+FieldData per ogni valore). Ogni definizione viene compilata una sola volta
+in un struct.Struct e i messaggi dati vengono decodificati con un solo
+unpack_from ciascuno.
+
+Nomi dei campi, scale, offset, enum, componenti e subfield vengono presi dal
+profilo di fitparse, quindi i valori prodotti sono gli stessi di fitparse
+(con il processore di default). Differenze note:
+- il CRC del file non viene verificato
+- tutto ciò che il decoder non gestisce solleva FastPathUnsupported, e il
+  chiamante deve rileggere il file con fitparse (vedi fit_stream.decode)
+
+Con recovery='partial' o 'resync' un file danneggiato non interrompe la
+lettura: i messaggi decodificati fino al punto danneggiato restano validi
+e con 'resync' la lettura riprende dal primo punto in cui i byte tornano a
+formare messaggi plausibili (vedi FastFitDecoder). Una definizione che
+nessun file valido può contenere (dimensione di un campo non multipla del
+tipo, developer field o tipo base non definiti) solleva FitCorrupt: è un
+punto danneggiato, non una funzione non gestita.
+"""
+
+import struct
+from operator import itemgetter
+from datetime import datetime, time, timedelta
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from fitparse.profile import FIELD_TYPE_TIMESTAMP, MESSAGE_TYPES
+from fitparse.records import BASE_TYPES, BASE_TYPE_BYTE
+
+from fit_constants import DEFAULT_MESSAGES, DEVELOPER_MESSAGES, RECOVERY_MODES
+
+TIMESTAMP_DEF_NUM = FIELD_TYPE_TIMESTAMP.def_num
+
+# I timestamp FIT sono secondi dal 31/12/1989 00:00 UTC
+FIT_EPOCH = datetime(1989, 12, 31)
+
+# Valori "non validi" dei tipi base, come in fitparse.records.BASE_TYPES
+_INVALID = {
+    0x00: 0xFF, 0x01: 0x7F, 0x02: 0xFF, 0x83: 0x7FFF, 0x84: 0xFFFF,
+    0x85: 0x7FFFFFFF, 0x86: 0xFFFFFFFF, 0x0A: 0, 0x8B: 0, 0x8C: 0,
+    0x8E: 0x7FFFFFFFFFFFFFFF, 0x8F: 0xFFFFFFFFFFFFFFFF, 0x90: 0,
+}
+
+# Tipi di campo con un processore in fitparse.processors.FitFileDataProcessor
+_PROCESSED_TYPES = frozenset(('bool', 'date_time', 'local_date_time', 'localtime_into_day'))
+
+# Tipi di specifica di campo
+_SIMPLE = 0    # valore scalare senza componenti né subfield
+_GENERIC = 1   # tutto il resto (array, stringhe, componenti, subfield, developer)
+
+
+# Messaggi consecutivi che devono risultare plausibili per riprendere la
+# lettura dopo un punto danneggiato
+RESYNC_MESSAGES = 4
+
+# Errori di basso livello di un messaggio letto da byte non validi
+DECODE_ERRORS = (struct.error, IndexError, KeyError, TypeError, ValueError)
+
+_by_name = itemgetter(0)
+
+
+class FastPathUnsupported(Exception):
+    """Il file contiene qualcosa che il decoder veloce non gestisce"""
+
+
+class FitCorrupt(FastPathUnsupported):
+    """Il file è danneggiato (troncato o con byte non validi)"""
+
+
+def _process_type(type_name: Optional[str], value):
+    """Replica i processori di tipo di fitparse (FitFileDataProcessor)"""
+    if value is None or type_name is None:
+        return value
+    if type_name == 'date_time':
+        if value >= 0x10000000:
+            return FIT_EPOCH + timedelta(seconds=value)
+        return value
+    if type_name == 'local_date_time':
+        return FIT_EPOCH + timedelta(seconds=value)
+    if type_name == 'bool':
+        return bool(value)
+    if type_name == 'localtime_into_day':
+        m, s = divmod(value, 60)
+        h, m = divmod(m, 60)
+        return time(h, m, s)
+    return value
+
+
+def _apply_scale_offset(field, value):
+    if isinstance(value, tuple):
+        return tuple(_apply_scale_offset(field, v) for v in value)
+    if isinstance(value, (int, float)):
+        if field.scale:
+            value = float(value) / field.scale
+        if field.offset:
+            value = value - field.offset
+    return value
+
+
+def _apply_compressed_accumulation(raw_value: int, accumulation: int, num_bits: int) -> int:
+    max_value = 1 << num_bits
+    max_mask = max_value - 1
+    base_value = raw_value + (accumulation & ~max_mask)
+    if raw_value < (accumulation & max_mask):
+        base_value += max_value
+    return base_value
+
+
+class _FieldSpec:
+    """Specifica precompilata di un campo all'interno di una definizione"""
+
+    __slots__ = ('kind', 'def_num', 'start', 'count', 'base_type', 'field', 'name',
+                 'invalid', 'scale', 'offset', 'values', 'type_name')
+
+    def __init__(self, kind, def_num, start, count, base_type, field, name):
+        self.kind = kind
+        self.def_num = def_num
+        self.start = start
+        self.count = count
+        self.base_type = base_type
+        self.field = field
+        self.name = name
+        self.invalid = _INVALID.get(base_type.identifier)
+        self.scale = field.scale if field else None
+        self.offset = field.offset if field else None
+        self.values = field.type.values if field and not field.is_base_type else None
+        type_name = field.type.name if field else None
+        self.type_name = type_name if type_name in _PROCESSED_TYPES else None
+
+
+class _Definition:
+    """Definizione di messaggio compilata"""
+
+    __slots__ = ('name', 'mesg_num', 'mesg_type', 'size', 'struct', 'fields', 'decode',
+                 'num_regular', 'has_subfields', 'timestamp_index', 'timestamp_invalid')
+
+    def __init__(self, mesg_num: int, endian: str, field_defs: List[Tuple[int, int, int]],
+                 dev_field_defs: List[Tuple[int, int, int]], dev_types: Dict, decode_names: Set[str],
+                 accumulators: Dict):
+        self.mesg_num = mesg_num
+        self.mesg_type = MESSAGE_TYPES.get(mesg_num)
+        self.name = self.mesg_type.name if self.mesg_type else f'unknown_{mesg_num}'
+        self.decode = self.name in decode_names
+        self.timestamp_index = None
+        self.timestamp_invalid = None
+
+        fmt = [endian]
+        fields = []
+        index = 0
+        for def_num, size, base_type_num in field_defs:
+            base_type = BASE_TYPES.get(base_type_num, BASE_TYPE_BYTE)
+            field = self.mesg_type.fields.get(def_num) if self.mesg_type else None
+            spec, piece, items = self._compile(def_num, size, base_type, field, index,
+                                               field.name if field else f'unknown_{def_num}')
+            if field and field.components:
+                # Come fitparse: gli accumulatori ripartono da zero a ogni definizione
+                for component in field.components:
+                    if component.accumulate:
+                        accumulators.setdefault(mesg_num, {})[component.def_num] = 0
+            fields.append(spec)
+            fmt.append(piece)
+            index += items
+
+        self.num_regular = len(fields)
+        self.has_subfields = any(
+            spec.field.subfields or any(self.mesg_type.fields[c.def_num].subfields
+                                        for c in (spec.field.components or ()))
+            for spec in fields if spec.field is not None)
+
+        for def_num, size, dev_data_index in dev_field_defs:
+            try:
+                field = dev_types[dev_data_index][def_num]
+            except KeyError:
+                raise FitCorrupt(
+                    f"developer field {def_num} non definito per l'indice {dev_data_index}")
+            spec, piece, items = self._compile(def_num, size, field.type, field, index, field.name)
+            spec.kind = _GENERIC
+            fields.append(spec)
+            fmt.append(piece)
+            index += items
+
+        self.fields = fields
+        self.struct = struct.Struct(''.join(fmt))
+        self.size = self.struct.size
+
+        for spec in fields:
+            if spec.def_num == TIMESTAMP_DEF_NUM and spec.kind == _SIMPLE:
+                self.timestamp_index = spec.start
+                self.timestamp_invalid = spec.invalid
+                break
+        else:
+            if any(spec.def_num == TIMESTAMP_DEF_NUM for spec in fields):
+                # Timestamp in un formato insolito: meglio lasciar fare a fitparse
+                raise FastPathUnsupported("campo timestamp non scalare")
+
+    @staticmethod
+    def _compile(def_num, size, base_type, field, index, name):
+        type_size = struct.calcsize(base_type.fmt)
+        if size == 0 or size % type_size:
+            # Non valida nemmeno per fitparse: byte danneggiati
+            raise FitCorrupt(f"dimensione {size} non valida per il campo {name}")
+        count = size // type_size
+
+        if base_type.fmt == 's':
+            piece, items = f'{size}s', 1
+        else:
+            piece, items = f'{count}{base_type.fmt}', count
+
+        simple = (count == 1 and base_type.fmt != 's' and base_type is not BASE_TYPE_BYTE
+                  and not (field and (field.components or field.subfields)))
+        spec = _FieldSpec(_SIMPLE if simple else _GENERIC, def_num, index, count,
+                          base_type, field, name)
+        return spec, piece, items
+
+
+class FastFitDecoder:
+    """
+    Decoder per un singolo file (o buffer) FIT
+
+    Args:
+        data: Contenuto del file (qualsiasi oggetto che supporti il buffer protocol)
+        names: Nomi dei messaggi da decodificare; gli altri vengono saltati
+            usando la lunghezza della loro definizione
+        recovery: 'fail' (default) solleva un'eccezione al primo errore;
+            'partial' si ferma al punto danneggiato; 'resync' salta i byte
+            danneggiati fino a RESYNC_MESSAGES messaggi plausibili di fila
+        issues: Lista in cui annotare i punti danneggiati (offset, errore,
+            byte saltati) quando recovery non è 'fail'
+    """
+
+    def __init__(self, data: bytes, names: Optional[Set[str]] = None,
+                 recovery: str = 'fail', issues: Optional[List[Dict]] = None):
+        if recovery not in RECOVERY_MODES:
+            raise ValueError(f"Modalità di recupero non supportata: {recovery}")
+        self.data = data
+        self.names = set(names or DEFAULT_MESSAGES) | DEVELOPER_MESSAGES
+        self.recovery = recovery
+        self.issues = issues if issues is not None else []
+
+    def messages(self) -> Iterator[Tuple[str, List[Tuple[str, object]]]]:
+        """
+        Yields:
+            Tuple (nome messaggio, lista di coppie (campo, valore)) nell'ordine
+            in cui fitparse produrrebbe i FieldData, senza i valori None
+        """
+        data = self.data
+        pos = 0
+        end_of_file = len(data)
+        if end_of_file < 12:
+            # Anche un file vuoto è danneggiato, come per fitparse
+            raise FitCorrupt(f"header FIT non valido: file di {end_of_file} byte")
+
+        try:
+            while pos < end_of_file:
+                try:
+                    pos, data_end = self._parse_header(pos)
+                except FitCorrupt as e:
+                    # Byte in coda dopo un file valido: ci si ferma lì
+                    if pos == 0 or self.recovery == 'fail':
+                        raise
+                    self._issue(pos, e, end_of_file - pos)
+                    return
+                yield from self._parse_chunk(pos, data_end)
+                if self._missing:
+                    # Troncato esattamente tra un messaggio e l'altro
+                    self._issue(data_end, self._truncated(), 0)
+                    return
+                if self._stopped:
+                    return
+                pos = data_end + 2  # CRC del file (non verificato)
+        except DECODE_ERRORS as e:
+            raise FastPathUnsupported(str(e)) from e
+
+    # True quando la lettura si è fermata a un punto danneggiato
+    _stopped = False
+    # Byte mancanti di un file troncato letto in modalità partial o resync
+    _missing = 0
+
+    def _parse_header(self, pos: int) -> Tuple[int, int]:
+        data = self.data
+        if len(data) - pos < 12 or data[pos + 8:pos + 12] != b'.FIT':
+            raise FitCorrupt("header FIT non valido")
+        header_size, _, _, data_size = struct.unpack_from('<2BHI', data, pos)
+        if header_size < 12 or 12 < header_size < 14:
+            raise FitCorrupt("dimensione header non valida")
+        start = pos + header_size
+        if start + data_size + 2 > len(data):
+            if self.recovery == 'fail' or start > len(data):
+                raise FitCorrupt("file troncato")
+            # Si legge quello che c'è, fino all'ultimo messaggio completo
+            self._missing = start + data_size + 2 - len(data)
+            return start, len(data)
+        return start, start + data_size
+
+    def _truncated(self) -> FitCorrupt:
+        error = FitCorrupt(f"file troncato: {self._missing} byte mancanti")
+        self._missing = 0
+        return error
+
+    def _issue(self, offset: int, error: Exception, skipped: int):
+        self.issues.append({'offset': offset, 'error': str(error) or type(error).__name__,
+                            'skipped': skipped})
+
+    def _recover(self, start: int, end: int, error: Exception, sizes: Dict[int, int]) -> int:
+        """
+        Gestisce un messaggio non decodificabile che inizia a start
+
+        Returns:
+            Posizione da cui riprendere, oppure end per fermarsi
+        """
+        if self.recovery == 'fail':
+            raise error
+        if isinstance(error, FastPathUnsupported) and not isinstance(error, FitCorrupt) \
+                and not self.issues:
+            # Nessun danno finora: è una funzione non gestita, non un file rotto
+            raise error
+        if self._missing and isinstance(error, (struct.error, IndexError)):
+            # L'ultimo messaggio è stato tagliato dal troncamento
+            self._issue(start, self._truncated(), end - start)
+            self._stopped = True
+            return end
+        if self.recovery == 'resync':
+            for candidate in range(start + 1, end):
+                if self._plausible(candidate, end, sizes):
+                    self._issue(start, error, candidate - start)
+                    return candidate
+        self._issue(start, error, end - start)
+        self._stopped = True
+        return end
+
+    def _plausible(self, pos: int, end: int, sizes: Dict[int, int]) -> bool:
+        """
+        Verifica, senza decodificare, che da pos inizino RESYNC_MESSAGES
+        messaggi strutturalmente validi (o almeno due che arrivano
+        esattamente a end)
+
+        Args:
+            sizes: Dimensione dei messaggi dati per tipo locale, dalle
+                definizioni lette prima del punto danneggiato
+        """
+        data = self.data
+        sizes = dict(sizes)
+        for count in range(RESYNC_MESSAGES):
+            if pos == end:
+                return count >= 2
+            header = data[pos]
+            if header & 0x80:
+                size = sizes.get((header >> 5) & 0x3)
+            elif header & 0x40:
+                size = self._definition_size(pos, end, sizes)
+                if size is None:
+                    return False
+                pos += size
+                continue
+            elif header & 0x30:
+                return False
+            else:
+                size = sizes.get(header & 0xF)
+            if size is None:
+                return False
+            pos += 1 + size
+            if pos > end:
+                return False
+        return True
+
+    def _definition_size(self, pos: int, end: int, sizes: Dict[int, int]) -> Optional[int]:
+        """Lunghezza di un messaggio di definizione plausibile a pos (None se non lo è)"""
+        data = self.data
+        header = data[pos]
+        if header & 0x10 or pos + 6 > end or data[pos + 1] != 0 or data[pos + 2] > 1:
+            return None
+        endian = '>' if data[pos + 2] else '<'
+        mesg_num = struct.unpack_from(endian + 'H', data, pos + 3)[0]
+        if mesg_num not in MESSAGE_TYPES and mesg_num < 0xFF00:
+            return None
+        num_fields = data[pos + 5]
+        cursor = pos + 6
+        size = 0
+        for _ in range(num_fields):
+            if cursor + 3 > end:
+                return None
+            field_size, base_type_num = data[cursor + 1], data[cursor + 2]
+            base_type = BASE_TYPES.get(base_type_num)
+            if base_type is None or field_size == 0 or field_size % struct.calcsize(base_type.fmt):
+                return None
+            size += field_size
+            cursor += 3
+        if header & 0x20:
+            if cursor >= end:
+                return None
+            num_dev = data[cursor]
+            if cursor + 1 + 3 * num_dev > end:
+                return None
+            size += sum(data[cursor + 1 + 3 * i + 1] for i in range(num_dev))
+            cursor += 1 + 3 * num_dev
+        sizes[header & 0xF] = size
+        return cursor - pos
+
+    def _parse_chunk(self, pos: int, end: int):
+        data = self.data
+        names = self.names
+        definitions: Dict[int, _Definition] = {}
+        accumulators: Dict[int, Dict[int, int]] = {}
+        dev_types: Dict[int, Dict[int, object]] = {}
+        ts_accumulator = 0
+
+        unpack_h = struct.Struct('<H').unpack_from
+        unpack_be_h = struct.Struct('>H').unpack_from
+
+        while pos < end:
+            start = pos
+            try:
+                header = data[pos]
+                pos += 1
+
+                if header & 0x80:
+                    # Header con timestamp compresso
+                    local = (header >> 5) & 0x3
+                    time_offset = header & 0x1F
+                elif header & 0x40:
+                    # Messaggio di definizione
+                    endian = '>' if data[pos + 1] else '<'
+                    mesg_num = (unpack_be_h if endian == '>' else unpack_h)(data, pos + 2)[0]
+                    num_fields = data[pos + 4]
+                    pos += 5
+                    field_defs = [tuple(data[pos + 3 * i:pos + 3 * i + 3]) for i in range(num_fields)]
+                    pos += 3 * num_fields
+
+                    dev_field_defs = []
+                    if header & 0x20:
+                        num_dev = data[pos]
+                        pos += 1
+                        dev_field_defs = [tuple(data[pos + 3 * i:pos + 3 * i + 3]) for i in range(num_dev)]
+                        pos += 3 * num_dev
+
+                    definitions[header & 0xF] = _Definition(
+                        mesg_num, endian, field_defs, dev_field_defs, dev_types, names, accumulators)
+                    continue
+                else:
+                    local = header & 0xF
+                    time_offset = None
+
+                definition = definitions.get(local)
+                if definition is None:
+                    raise FitCorrupt(f"messaggio dati con tipo locale {local} non definito")
+
+                if not definition.decode:
+                    # Messaggio non richiesto: si salta, tenendo solo il timestamp
+                    # che serve a ricostruire i timestamp compressi successivi
+                    if definition.timestamp_index is not None:
+                        raw = definition.struct.unpack_from(data, pos)[definition.timestamp_index]
+                        if raw != definition.timestamp_invalid:
+                            ts_accumulator = raw
+                    if time_offset is not None:
+                        ts_accumulator = _apply_compressed_accumulation(time_offset, ts_accumulator, 5)
+                    pos += definition.size
+                    continue
+
+                raw_values = definition.struct.unpack_from(data, pos)
+                pos += definition.size
+                pairs, unknown, ts_raw = self._decode_fields(definition, raw_values, accumulators)
+                if ts_raw is not None:
+                    ts_accumulator = ts_raw
+
+                if time_offset is not None:
+                    ts_accumulator = _apply_compressed_accumulation(time_offset, ts_accumulator, 5)
+                    value = _process_type('date_time', ts_accumulator)
+                    if value is not None:
+                        pairs.append(('timestamp', value))
+
+                # Stesso ordine di DataMessage.__iter__: prima i campi noti, poi
+                # quelli sconosciuti, ciascun gruppo per nome (ordinamento stabile)
+                pairs.sort(key=_by_name)
+                if unknown:
+                    unknown.sort(key=_by_name)
+                    pairs.extend(unknown)
+
+                if definition.name == 'developer_data_id':
+                    self._add_dev_data_id(dev_types, pairs)
+                elif definition.name == 'field_description':
+                    self._add_dev_field_description(dev_types, pairs, definition, raw_values)
+
+                yield definition.name, pairs
+            except DECODE_ERRORS + (FastPathUnsupported,) as e:
+                # Il primo messaggio non decodificabile: ci si ferma o si
+                # riprende dal primo punto plausibile (vedi recovery)
+                sizes = {number: known.size for number, known in definitions.items()}
+                pos = self._recover(start, end, e, sizes)
+
+    @staticmethod
+    def _parsed_value(spec: _FieldSpec, raw_values: tuple):
+        """Valore grezzo di un campo dopo il controllo di validità del tipo base"""
+        base_type = spec.base_type
+        if base_type.fmt == 's':
+            return base_type.parse(raw_values[spec.start])
+        if base_type is BASE_TYPE_BYTE:
+            return base_type.parse(raw_values[spec.start:spec.start + spec.count])
+        if spec.count == 1:
+            return base_type.parse(raw_values[spec.start])
+        return tuple(base_type.parse(v) for v in raw_values[spec.start:spec.start + spec.count])
+
+    def _decode_fields(self, definition: _Definition, raw_values: tuple, accumulators: Dict):
+        pairs = []
+        unknown = []
+        ts_raw = None
+        parsed_cache = None
+
+        for spec in definition.fields:
+            if spec.kind == _SIMPLE:
+                raw = raw_values[spec.start]
+                if raw == spec.invalid or raw != raw:
+                    continue
+                if spec.def_num == TIMESTAMP_DEF_NUM:
+                    ts_raw = raw
+                value = raw
+                if spec.values is not None and raw in spec.values:
+                    value = spec.values[raw]
+                elif spec.scale or spec.offset:
+                    if spec.scale:
+                        value = float(value) / spec.scale
+                    if spec.offset:
+                        value = value - spec.offset
+                if spec.type_name is not None:
+                    value = _process_type(spec.type_name, value)
+                if value is not None:
+                    (pairs if spec.field else unknown).append((spec.name, value))
+                continue
+
+            # Percorso generico: stessa logica di FitFile._parse_data_message
+            raw = self._parsed_value(spec, raw_values)
+            field = spec.field
+
+            if spec.def_num == TIMESTAMP_DEF_NUM and raw is not None:
+                ts_raw = raw
+
+            if field is None:
+                if raw is not None:
+                    unknown.append((spec.name, raw))
+                continue
+
+            if definition.has_subfields and parsed_cache is None:
+                # I subfield dipendono dai valori degli altri campi del messaggio
+                parsed_cache = [self._parsed_value(s, raw_values)
+                                for s in definition.fields[:definition.num_regular]]
+
+            if getattr(field, 'subfields', None):
+                field = self._resolve_subfield(field, definition, parsed_cache)
+
+            if field.components:
+                for component in field.components:
+                    try:
+                        cmp_raw = component.render(raw)
+                    except ValueError:
+                        continue
+                    if component.accumulate and cmp_raw is not None:
+                        accumulator = accumulators[definition.mesg_num]
+                        cmp_raw = _apply_compressed_accumulation(
+                            cmp_raw, accumulator[component.def_num], component.bits)
+                        accumulator[component.def_num] = cmp_raw
+                    cmp_raw = _apply_scale_offset(component, cmp_raw)
+                    cmp_field = definition.mesg_type.fields[component.def_num]
+                    if cmp_field.subfields:
+                        cmp_field = self._resolve_subfield(cmp_field, definition, parsed_cache)
+                    cmp_value = _process_type(cmp_field.type.name, cmp_field.render(cmp_raw))
+                    if cmp_value is not None:
+                        pairs.append((cmp_field.name, cmp_value))
+
+            value = _apply_scale_offset(field, field.render(raw))
+            value = _process_type(field.type.name, value)
+            if value is not None:
+                pairs.append((field.name, value))
+
+        return pairs, unknown, ts_raw
+
+    @staticmethod
+    def _resolve_subfield(field, definition: _Definition, parsed_values: list):
+        if field.subfields:
+            for sub_field in field.subfields:
+                for ref_field in sub_field.ref_fields:
+                    for spec, raw in zip(definition.fields, parsed_values):
+                        if spec.def_num == ref_field.def_num and ref_field.raw_value == raw:
+                            return sub_field
+        return field
+
+    @staticmethod
+    def _add_dev_data_id(dev_types: Dict, pairs: list):
+        values = dict(pairs)
+        index = values.get('developer_data_index')
+        dev_types[index] = {}
+
+    @staticmethod
+    def _add_dev_field_description(dev_types: Dict, pairs: list, definition: _Definition,
+                                   raw_values: tuple):
+        from fitparse.records import DevField
+
+        values = dict(pairs)
+        index = values.get('developer_data_index')
+        def_num = values.get('field_definition_number')
+        base_type_id = values.get('fit_base_type_id')
+        if index not in dev_types:
+            raise FitCorrupt(f"developer_data_index {index} non definito")
+        # fit_base_type_id è un enum: serve il valore grezzo, non il nome
+        for spec in definition.fields:
+            if spec.name == 'fit_base_type_id':
+                base_type_id = raw_values[spec.start]
+        if base_type_id not in BASE_TYPES:
+            raise FitCorrupt(f"tipo base {base_type_id} non valido")
+
+        name = values.get('field_name') or f"unnamed_dev_field_{def_num}"
+        dev_types[index][def_num] = DevField(
+            dev_data_index=index, def_num=def_num, type=BASE_TYPES[base_type_id],
+            name=name, units=values.get('units'), native_field_num=values.get('native_field_num'))
+
+
+def fast_messages(data: bytes, names: Optional[Set[str]] = None, recovery: str = 'fail',
+                  issues: Optional[List[Dict]] = None) -> Iterator[Tuple[str, list]]:
+    """
+    Decodifica un file FIT già in memoria con il decoder veloce
+
+    Args:
+        data: Contenuto del file (bytes, mmap o memoryview, senza copie)
+        names: Messaggi da decodificare (default: session, lap e record)
+        recovery, issues: Gestione dei file danneggiati (vedi FastFitDecoder)
+
+    Yields:
+        Tuple (nome messaggio, lista di coppie (campo, valore)) per i soli
+        messaggi richiesti
+    """
+    names = set(names or DEFAULT_MESSAGES)
+    for name, pairs in FastFitDecoder(data, names, recovery, issues).messages():
+        if name in names:
+            yield name, pairs
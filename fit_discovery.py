@@ -0,0 +1,200 @@
+"""
+Ricerca dei file .fit
+Un solo passaggio con os.scandir sull'albero delle cartelle: l'estensione
+viene confrontata senza distinzione tra maiuscole e minuscole (.fit, .FIT,
+.Fit) e i file vengono restituiti man mano, così la conversione può
+iniziare prima che la ricerca sia finita
+"""
+
+import os
+import re
+import time
+import queue
+import threading
+from datetime import datetime
+from fnmatch import fnmatchcase
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional
+
+FIT_SUFFIX = '.fit'
+
+# Unità accettate da --since per le durate relative (es. 7d, 12h, 30m)
+_SINCE_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 7 * 86400}
+_RELATIVE_SINCE = re.compile(r'^(\d+(?:\.\d+)?)([smhdw])$')
+
+
+def parse_since(value: str, now: Optional[float] = None) -> float:
+    """
+    Interpreta il valore di --since come timestamp Unix
+
+    Args:
+        value: Data o data e ora ISO (2024-05-01, 2024-05-01T18:30) oppure
+            una durata relativa ad adesso (90m, 12h, 7d, 2w)
+    """
+    match = _RELATIVE_SINCE.match(value.strip().lower())
+    if match:
+        amount, unit = match.groups()
+        return (now if now is not None else time.time()) - float(amount) * _SINCE_UNITS[unit]
+    try:
+        return datetime.fromisoformat(value.strip()).timestamp()
+    except ValueError:
+        raise ValueError(f"data non valida: {value} (usa AAAA-MM-GG[THH:MM] o una "
+                         f"durata come 12h, 7d)") from None
+
+
+class _Patterns:
+    """
+    Pattern glob confrontati senza distinzione tra maiuscole e minuscole
+
+    I pattern con '/' si confrontano con il path relativo alla cartella di
+    partenza, gli altri con il solo nome.
+    """
+
+    def __init__(self, patterns: Iterable[str]):
+        self.names: List[str] = []
+        self.paths: List[str] = []
+        for pattern in patterns:
+            pattern = pattern.lower().replace(os.sep, '/').strip('/')
+            (self.paths if '/' in pattern else self.names).append(pattern)
+
+    def __bool__(self):
+        return bool(self.names or self.paths)
+
+    def match(self, name: str, relative: str) -> bool:
+        name = name.lower()
+        if any(fnmatchcase(name, pattern) for pattern in self.names):
+            return True
+        relative = relative.lower()
+        return any(fnmatchcase(relative, pattern) for pattern in self.paths)
+
+
+def discover(root: Path, recursive: bool = False, include: Iterable[str] = (),
+             exclude: Iterable[str] = (), max_depth: Optional[int] = None,
+             since: Optional[float] = None) -> Iterator[Path]:
+    """
+    Restituisce i file .fit sotto root, man mano che vengono trovati
+
+    Ogni cartella viene letta una sola volta; i file di una cartella escono
+    in ordine alfabetico, prima di quelli delle sottocartelle. I link
+    simbolici a cartelle non vengono seguiti (niente cicli).
+
+    Args:
+        root: Cartella da cui partire, oppure un singolo file .fit
+        recursive: Cerca anche nelle sottocartelle
+        include: Pattern glob (es. '2024-*', 'garmin/*.fit'): se indicati,
+            vengono restituiti solo i file che ne soddisfano almeno uno
+        exclude: Pattern glob di file o cartelle da saltare (una cartella
+            esclusa non viene nemmeno letta)
+        max_depth: Livelli di sottocartelle al massimo (0 = solo root);
+            implica recursive
+        since: Solo i file modificati da questo timestamp Unix in poi
+    """
+    root = Path(root)
+    if root.is_file():
+        if root.suffix.lower() == FIT_SUFFIX and (since is None or root.stat().st_mtime >= since):
+            yield root
+        return
+    if not root.is_dir():
+        return
+
+    include = _Patterns(include)
+    exclude = _Patterns(exclude)
+    if max_depth is None:
+        max_depth = -1 if recursive else 0
+
+    # Pila di (cartella, path relativo, profondità): visita in profondità
+    # con i file prima delle sottocartelle
+    stack = [(str(root), '', 0)]
+    while stack:
+        directory, relative, depth = stack.pop()
+        try:
+            with os.scandir(directory) as scan:
+                entries = sorted(scan, key=lambda entry: entry.name)
+        except OSError:
+            # Cartella sparita o non leggibile: si prosegue con le altre
+            continue
+
+        subdirectories = []
+        for entry in entries:
+            name = entry.name
+            entry_relative = f"{relative}/{name}" if relative else name
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if depth != max_depth and not exclude.match(name, entry_relative):
+                        subdirectories.append((entry.path, entry_relative, depth + 1))
+                    continue
+                if not (name[-4:].lower() == FIT_SUFFIX and entry.is_file()):
+                    continue
+                if exclude and exclude.match(name, entry_relative):
+                    continue
+                if include and not include.match(name, entry_relative):
+                    continue
+                if since is not None and entry.stat().st_mtime < since:
+                    continue
+            except OSError:
+                continue
+            yield Path(entry.path)
+
+        stack.extend(reversed(subdirectories))
+
+
+# Fine della ricerca nella coda di Prefetch
+_END = object()
+
+
+class Prefetch:
+    """
+    Ricerca eseguita in un thread, un passo avanti alla conversione
+
+    Si itera come l'iteratore originale (es. discover() con i filtri di
+    fit_manifest e fit_queue.in_shard): la conversione inizia subito e
+    total diventa il numero di file appena la ricerca è finita, così il
+    progresso può mostrare il totale senza attendere l'elenco completo.
+    Gli errori della ricerca vengono sollevati da chi itera.
+
+    Il thread usa l'iteratore da solo: close() lo ferma e lo attende prima
+    che il chiamante torni a usare gli oggetti condivisi (es. il manifest).
+    """
+
+    def __init__(self, files: Iterable[Path]):
+        self.total: Optional[int] = None
+        self._queue: "queue.Queue" = queue.Queue()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(files,),
+                                        name='fit-discovery', daemon=True)
+        self._thread.start()
+
+    def _run(self, files: Iterable[Path]):
+        # Ogni file passa dopo aver cercato il successivo: l'ultimo arriva
+        # quando total è già noto
+        count = 0
+        last = _END
+        try:
+            for path in files:
+                if self._stop.is_set():
+                    return
+                if last is not _END:
+                    self._queue.put(last)
+                last = path
+                count += 1
+            self.total = count
+            if last is not _END:
+                self._queue.put(last)
+        except BaseException as e:
+            self._queue.put(e)
+        finally:
+            self._queue.put(_END)
+
+    def __iter__(self) -> Iterator[Path]:
+        while True:
+            item = self._queue.get()
+            if item is _END:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+
+    def close(self):
+        """Ferma la ricerca (se non è finita) e attende il thread"""
+        self._stop.set()
+        self._thread.join()
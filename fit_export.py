@@ -0,0 +1,390 @@
+"""
+Esportazione colonnare dei messaggi 'record'
+Scrive tutti i punti dati di un file .fit (non solo il campione del .txt)
+come colonne tipizzate in formato CSV/TSV, Parquet o NumPy .npz
+"""
+
+import io
+import csv
+import math
+from array import array
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+# Formati di esportazione supportati -> estensione del file di output
+EXPORT_FORMATS = {
+    'csv': '.csv',
+    'tsv': '.tsv',
+    'parquet': '.parquet',
+    'npz': '.npz',
+}
+
+# Colonne principali, sempre presenti e in quest'ordine; gli altri campi
+# (compresi i developer field) seguono nell'ordine di prima apparizione
+CORE_COLUMNS = {
+    'timestamp': 'time',
+    'position_lat': 'int',
+    'position_long': 'int',
+    'altitude': 'float',
+    'heart_rate': 'int',
+    'power': 'int',
+    'cadence': 'int',
+    'speed': 'float',
+    'distance': 'float',
+}
+
+# Stima dei byte per record usata per la preallocazione iniziale: i file
+# con molti messaggi diversi dai record (hrv, eventi, developer data) la
+# superano di molto, quindi la preallocazione non va oltre MAX_INITIAL_CAPACITY
+# righe e le colonne crescono poi raddoppiando
+BYTES_PER_RECORD_ESTIMATE = 32
+MIN_CAPACITY = 256
+MAX_INITIAL_CAPACITY = 4096
+
+EPOCH = datetime(1970, 1, 1)
+NAN = float('nan')
+
+
+class Column:
+    """
+    Colonna preallocata
+
+    I valori numerici (compresi i timestamp, in secondi epoch UTC) sono
+    tenuti in un array di double con NaN per i valori mancanti; le colonne
+    testuali usano una lista con None.
+    """
+
+    __slots__ = ('name', 'kind', 'values')
+
+    def __init__(self, name: str, kind: str, capacity: int):
+        self.name = name
+        self.kind = kind
+        if kind == 'str':
+            self.values = [None] * capacity
+        else:
+            self.values = array('d', [NAN]) * capacity
+
+    def grow(self, capacity: int):
+        extra = capacity - len(self.values)
+        if self.kind == 'str':
+            self.values.extend([None] * extra)
+        else:
+            self.values.extend(array('d', [NAN]) * extra)
+
+    def to_text(self, capacity: int):
+        """Converte una colonna numerica in testuale (valori eterogenei)"""
+        old = self.values
+        self.kind = 'str'
+        self.values = [None if math.isnan(v) else _format_number(v) for v in old]
+        self.values.extend([None] * (capacity - len(self.values)))
+
+
+class RecordColumns:
+    """Raccoglie i messaggi 'record' in colonne tipizzate"""
+
+    def __init__(self, capacity: int = MIN_CAPACITY):
+        self.capacity = max(capacity, MIN_CAPACITY)
+        self.count = 0
+        self.columns: Dict[str, Column] = {
+            name: Column(name, kind, self.capacity) for name, kind in CORE_COLUMNS.items()
+        }
+        # Metadati del file (es. le statistiche di fit_analytics), scritti
+        # nello schema dei file Parquet
+        self.metadata: Dict[str, str] = {}
+
+    def _ensure_capacity(self):
+        if self.count < self.capacity:
+            return
+        self.capacity = max(2 * self.capacity, MIN_CAPACITY)
+        for column in self.columns.values():
+            column.grow(self.capacity)
+
+    def trim(self):
+        """Libera le righe preallocate e non usate (a raccolta finita)"""
+        self.capacity = self.count
+        for column in self.columns.values():
+            del column.values[self.count:]
+
+    def _column_for(self, name: str, value) -> Column:
+        column = self.columns.get(name)
+        if column is None:
+            column = Column(name, _kind_of(value), self.capacity)
+            self.columns[name] = column
+        return column
+
+    def append(self, fields: Iterable):
+        """
+        Aggiunge una riga a partire dai campi di un messaggio
+
+        Args:
+            fields: Coppie (nome campo, valore); i valori None vengono ignorati
+        """
+        self._ensure_capacity()
+        row = self.count
+        for name, value in fields:
+            if value is None:
+                continue
+            column = self._column_for(name, value)
+            kind = column.kind
+            if kind == 'time' and isinstance(value, datetime):
+                column.values[row] = (value - EPOCH).total_seconds()
+            elif kind == 'str':
+                column.values[row] = value if isinstance(value, str) else str(value)
+            elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                if kind == 'int' and isinstance(value, float) and not value.is_integer():
+                    column.kind = 'float'
+                column.values[row] = value
+            else:
+                column.to_text(self.capacity)
+                column.values[row] = str(value)
+        self.count += 1
+
+    def add_column(self, name: str, kind: str, values):
+        """
+        Aggiunge (o sostituisce) una colonna numerica già calcolata
+
+        Args:
+            kind: 'int', 'float' o 'time'
+            values: Sequenza di float lunga count, NaN per i valori mancanti
+                (es. un array NumPy float64)
+        """
+        column = Column(name, kind, 0)
+        try:
+            view = memoryview(values)
+        except TypeError:
+            view = None
+        if view is not None and view.format == 'd' and view.c_contiguous:
+            # Array di double (es. NumPy float64): copia in blocco
+            column.values.frombytes(view.cast('B'))
+        else:
+            column.values.extend(values)
+        column.grow(self.capacity)
+        self.columns[name] = column
+
+    def select(self, rows: List[int]):
+        """
+        Tiene solo le righe indicate (es. quelle scelte da fit_sampling)
+
+        Args:
+            rows: Posizioni delle righe da tenere, in ordine crescente
+        """
+        self.count = self.capacity = len(rows)
+        for column in self.columns.values():
+            old = column.values
+            if column.kind == 'str':
+                column.values = [old[row] for row in rows]
+            else:
+                column.values = array('d', [old[row] for row in rows])
+
+    def names(self) -> List[str]:
+        return list(self.columns)
+
+    def values(self, name: str):
+        """Valori validi (senza la parte preallocata non usata) di una colonna"""
+        return self.columns[name].values[:self.count]
+
+
+def _kind_of(value) -> str:
+    if isinstance(value, datetime):
+        return 'time'
+    if isinstance(value, bool):
+        return 'str'
+    if isinstance(value, int):
+        return 'int'
+    if isinstance(value, float):
+        return 'float'
+    return 'str'
+
+
+def _format_number(value: float) -> str:
+    if value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def collect_records(messages: Iterable, capacity: Optional[int] = None) -> RecordColumns:
+    """
+    Raccoglie i messaggi 'record' senza costruire un dizionario per riga
+
+    Args:
+        messages: Tuple (nome messaggio, coppie (campo, valore)) come
+            prodotte da fit_stream.decode
+        capacity: Numero di righe da preallocare
+    """
+    columns = RecordColumns(capacity or MIN_CAPACITY)
+    for name, fields in messages:
+        if name == 'record':
+            columns.append(fields)
+    columns.trim()
+    return columns
+
+
+def estimate_capacity(fit_file) -> int:
+    """
+    Righe da preallocare per un file (Path o bytes), stimate dalla sua
+    dimensione ma non oltre MAX_INITIAL_CAPACITY
+    """
+    try:
+        if isinstance(fit_file, (bytes, bytearray, memoryview)):
+            size = len(fit_file)
+        else:
+            size = Path(fit_file).stat().st_size
+    except (OSError, TypeError):
+        return MIN_CAPACITY
+    return min(MAX_INITIAL_CAPACITY, max(MIN_CAPACITY, size // BYTES_PER_RECORD_ESTIMATE))
+
+
+def check_format_dependencies(export_format: str):
+    """Verifica che le librerie opzionali richieste dal formato siano installate"""
+    if export_format == 'npz':
+        _require('numpy')
+    elif export_format == 'parquet':
+        _require('numpy')
+        _require('pyarrow')
+
+
+def _require(module: str):
+    try:
+        __import__(module)
+    except ImportError:
+        raise RuntimeError(
+            f"Il formato richiede il modulo '{module}': pip install {module}") from None
+
+
+@contextmanager
+def _open_target(target, binary: bool):
+    """
+    Apre la destinazione di un writer: un path viene aperto (e chiuso), un
+    oggetto file viene usato così com'è; i file binari ricevono il testo in UTF-8
+    """
+    if isinstance(target, (str, Path)):
+        if binary:
+            with open(target, 'wb') as f:
+                yield f
+        else:
+            with open(target, 'w', encoding='utf-8', newline='') as f:
+                yield f
+    elif binary or isinstance(target, io.TextIOBase):
+        yield target
+    else:
+        wrapper = io.TextIOWrapper(target, encoding='utf-8', newline='')
+        try:
+            yield wrapper
+        finally:
+            wrapper.flush()
+            wrapper.detach()
+
+
+def write_columns(columns: RecordColumns, path, export_format: str):
+    """
+    Scrive le colonne nel formato richiesto
+
+    Args:
+        path: Path del file di output oppure oggetto file già aperto
+            (binario, o testuale per CSV/TSV)
+    """
+    if export_format == 'csv':
+        write_delimited(columns, path, ',')
+    elif export_format == 'tsv':
+        write_delimited(columns, path, '\t')
+    elif export_format == 'npz':
+        write_npz(columns, path)
+    elif export_format == 'parquet':
+        write_parquet(columns, path)
+    else:
+        raise ValueError(f"Formato non supportato: {export_format}")
+
+
+def write_delimited(columns: RecordColumns, path, delimiter: str):
+    """Scrive le colonne come CSV/TSV (celle vuote per i valori mancanti)"""
+    names = columns.names()
+    formatters = [_cell_formatter(columns.columns[name].kind) for name in names]
+    data = [columns.values(name) for name in names]
+
+    with _open_target(path, binary=False) as f:
+        writer = csv.writer(f, delimiter=delimiter, lineterminator='\n')
+        writer.writerow(names)
+        writer.writerows(
+            [fmt(value) for fmt, value in zip(formatters, row)] for row in zip(*data)
+        )
+
+
+def _cell_formatter(kind: str):
+    if kind == 'str':
+        return lambda v: '' if v is None else v
+    if kind == 'time':
+        return lambda v: '' if v != v else (EPOCH + timedelta(seconds=v)).strftime('%Y-%m-%d %H:%M:%S')
+    if kind == 'int':
+        return lambda v: '' if v != v else str(int(v))
+    return lambda v: '' if v != v else repr(v)
+
+
+def _numpy_columns(columns: RecordColumns) -> Dict:
+    """Converte le colonne in array NumPy (senza copie per le colonne numeriche)"""
+    import numpy as np
+
+    result = {}
+    for name, column in columns.columns.items():
+        if column.kind == 'str':
+            result[name] = np.array(columns.values(name), dtype=object)
+            continue
+
+        values = np.frombuffer(column.values, dtype=np.float64)[:columns.count]
+        missing = np.isnan(values)
+        if column.kind == 'time':
+            out = np.full(columns.count, np.datetime64('NaT'), dtype='datetime64[s]')
+            out[~missing] = values[~missing].astype(np.int64)
+            result[name] = out
+        elif column.kind == 'int' and not missing.any():
+            result[name] = values.astype(np.int64)
+        else:
+            result[name] = values
+    return result
+
+
+def write_npz(columns: RecordColumns, path):
+    """
+    Scrive le colonne in un archivio .npz (un array per colonna)
+
+    Le colonne intere con valori mancanti restano float64 con NaN; le
+    colonne testuali sono salvate come stringhe unicode.
+    """
+    import numpy as np
+
+    arrays = _numpy_columns(columns)
+    for name, values in arrays.items():
+        if values.dtype == object:
+            arrays[name] = np.array(['' if v is None else v for v in values], dtype=str)
+
+    with _open_target(path, binary=True) as f:
+        np.savez(f, **arrays)
+
+
+def write_parquet(columns: RecordColumns, path):
+    """Scrive le colonne in un file Parquet con tipi nativi e valori null"""
+    import numpy as np
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    fields = {}
+    for name, values in _numpy_columns(columns).items():
+        kind = columns.columns[name].kind
+        if kind == 'time':
+            fields[name] = pa.array(values, type=pa.timestamp('s'))
+        elif kind == 'str':
+            fields[name] = pa.array(values.tolist(), type=pa.string())
+        elif kind == 'int':
+            mask = np.isnan(values) if values.dtype == np.float64 else None
+            if mask is not None:
+                values = np.where(mask, 0, values)
+            fields[name] = pa.array(values.astype(np.int64), type=pa.int64(), mask=mask)
+        else:
+            fields[name] = pa.array(values, type=pa.float64(), from_pandas=True)
+
+    table = pa.table(fields)
+    if columns.metadata:
+        table = table.replace_schema_metadata(columns.metadata)
+    with _open_target(path, binary=True) as f:
+        pq.write_table(table, f)
@@ -0,0 +1,176 @@
+"""
+Lettura dell'input dei file FIT
+Espone file su disco, bytes in memoria e oggetti file-like come un unico
+buffer (memoryview) da passare al decoder, senza copie intermedie
+"""
+
+import io
+import os
+import mmap
+from pathlib import Path
+from typing import Optional, Union
+
+# Modalità di lettura dei file su disco:
+# - mmap: il file viene mappato in memoria, nessuna read() esplicita
+# - bulk: una sola lettura in un buffer preallocato, con read-ahead
+#   sequenziale richiesto al kernel (indicata per NFS e filesystem di rete)
+INPUT_MODES = ('mmap', 'bulk')
+
+# Nome usato per le sorgenti senza nome (es. bytes ricevuti via rete)
+DEFAULT_SOURCE_NAME = "upload.fit"
+
+# Dimensione massima di ogni readinto() nella modalità bulk
+BULK_CHUNK_SIZE = 16 * 1024 * 1024
+
+Source = Union[str, Path, bytes, bytearray, memoryview, io.IOBase]
+
+
+def source_path(source, name: Optional[str] = None) -> Path:
+    """
+    Path usato per dare un nome all'output di una sorgente
+
+    Per i file su disco è il path stesso; per bytes e file-like è il nome
+    indicato, quello dell'oggetto file oppure DEFAULT_SOURCE_NAME.
+    """
+    if name:
+        return Path(name)
+    if isinstance(source, (str, Path)):
+        return Path(source)
+    file_name = getattr(source, 'name', None)
+    if isinstance(file_name, str):
+        return Path(file_name)
+    return Path(DEFAULT_SOURCE_NAME)
+
+
+def source_size(source) -> Optional[int]:
+    """Dimensione in byte della sorgente, se nota senza leggerla"""
+    if isinstance(source, (bytes, bytearray)):
+        return len(source)
+    if isinstance(source, memoryview):
+        return source.nbytes
+    if isinstance(source, (str, Path)):
+        try:
+            return os.stat(source).st_size
+        except OSError:
+            return None
+    if isinstance(source, io.BytesIO):
+        return source.getbuffer().nbytes
+    try:
+        return os.fstat(source.fileno()).st_size
+    except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+        return None
+
+
+class FitSource:
+    """
+    Sorgente di un file FIT esposta come memoryview
+
+    Si usa come context manager:
+
+        with FitSource(path) as source:
+            decoder = FastFitDecoder(source.buffer)
+
+    Args:
+        source: Path del file, contenuto in memoria (bytes, bytearray,
+            memoryview) oppure oggetto file-like aperto in modalità binaria
+        mode: Modalità di lettura dei file su disco (vedi INPUT_MODES)
+    """
+
+    def __init__(self, source: Source, mode: str = 'mmap'):
+        if mode not in INPUT_MODES:
+            raise ValueError(f"Modalità di input non supportata: {mode}")
+        self.source = source
+        self.mode = mode
+        self.buffer: Optional[memoryview] = None
+        self._mmap = None
+
+    def __enter__(self) -> "FitSource":
+        self.open()
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    @property
+    def size(self) -> int:
+        return len(self.buffer) if self.buffer is not None else 0
+
+    def open(self):
+        source = self.source
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            self.buffer = memoryview(source).cast('B')
+        elif isinstance(source, (str, Path)):
+            with open(source, 'rb') as f:
+                self.buffer = self._read_file(f)
+        elif isinstance(source, io.BytesIO):
+            self.buffer = source.getbuffer()
+        elif hasattr(source, 'read'):
+            self.buffer = self._read_fileobj(source)
+        else:
+            raise TypeError(f"Sorgente FIT non supportata: {type(source).__name__}")
+
+    def _read_file(self, f) -> memoryview:
+        size = os.fstat(f.fileno()).st_size
+        if self.mode == 'mmap' and size > 0:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            return memoryview(self._mmap)
+
+        # Lettura in blocco: un buffer della dimensione del file riempito con
+        # poche readinto() grandi, dopo aver chiesto il read-ahead al kernel
+        if hasattr(os, 'posix_fadvise'):
+            try:
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+            except OSError:
+                pass
+        buffer = bytearray(size)
+        view = memoryview(buffer)
+        filled = 0
+        raw = f.raw if hasattr(f, 'raw') else f
+        while filled < size:
+            n = raw.readinto(view[filled:filled + BULK_CHUNK_SIZE])
+            if not n:
+                break
+            filled += n
+        return view[:filled]
+
+    def _read_fileobj(self, f) -> memoryview:
+        fileno = None
+        try:
+            fileno = f.fileno()
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            pass
+        if fileno is not None and self.mode == 'mmap':
+            try:
+                if os.fstat(fileno).st_size > 0 and f.tell() == 0:
+                    self._mmap = mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+                    return memoryview(self._mmap)
+            except (OSError, ValueError):
+                pass
+        return memoryview(f.read())
+
+    def reader(self) -> io.BytesIO:
+        """
+        File-like sopra il buffer, per le librerie che leggono da file (fitparse)
+
+        Il contenuto viene copiato una volta sola: fitparse fa molte read()
+        di pochi byte, che su io.BytesIO costano meno che su un reader in
+        Python sopra il memoryview. Il decoder veloce usa invece il buffer
+        direttamente, senza copie.
+        """
+        return io.BytesIO(self.buffer)
+
+    def close(self):
+        if self.buffer is not None:
+            try:
+                self.buffer.release()
+            except BufferError:
+                # Qualche slice del buffer è ancora in uso: ci pensa il GC
+                pass
+            self.buffer = None
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                pass
+            self._mmap = None
@@ -0,0 +1,156 @@
+"""
+Limiti per file e quarantena
+Un file patologico (enorme, o che fa girare a vuoto il decoder) non deve
+bloccare né rallentare l'intero batch: ogni conversione può avere una
+dimensione massima e un tempo massimo, reale e di CPU, e i file che non si
+riescono a convertire possono essere spostati in una cartella di
+quarantena insieme a un report JSON dell'errore
+"""
+
+import os
+import json
+import signal
+import hashlib
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional
+
+# Suffisso del report accanto a ogni file in quarantena
+REPORT_SUFFIX = '.error.json'
+
+
+class LimitExceeded(Exception):
+    """Il file supera uno dei limiti di FileLimits"""
+
+
+class FileLimits:
+    """
+    Limiti della conversione di un singolo file, validati alla creazione
+
+    I tempi massimi usano i timer di intervallo del sistema (setitimer):
+    valgono sui sistemi Unix e solo nel thread principale del processo che
+    converte (CLI sequenziale e processi del pool); altrove resta attivo
+    solo il limite di dimensione.
+
+    Args:
+        max_size: Byte massimi del file .fit
+        timeout: Secondi massimi di tempo reale per file
+        cpu_timeout: Secondi massimi di CPU per file
+    """
+
+    def __init__(self, max_size: Optional[int] = None, timeout: Optional[float] = None,
+                 cpu_timeout: Optional[float] = None):
+        for name, value in (('dimensione massima', max_size), ('timeout', timeout),
+                            ('timeout di CPU', cpu_timeout)):
+            if value is not None and value <= 0:
+                raise ValueError(f"{name} deve essere positivo")
+        self.max_size = max_size
+        self.timeout = timeout
+        self.cpu_timeout = cpu_timeout
+
+    def to_dict(self) -> Dict:
+        """Argomenti per ricreare i limiti (es. nei processi di un pool)"""
+        return {'max_size': self.max_size, 'timeout': self.timeout,
+                'cpu_timeout': self.cpu_timeout}
+
+    def check_size(self, size: Optional[int]):
+        """Solleva LimitExceeded se il file supera max_size"""
+        if self.max_size is not None and size is not None and size > self.max_size:
+            raise LimitExceeded(f"file di {size} byte oltre il limite di {self.max_size} byte")
+
+    @contextmanager
+    def enforce(self):
+        """
+        Interrompe il blocco con LimitExceeded allo scadere di timeout o
+        cpu_timeout (SIGALRM e SIGPROF)
+        """
+        timers = []
+        if hasattr(signal, 'setitimer') and threading.current_thread() is threading.main_thread():
+            if self.timeout is not None:
+                timers.append((signal.ITIMER_REAL, signal.SIGALRM, self.timeout,
+                               f"tempo massimo di {self.timeout:g} s superato"))
+            if self.cpu_timeout is not None:
+                timers.append((signal.ITIMER_PROF, signal.SIGPROF, self.cpu_timeout,
+                               f"tempo massimo di CPU di {self.cpu_timeout:g} s superato"))
+
+        previous = []
+        try:
+            for timer, signum, seconds, message in timers:
+                previous.append((timer, signum, signal.signal(signum, _raiser(message))))
+                signal.setitimer(timer, seconds)
+            yield
+        finally:
+            for timer, signum, handler in previous:
+                signal.setitimer(timer, 0)
+                signal.signal(signum, handler)
+
+
+def _raiser(message: str):
+    def handler(signum, frame):
+        raise LimitExceeded(message)
+    return handler
+
+
+def quarantine(fit_file: Path, directory: Path, error: str, details: Optional[Dict] = None,
+               root: Optional[Path] = None) -> Path:
+    """
+    Sposta un file non convertibile nella cartella di quarantena e scrive
+    accanto il report '<nome>.error.json'
+
+    I file con lo stesso nome ricevono un suffisso numerico invece di
+    sovrascriversi; il report registra comunque il path originale.
+
+    Args:
+        error: Messaggio di errore della conversione
+        details: Campi aggiunti al report (es. tipo di errore, punti
+            danneggiati, metriche, opzioni)
+        root: Cartella di input: le sottocartelle del file vengono
+            riprodotte nella quarantena
+
+    Returns:
+        Nuovo path del file
+    """
+    fit_file = Path(fit_file)
+    if root is not None:
+        try:
+            directory = directory / fit_file.parent.relative_to(root)
+        except ValueError:
+            pass
+    directory.mkdir(parents=True, exist_ok=True)
+
+    target = directory / fit_file.name
+    number = 1
+    while target.exists() or target.with_name(target.name + REPORT_SUFFIX).exists():
+        number += 1
+        target = directory / f"{fit_file.stem}_{number}{fit_file.suffix}"
+
+    stat = fit_file.stat()
+    digest = hashlib.sha256()
+    with open(fit_file, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+
+    report = {
+        'input': str(fit_file),
+        'quarantined_as': str(target),
+        'time': datetime.now().isoformat(timespec='seconds'),
+        'error': error,
+        'size': stat.st_size,
+        'mtime': datetime.fromtimestamp(stat.st_mtime).isoformat(timespec='seconds'),
+        'sha256': digest.hexdigest(),
+    }
+    report.update(details or {})
+
+    # Prima il report, poi lo spostamento: un file in quarantena ha sempre il suo report
+    report_path = target.with_name(target.name + REPORT_SUFFIX)
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, default=str)
+    try:
+        os.replace(fit_file, target)
+    except OSError:
+        # Filesystem diversi: copia e rimozione
+        import shutil
+        shutil.move(str(fit_file), str(target))
+    return target
@@ -0,0 +1,138 @@
+"""
+Manifest per la conversione incrementale
+Tiene traccia dei file .fit già convertiti in una cartella di output, così
+le esecuzioni successive riconvertono solo i file nuovi o modificati
+"""
+
+import os
+import json
+import hashlib
+from pathlib import Path
+from typing import Dict, Iterable, Iterator
+
+MANIFEST_NAME = ".fit_to_txt_manifest.json"
+MANIFEST_FORMAT = 1
+
+# Dimensione dei blocchi letti per calcolare l'hash
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_sha256(path: Path) -> str:
+    """Calcola lo SHA-256 del contenuto di un file"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ConversionManifest:
+    """
+    Manifest su disco delle conversioni eseguite
+
+    Per ogni sorgente registra path, dimensione, mtime, hash del contenuto e
+    file di output. Un file viene considerato invariato se la versione del
+    converter e le opzioni di output coincidono e il file di output esiste
+    ancora; l'hash viene ricalcolato solo quando dimensione o mtime cambiano.
+    """
+
+    def __init__(self, output_dir: Path, version: str, options: Dict):
+        self.path = output_dir / MANIFEST_NAME
+        self.output_dir = output_dir
+        self.version = version
+        self.options = options
+        self.entries: Dict[str, Dict] = {}
+        # Hash calcolati durante changed(), riusati da record()
+        self._hashes: Dict[str, str] = {}
+        # File invariati trovati dall'ultima changed()
+        self.unchanged = 0
+        self._dirty = False
+
+    @classmethod
+    def load(cls, output_dir: Path, version: str, options: Dict) -> "ConversionManifest":
+        """Carica il manifest dalla cartella di output (vuoto se assente o illeggibile)"""
+        manifest = cls(output_dir, version, options)
+        try:
+            with open(manifest.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('format') == MANIFEST_FORMAT:
+                manifest.entries = data.get('files', {})
+        except (OSError, ValueError):
+            pass
+        return manifest
+
+    @staticmethod
+    def _key(fit_file: Path) -> str:
+        return str(fit_file.resolve())
+
+    def is_unchanged(self, fit_file: Path) -> bool:
+        """Verifica se il file è già stato convertito con le opzioni correnti"""
+        key = self._key(fit_file)
+        entry = self.entries.get(key)
+        if entry is None:
+            return False
+        if entry.get('version') != self.version or entry.get('options') != self.options:
+            return False
+        if not (self.output_dir / entry.get('output', '')).is_file():
+            return False
+
+        stat = fit_file.stat()
+        if entry.get('size') == stat.st_size and entry.get('mtime_ns') == stat.st_mtime_ns:
+            return True
+
+        # Dimensione o mtime diversi: decide il contenuto
+        if entry.get('size') != stat.st_size:
+            return False
+        digest = file_sha256(fit_file)
+        self._hashes[key] = digest
+        if digest != entry.get('sha256'):
+            return False
+
+        # Contenuto identico (es. file copiato o toccato): aggiorna solo l'mtime
+        entry['mtime_ns'] = stat.st_mtime_ns
+        self._dirty = True
+        return True
+
+    def changed(self, fit_files: Iterable[Path]) -> Iterator[Path]:
+        """
+        Restituisce man mano i file da convertire, saltando quelli invariati
+        (contati in self.unchanged)
+        """
+        self.unchanged = 0
+        for fit_file in fit_files:
+            if self.is_unchanged(fit_file):
+                self.unchanged += 1
+            else:
+                yield fit_file
+
+    def record(self, fit_file: Path, output_name: str):
+        """Registra una conversione riuscita"""
+        key = self._key(fit_file)
+        stat = fit_file.stat()
+        digest = self._hashes.pop(key, None) or file_sha256(fit_file)
+        self.entries[key] = {
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'sha256': digest,
+            'version': self.version,
+            'options': self.options,
+            'output': output_name,
+        }
+        self._dirty = True
+
+    def discard(self, fit_file: Path):
+        """Rimuove un file dal manifest (es. conversione fallita)"""
+        key = self._key(fit_file)
+        self._hashes.pop(key, None)
+        if self.entries.pop(key, None) is not None:
+            self._dirty = True
+
+    def save(self):
+        """Scrive il manifest in modo atomico (file temporaneo + rename)"""
+        if not self._dirty:
+            return
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'format': MANIFEST_FORMAT, 'files': self.entries}, f)
+        os.replace(tmp_path, self.path)
+        self._dirty = False
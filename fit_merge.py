@@ -0,0 +1,375 @@
+"""
+Unione delle attività divise in più file
+Molti dispositivi spezzano un'attività in più file .fit (cambio batteria,
+blocco, ripartenza): i file dello stesso dispositivo (numero di serie) che
+si susseguono a breve distanza vengono riuniti in un'unica attività, con i
+record in ordine di tempo e i totali della sessione ricalcolati. I record
+vengono uniti in streaming (merge a k vie con heapq), quindi in memoria c'è
+un solo record per file, non i file interi.
+"""
+
+import hashlib
+import heapq
+from datetime import datetime
+from itertools import islice
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from fit_constants import DEFAULT_MESSAGES
+
+# Secondi massimi tra la fine di un file e l'inizio del successivo perché
+# vengano considerati la stessa attività
+MERGE_GAP = 600.0
+
+# Messaggi letti per decidere i gruppi
+SCAN_MESSAGES = frozenset(('file_id', 'session', 'record'))
+
+# Totali di sessione sommati dai file che hanno una sessione
+SUMMED_FIELDS = ('total_calories', 'total_ascent', 'total_descent')
+
+
+class FileSpan:
+    """
+    Dispositivo e intervallo di tempo di un file, letti da scan_file()
+
+    Un file senza numero di serie o senza record con timestamp non viene
+    mai unito ad altri.
+    """
+
+    __slots__ = ('path', 'serial', 'start', 'end', 'first_distance', 'last_distance',
+                 'timer_time')
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.serial = None
+        self.start: Optional[datetime] = None
+        self.end: Optional[datetime] = None
+        self.first_distance: Optional[float] = None
+        self.last_distance: Optional[float] = None
+        # Dalla sessione, se c'è (i file interrotti spesso non ce l'hanno)
+        self.timer_time: Optional[float] = None
+
+    @property
+    def mergeable(self) -> bool:
+        return self.serial is not None and self.start is not None
+
+    def consume(self, messages: Iterable) -> "FileSpan":
+        """Registra i messaggi di fit_stream.decode (da usare come consume)"""
+        for name, fields in messages:
+            if name == 'record':
+                for key, value in fields:
+                    if key == 'timestamp' and isinstance(value, datetime):
+                        if self.start is None:
+                            self.start = value
+                        self.end = value
+                    elif key == 'distance':
+                        if self.first_distance is None:
+                            self.first_distance = value
+                        self.last_distance = value
+            elif name == 'file_id' and self.serial is None:
+                self.serial = dict(fields).get('serial_number')
+            elif name == 'session' and self.timer_time is None:
+                self.timer_time = dict(fields).get('total_timer_time')
+        return self
+
+
+def scan_file(fit_file: Path, engine: str = 'fitparse', input_mode: str = 'mmap',
+              recovery: str = 'fail') -> FileSpan:
+    """
+    Legge dispositivo, inizio, fine e distanza di un file (solleva gli
+    errori di lettura; con recovery diverso da 'fail' usa la parte leggibile)
+    """
+    from fit_stream import decode
+
+    return decode(fit_file, lambda messages: FileSpan(fit_file).consume(messages),
+                  engine, SCAN_MESSAGES, input_mode, recovery)
+
+
+def group_spans(spans: Iterable[FileSpan], gap: float = MERGE_GAP) -> List[List[FileSpan]]:
+    """
+    Raggruppa i file dello stesso dispositivo che si susseguono (o si
+    sovrappongono) a meno di gap secondi
+
+    Returns:
+        Gruppi in ordine di tempo; i file non unibili formano un gruppo da soli
+    """
+    groups = []
+    current: List[FileSpan] = []
+    end = None
+    for span in sorted((span for span in spans if span.mergeable),
+                       key=lambda span: (str(span.serial), span.start)):
+        if (current and span.serial == current[0].serial
+                and (span.start - end).total_seconds() <= gap):
+            current.append(span)
+            end = max(end, span.end)
+            continue
+        if current:
+            groups.append(current)
+        current, end = [span], span.end
+    if current:
+        groups.append(current)
+    groups.extend([span] for span in spans if not span.mergeable)
+    groups.sort(key=lambda group: str(group[0].path))
+    return groups
+
+
+def group_files(fit_files: Iterable[Path], gap: float = MERGE_GAP, engine: str = 'fitparse',
+                input_mode: str = 'mmap', recovery: str = 'fail') -> List[List[FileSpan]]:
+    """
+    Come group_spans(), leggendo i file con scan_file(); i file illeggibili
+    restano da soli (la loro conversione riporterà l'errore)
+    """
+    spans = []
+    for fit_file in fit_files:
+        try:
+            spans.append(scan_file(fit_file, engine, input_mode, recovery))
+        except Exception:
+            spans.append(FileSpan(fit_file))
+    return group_spans(spans, gap)
+
+
+class MergedActivity:
+    """
+    Gruppo di file della stessa attività, da convertire come un file solo
+
+    Si passa a fit_core.convert al posto del file .fit: l'output prende il
+    nome dal primo file con il suffisso '_merged'.
+
+    I messaggi prodotti da decode() sono, nell'ordine: i record di tutti i
+    file in ordine di tempo (a parità di timestamp vale l'ordine dei file,
+    e un record con lo stesso timestamp del precedente ma di un altro file
+    viene scartato come duplicato), il file_id del primo file, i lap di
+    tutti i file e una sessione con i totali ricalcolati. La distanza dei
+    record prosegue da un file all'altro quando un file riparte da zero.
+    I record vengono letti anche quando non sono tra i messaggi richiesti,
+    perché i totali della sessione si calcolano da loro.
+    """
+
+    def __init__(self, spans: List[FileSpan]):
+        self.spans = sorted(spans, key=lambda span: span.start)
+        first = self.spans[0].path
+        self.name = str(first.with_name(f"{first.stem}_merged{first.suffix}"))
+        self.offsets = _distance_offsets(self.spans)
+        # Record scartati come duplicati nell'ultima decode()
+        self.duplicates = 0
+
+    @property
+    def paths(self) -> List[Path]:
+        return [span.path for span in self.spans]
+
+    def digest(self, input_mode: str = 'mmap') -> bytes:
+        """
+        Impronta del gruppo per la cache dei risultati: SHA-256 del contenuto
+        di ogni file, nell'ordine dell'unione
+        """
+        from fit_input import FitSource
+
+        digests = []
+        for path in self.paths:
+            with FitSource(path, input_mode) as source:
+                digests.append(hashlib.sha256(source.buffer).digest())
+        return b''.join(digests)
+
+    def decode(self, consume, engine: str = 'fitparse',
+               names: Optional[Set[str]] = DEFAULT_MESSAGES, input_mode: str = 'mmap',
+               recovery: str = 'fail', issues: Optional[List[Dict]] = None):
+        """Come fit_stream.decode, sull'unione dei file"""
+        return consume(self.messages(engine, names, input_mode, recovery, issues))
+
+    def messages(self, engine: str = 'fitparse', names: Optional[Set[str]] = DEFAULT_MESSAGES,
+                 input_mode: str = 'mmap', recovery: str = 'fail',
+                 issues: Optional[List[Dict]] = None) -> Iterator[Tuple[str, List]]:
+        names = set(names if names is not None else DEFAULT_MESSAGES)
+        # I record servono comunque per i totali della sessione unita
+        read = names | {'record'}
+        others: List[List[Tuple[str, List]]] = [[] for _ in self.spans]
+        file_issues: List[List[Dict]] = [[] for _ in self.spans]
+        streams = [_records(index, span, self.offsets[index], others[index],
+                            _read(span.path, engine, read, input_mode, recovery,
+                                  file_issues[index]))
+                   for index, span in enumerate(self.spans)]
+
+        totals = SessionTotals()
+        records = 'record' in names
+        last = None
+        self.duplicates = 0
+        for timestamp, index, _, fields in heapq.merge(*streams):
+            if last is not None and timestamp == last[0] and index != last[1]:
+                self.duplicates += 1
+                continue
+            last = (timestamp, index)
+            totals.add(fields)
+            if records:
+                yield 'record', fields
+
+        # Tutti i file sono stati letti: restano i messaggi diversi dai record
+        if issues is not None:
+            for span, found in zip(self.spans, file_issues):
+                issues.extend(dict(issue, file=span.path.name) for issue in found)
+        file_ids = [fields for messages in others for name, fields in messages
+                    if name == 'file_id']
+        if file_ids and 'file_id' in names:
+            yield 'file_id', file_ids[0]
+        # I lap ripetuti (file sovrapposti) compaiono una volta sola
+        laps, seen = [], set()
+        for messages in others:
+            for name, fields in messages:
+                if name == 'lap':
+                    key = tuple(value for key, value in fields if key in ('start_time', 'timestamp'))
+                    if key and key in seen:
+                        continue
+                    seen.add(key)
+                    laps.append(fields)
+        if 'lap' in names:
+            for fields in laps:
+                yield 'lap', fields
+        if 'session' in names:
+            sessions = [dict(fields) for messages in others for name, fields in messages
+                        if name == 'session']
+            yield 'session', totals.fields(self.spans, sessions, len(laps))
+
+
+def _distance_offsets(spans: List[FileSpan]) -> List[float]:
+    """Distanza da aggiungere ai record di ogni file perché la distanza prosegua"""
+    offsets = []
+    covered = offset = 0.0
+    end = None
+    for span in spans:
+        if end is not None and span.start <= end:
+            # Sovrapposto al precedente (es. una copia): stessa distanza di partenza
+            pass
+        elif span.first_distance is not None and span.first_distance < covered:
+            # Il file riparte da zero invece di continuare il conteggio
+            offset = covered
+        else:
+            offset = 0.0
+        offsets.append(offset)
+        if span.last_distance is not None:
+            covered = max(covered, span.last_distance + offset)
+        end = span.end if end is None else max(end, span.end)
+    return offsets
+
+
+def _read(fit_file: Path, engine: str, names: Set[str], input_mode: str, recovery: str,
+          issues: List[Dict]) -> Iterator[Tuple[str, List]]:
+    """
+    Messaggi di un file come generatore (fit_stream.decode li passa a una
+    funzione): se il decoder veloce si ferma a metà, la lettura riprende con
+    fitparse dal primo messaggio non ancora restituito
+    """
+    from fit_decoder import FastPathUnsupported, fast_messages
+    from fit_input import FitSource
+    from fit_stream import fitparse_messages
+
+    done = 0
+    with FitSource(fit_file, input_mode) as source:
+        if engine == 'fast':
+            try:
+                for message in fast_messages(source.buffer, names, recovery, issues):
+                    yield message
+                    done += 1
+                return
+            except FastPathUnsupported:
+                # I punti annotati verranno ritrovati rileggendo
+                del issues[:]
+        messages = fitparse_messages(source.reader(), names,
+                                     issues if recovery != 'fail' else None)
+        yield from islice((message for message in messages if message[0] in names), done, None)
+
+
+def _records(index: int, span: FileSpan, offset: float, others: List,
+             messages: Iterator) -> Iterator[Tuple[datetime, int, int, List]]:
+    """
+    Record di un file con la chiave di ordinamento (timestamp, file, posizione);
+    gli altri messaggi finiscono in others
+    """
+    timestamp = span.start
+    for position, (name, fields) in enumerate(messages):
+        if name != 'record':
+            others.append((name, fields))
+            continue
+        if offset:
+            # Distanza in centimetri nel file: si evitano i residui della somma
+            fields = [(key, round(value + offset, 2) if key == 'distance' else value)
+                      for key, value in fields]
+        for key, value in fields:
+            if key == 'timestamp':
+                # I record senza timestamp restano dopo il precedente
+                timestamp = value
+                break
+        yield timestamp, index, position, fields
+
+
+class SessionTotals:
+    """Totali della sessione unita, calcolati dai record man mano che passano"""
+
+    AVERAGED = ('heart_rate', 'cadence', 'power')
+
+    def __init__(self):
+        self.start = self.end = None
+        self.distance = None
+        self.max_speed = None
+        self._sums = {name: 0 for name in self.AVERAGED}
+        self._counts = {name: 0 for name in self.AVERAGED}
+        self._maxima: Dict[str, object] = {}
+
+    def add(self, fields: List[Tuple[str, object]]):
+        sums, counts, maxima = self._sums, self._counts, self._maxima
+        for key, value in fields:
+            if key in sums:
+                sums[key] += value
+                counts[key] += 1
+                if key not in maxima or value > maxima[key]:
+                    maxima[key] = value
+            elif key == 'timestamp':
+                if self.start is None:
+                    self.start = value
+                self.end = value
+            elif key == 'distance':
+                self.distance = value
+            elif key in ('speed', 'enhanced_speed'):
+                if self.max_speed is None or value > self.max_speed:
+                    self.max_speed = value
+
+    def fields(self, spans: List[FileSpan], sessions: List[Dict],
+               laps: int) -> List[Tuple[str, object]]:
+        """
+        Coppie (campo, valore) della sessione: tempi, distanza, velocità e
+        medie dai record; tempo di movimento, calorie e dislivelli dalle
+        sessioni dei singoli file (per i file senza sessione e per quelli
+        sovrapposti, il tempo tra il primo e l'ultimo record)
+        """
+        first = next((session for session in sessions if session.get('sport') is not None), {})
+        timer = 0.0
+        end = None
+        for span in spans:
+            if end is not None and span.start <= end:
+                # File sovrapposti: conta solo il tempo oltre la fine del precedente
+                timer += max(0.0, (span.end - end).total_seconds())
+            elif span.timer_time is not None:
+                timer += span.timer_time
+            else:
+                timer += (span.end - span.start).total_seconds()
+            end = span.end if end is None else max(end, span.end)
+        values: List[Tuple[str, object]] = [
+            ('timestamp', self.end),
+            ('start_time', self.start),
+            ('sport', first.get('sport')),
+            ('sub_sport', first.get('sub_sport')),
+        ]
+        if self.start is not None:
+            values.append(('total_elapsed_time', (self.end - self.start).total_seconds()))
+        values.append(('total_timer_time', round(timer, 3)))
+        values.append(('total_distance', self.distance))
+        for name in SUMMED_FIELDS:
+            found = [session[name] for session in sessions if session.get(name) is not None]
+            values.append((name, sum(found) if found else None))
+        if self.distance is not None and timer > 0:
+            values.append(('avg_speed', round(self.distance / timer, 3)))
+        values.append(('max_speed', self.max_speed))
+        for name in self.AVERAGED:
+            if self._counts[name]:
+                values.append((f'avg_{name}', round(self._sums[name] / self._counts[name])))
+                values.append((f'max_{name}', self._maxima[name]))
+        values.append(('num_laps', laps))
+        return [(name, value) for name, value in values if value is not None]
@@ -0,0 +1,237 @@
+"""
+Metriche e profilazione della conversione
+Tempi per fase (decode, categorize, analyze, format, write) e contatori per file,
+scritti come JSON lines insieme a un riepilogo aggregato, più una modalità
+di profilazione (cProfile o tracemalloc) per un'intera esecuzione
+"""
+
+import io
+import sys
+import json
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, TypeVar
+
+STAGES = ('decode', 'categorize', 'analyze', 'format', 'write')
+
+# Modalità di --profile
+PROFILE_MODES = ('cpu', 'memory')
+
+# Righe mostrate nel report di profilazione
+PROFILE_TOP = 25
+
+T = TypeVar('T')
+
+
+class FileMetrics:
+    """
+    Metriche della conversione di un file
+
+    Args:
+        name: Nome del file .fit
+        track_messages: Se False, track() non conta i messaggi e non separa
+            il tempo di decodifica da quello di categorizzazione (nessun
+            costo per messaggio quando le metriche non servono)
+    """
+
+    def __init__(self, name: Optional[str], track_messages: bool = True):
+        self.name = name
+        self.track_messages = track_messages
+        self.stages = dict.fromkeys(STAGES, 0.0)
+        self.messages = Counter()
+        self.decode_passes = 0
+        self.bytes_in: Optional[int] = None
+        self.bytes_out: Optional[int] = None
+        self.output: Optional[str] = None
+        # 'hit' o 'miss' quando la conversione usa la cache dei risultati
+        self.cache: Optional[str] = None
+        self.ok: Optional[bool] = None
+        self.error: Optional[str] = None
+        self.error_type: Optional[str] = None
+        # Punti danneggiati dei file convertiti parzialmente (vedi fit_decoder)
+        self.issues: List[Dict] = []
+        self.seconds = 0.0
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name: str):
+        """Somma il tempo del blocco alla fase indicata"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] += time.perf_counter() - start
+
+    def track(self, messages: Iterable) -> Iterator:
+        """
+        Conta i messaggi che attraversano l'iteratore
+
+        Va usato dentro stage('decode'): il tempo passato dal consumatore tra
+        un messaggio e l'altro viene spostato da 'decode' a 'categorize',
+        così le due fasi restano separate anche se lettura e categorizzazione
+        avvengono in streaming. Se la decodifica riparte (ripiego su
+        fitparse), i contatori ripartono da zero.
+        """
+        self.decode_passes += 1
+        if not self.track_messages:
+            return iter(messages)
+        self.messages.clear()
+        return self._track(messages)
+
+    def _track(self, messages: Iterable) -> Iterator:
+        clock = time.perf_counter
+        counts = self.messages
+        consumer = 0.0
+        try:
+            for message in messages:
+                counts[message[0]] += 1
+                start = clock()
+                yield message
+                consumer += clock() - start
+        finally:
+            self.stages['decode'] -= consumer
+            self.stages['categorize'] += consumer
+
+    def finish(self, ok: bool, error: Optional[str] = None):
+        self.ok = ok
+        self.error = error
+        self.seconds = time.perf_counter() - self._start
+
+    def to_dict(self) -> Dict:
+        return {
+            'type': 'file',
+            'file': self.name,
+            'ok': self.ok,
+            'error': self.error,
+            'error_type': self.error_type,
+            'issues': self.issues,
+            'output': self.output,
+            'seconds': round(self.seconds, 6),
+            'stages': {name: round(seconds, 6) for name, seconds in self.stages.items()},
+            'messages': dict(self.messages),
+            'records': self.messages.get('record', 0),
+            'decode_passes': self.decode_passes,
+            'cache': self.cache,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+        }
+
+
+class MetricsWriter:
+    """
+    Scrive le metriche dei file come JSON lines
+
+    Ogni riga è il dizionario di FileMetrics.to_dict(); close() aggiunge
+    una riga finale con type='aggregate' e i totali del batch.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, 'w', encoding='utf-8')
+        self.files = 0
+        self.failed = 0
+        self.partial = 0
+        self.seconds = 0.0
+        self.stages = dict.fromkeys(STAGES, 0.0)
+        self.messages = Counter()
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.cache_hits = 0
+        self.slowest: Optional[Dict] = None
+
+    def write(self, metrics: Dict):
+        """Aggiunge le metriche di un file (dizionario di FileMetrics.to_dict)"""
+        self._file.write(json.dumps(metrics) + "\n")
+        self._file.flush()
+
+        self.files += 1
+        if not metrics['ok']:
+            self.failed += 1
+        elif metrics.get('issues'):
+            self.partial += 1
+        self.seconds += metrics['seconds']
+        for name, seconds in metrics['stages'].items():
+            self.stages[name] += seconds
+        self.messages.update(metrics['messages'])
+        self.bytes_in += metrics['bytes_in'] or 0
+        self.bytes_out += metrics['bytes_out'] or 0
+        if metrics.get('cache') == 'hit':
+            self.cache_hits += 1
+        if self.slowest is None or metrics['seconds'] > self.slowest['seconds']:
+            self.slowest = {'file': metrics['file'], 'seconds': metrics['seconds']}
+
+    def aggregate(self) -> Dict:
+        return {
+            'type': 'aggregate',
+            'files': self.files,
+            'failed': self.failed,
+            'partial': self.partial,
+            'seconds': round(self.seconds, 6),
+            'stages': {name: round(seconds, 6) for name, seconds in self.stages.items()},
+            'messages': dict(self.messages),
+            'records': self.messages.get('record', 0),
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'cache_hits': self.cache_hits,
+            'slowest': self.slowest,
+        }
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._file.write(json.dumps(self.aggregate()) + "\n")
+        self._file.close()
+
+    def __enter__(self) -> "MetricsWriter":
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+def profile_run(mode: str, run: Callable[[], T], output: Optional[str] = None) -> T:
+    """
+    Esegue run() sotto profilazione e stampa il report su stderr
+
+    Args:
+        mode: 'cpu' (cProfile, funzioni ordinate per tempo cumulativo)
+            oppure 'memory' (tracemalloc, righe che allocano di più)
+        output: Se indicato, salva anche i dati grezzi (formato pstats per
+            'cpu', snapshot di tracemalloc per 'memory')
+    """
+    if mode == 'cpu':
+        import cProfile
+        import pstats
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            return run()
+        finally:
+            profiler.disable()
+            if output:
+                profiler.dump_stats(output)
+            report = io.StringIO()
+            pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(PROFILE_TOP)
+            print(report.getvalue(), file=sys.stderr)
+
+    if mode == 'memory':
+        import tracemalloc
+
+        tracemalloc.start()
+        try:
+            return run()
+        finally:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            if output:
+                snapshot.dump(output)
+            print(f"\nMemoria Python: attuale {current / 1e6:.1f} MB, picco {peak / 1e6:.1f} MB",
+                  file=sys.stderr)
+            print(f"Prime {PROFILE_TOP} righe per memoria allocata:", file=sys.stderr)
+            for stat in snapshot.statistics('lineno')[:PROFILE_TOP]:
+                print(f"  {stat}", file=sys.stderr)
+
+    raise ValueError(f"Modalità di profilazione non supportata: {mode}")
@@ -0,0 +1,222 @@
+"""
+Conversione distribuita: shard e coda di lavoro condivisa
+Un archivio grande si divide tra più processi o macchine che vedono lo
+stesso filesystem: con gli shard ogni processo prende una parte fissa dei
+file (hash stabile del path), con la coda di lavoro (file SQLite) i processi
+si prendono i file uno alla volta senza convertirli due volte, e
+un'esecuzione interrotta riprende dal punto in cui si era fermata
+"""
+
+import os
+import time
+import socket
+import sqlite3
+import hashlib
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+# Secondi di attesa quando un altro processo sta scrivendo nella coda
+LOCK_TIMEOUT = 30.0
+
+# Secondi dopo cui un file preso da un processo di un'altra macchina, e
+# non ancora finito, torna disponibile (quelli dei processi terminati
+# sulla stessa macchina tornano disponibili subito)
+DEFAULT_LEASE = 3600.0
+
+# Stati di un file nella coda
+STATES = ('running', 'done', 'failed')
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS files ("
+    " key TEXT PRIMARY KEY, state TEXT NOT NULL, worker TEXT NOT NULL,"
+    " size INTEGER, mtime REAL, attempts INTEGER NOT NULL DEFAULT 0,"
+    " started REAL NOT NULL, finished REAL, output TEXT, error TEXT)",
+    "CREATE INDEX IF NOT EXISTS files_state ON files (state)",
+)
+
+
+def parse_shard(spec: str) -> Tuple[int, int]:
+    """Interpreta 'i/N' (shard i di N, da 1 a N)"""
+    index, _, count = spec.partition('/')
+    try:
+        index, count = int(index), int(count)
+    except ValueError:
+        raise ValueError(f"shard non valido: {spec} (usa i/N, es. 1/4)") from None
+    if count < 1 or not 1 <= index <= count:
+        raise ValueError(f"shard non valido: {spec} (i deve essere tra 1 e N)")
+    return index, count
+
+
+def file_key(fit_file: Path, root: Optional[Path] = None) -> str:
+    """
+    Chiave di un file per shard e coda: il path relativo alla cartella di
+    input, così macchine che montano l'archivio in punti diversi concordano
+    """
+    fit_file = Path(fit_file)
+    if root is not None:
+        try:
+            return fit_file.relative_to(root).as_posix()
+        except ValueError:
+            pass
+    return fit_file.resolve().as_posix()
+
+
+def shard_of(key: str, count: int) -> int:
+    """Shard (da 1 a count) di una chiave: hash stabile tra processi e macchine"""
+    digest = hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % count + 1
+
+
+def in_shard(fit_files: Iterable[Path], index: int, count: int,
+             root: Optional[Path] = None) -> Iterator[Path]:
+    """Solo i file dello shard index di count, senza consumare l'iteratore in anticipo"""
+    for fit_file in fit_files:
+        if shard_of(file_key(fit_file, root), count) == index:
+            yield fit_file
+
+
+class WorkQueue:
+    """
+    Coda di lavoro su file SQLite, condivisibile tra processi e macchine
+
+    Ogni file passa per claim() prima della conversione: viene preso in
+    una transazione BEGIN IMMEDIATE, quindi due processi non convertono mai
+    lo stesso file. Lo stato di ogni file (running, done, failed) resta nel
+    file della coda: un file già convertito viene saltato finché non cambia
+    (dimensione o data di modifica), uno rimasto 'running' da un processo
+    terminato torna disponibile, subito se il processo era su questa
+    macchina, altrimenti dopo lease secondi.
+
+    Args:
+        path: File SQLite (creato se non esiste)
+        lease: Secondi dopo cui un file non finito da un processo di
+            un'altra macchina torna disponibile
+        retry_failed: Riprova i file non convertiti nelle esecuzioni precedenti
+    """
+
+    def __init__(self, path, lease: float = DEFAULT_LEASE, retry_failed: bool = False):
+        if lease <= 0:
+            raise ValueError("la durata dell'assegnazione deve essere positiva")
+        self.path = Path(path)
+        self.lease = lease
+        self.retry_failed = retry_failed
+        self.host = socket.gethostname()
+        self.worker = f"{self.host}:{os.getpid()}"
+        # File saltati perché già convertiti (o falliti) o presi da altri processi
+        self.skipped = 0
+        self.busy = 0
+        self._keys: Dict[Path, str] = {}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(self.path), timeout=LOCK_TIMEOUT, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        with self._transaction():
+            for statement in _SCHEMA:
+                self._db.execute(statement)
+
+    @contextmanager
+    def _transaction(self):
+        """Transazione in scrittura (BEGIN IMMEDIATE, vedi fit_cache.ResultCache)"""
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        self._db.execute("COMMIT")
+
+    def claim(self, fit_file: Path, key: str) -> bool:
+        """
+        Prende un file da convertire
+
+        Returns:
+            False se il file è già stato convertito (e non è cambiato), è
+            fallito o lo sta convertendo un altro processo attivo
+        """
+        try:
+            stat = fit_file.stat()
+            size, mtime = stat.st_size, stat.st_mtime
+        except OSError:
+            size = mtime = None
+        now = time.time()
+        with self._transaction():
+            row = self._db.execute("SELECT state, worker, started, size, mtime FROM files "
+                                   "WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                state, worker, started, old_size, old_mtime = row
+                unchanged = (old_size, old_mtime) == (size, mtime)
+                if state == 'running' and worker != self.worker and self._active(worker, started):
+                    self.busy += 1
+                    return False
+                if unchanged and (state == 'done' or (state == 'failed' and not self.retry_failed)):
+                    self.skipped += 1
+                    return False
+            self._db.execute(
+                "INSERT INTO files (key, state, worker, size, mtime, attempts, started) "
+                "VALUES (?, 'running', ?, ?, ?, 1, ?) "
+                "ON CONFLICT (key) DO UPDATE SET state = 'running', worker = excluded.worker, "
+                "size = excluded.size, mtime = excluded.mtime, attempts = attempts + 1, "
+                "started = excluded.started, finished = NULL, output = NULL, error = NULL",
+                (key, self.worker, size, mtime, now))
+        self._keys[fit_file] = key
+        return True
+
+    def _active(self, worker: str, started: float) -> bool:
+        """True se il processo che ha preso il file può ancora finirlo"""
+        if time.time() - started > self.lease:
+            return False
+        host, _, pid = worker.rpartition(':')
+        if host != self.host:
+            return True
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            return False
+        except (PermissionError, ValueError, OSError):
+            return True
+        return True
+
+    def claimed(self, fit_files: Iterable[Path], root: Optional[Path] = None) -> Iterator[Path]:
+        """
+        Solo i file presi con claim(), uno alla volta: ogni file viene preso
+        quando serve, così i processi si dividono il lavoro man mano
+        """
+        for fit_file in fit_files:
+            if self.claim(fit_file, file_key(fit_file, root)):
+                yield fit_file
+
+    def finish(self, fit_file: Path, ok: bool, detail: Optional[str] = None):
+        """
+        Registra l'esito di un file preso con claim()
+
+        Args:
+            detail: Path o nome dell'output, oppure messaggio di errore
+        """
+        key = self._keys.pop(fit_file, None)
+        if key is None:
+            return
+        with self._transaction():
+            self._db.execute(
+                "UPDATE files SET state = ?, finished = ?, output = ?, error = ? "
+                "WHERE key = ? AND worker = ?",
+                ('done' if ok else 'failed', time.time(), detail if ok else None,
+                 None if ok else detail, key, self.worker))
+
+    def stats(self) -> Dict:
+        """Numero di file per stato e processi al lavoro"""
+        counts = dict.fromkeys(STATES, 0)
+        counts.update(self._db.execute("SELECT state, COUNT(*) FROM files GROUP BY state"))
+        workers = [worker for (worker,) in self._db.execute(
+            "SELECT DISTINCT worker FROM files WHERE state = 'running'")]
+        return {'path': str(self.path), 'files': sum(counts.values()), **counts,
+                'workers': workers}
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self) -> "WorkQueue":
+        return self
+
+    def __exit__(self, *_):
+        self.close()
@@ -0,0 +1,409 @@
+"""
+Campionamento dei record
+Il .txt mostra di default i primi e gli ultimi 10 record; qui ci sono le
+alternative, tutte calcolate nello stesso passaggio della conversione: un
+record ogni N, un record ogni intervallo di tempo, un campione casuale di K
+record (reservoir sampling) oppure la traccia GPS e altimetrica ridotta a K
+punti preservandone la forma (Ramer-Douglas-Peucker o LTTB)
+"""
+
+import math
+import heapq
+import random
+from array import array
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from fit_constants import SUMMARY_FIELDS
+
+# Modalità di campionamento -> valore di default (record, secondi o punti)
+SAMPLING_MODES = {
+    'every': 60,
+    'interval': 60.0,
+    'reservoir': 100,
+    'rdp': 500,
+    'lttb': 500,
+}
+
+# Modalità che riducono la traccia (richiedono NumPy)
+TRACK_MODES = ('rdp', 'lttb')
+
+# Seme del reservoir sampling: stesso file -> stesso campione (e stessa cache)
+RESERVOIR_SEED = 0
+
+# Campi della traccia usati dalle modalità rdp e lttb per scegliere i punti
+TRACK_FIELDS = ('position_lat', 'position_long', 'altitude', 'distance')
+
+# Campi conservati per i punti di rdp e lttb, nell'ordine dei messaggi
+# decodificati: solo quelli mostrati nel .txt (l'esportazione colonnare
+# usa indices() e rilegge tutte le colonne)
+SAMPLE_FIELDS = tuple(sorted(SUMMARY_FIELDS))
+
+# Tipo dei valori di SAMPLE_FIELDS negli array di TrackSampler
+_MISSING, _INT, _FLOAT, _TIME, _OTHER = range(5)
+
+# Da semicerchi FIT a gradi, e raggio terrestre medio in metri
+SEMICIRCLES = 180.0 / 2 ** 31
+EARTH_RADIUS = 6371008.8
+
+
+class SamplingSettings:
+    """
+    Campionamento dei record, validato alla creazione
+
+    Args:
+        mode: Una delle modalità di SAMPLING_MODES
+        value: Per 'every' il passo in record, per 'interval' i secondi
+            tra due record, per 'reservoir' i record del campione, per
+            'rdp' e 'lttb' i punti della traccia (default: SAMPLING_MODES)
+    """
+
+    def __init__(self, mode: str, value: Optional[float] = None):
+        if mode not in SAMPLING_MODES:
+            raise ValueError(f"Campionamento non supportato: {mode} "
+                             f"(validi: {', '.join(SAMPLING_MODES)})")
+        if value is None:
+            value = SAMPLING_MODES[mode]
+        if mode != 'interval':
+            if value != int(value):
+                raise ValueError(f"il valore di '{mode}' deve essere un numero intero")
+            value = int(value)
+        if value <= 0 or (mode in TRACK_MODES and value < 2):
+            raise ValueError(f"valore non valido per '{mode}': {value:g}")
+        self.mode = mode
+        self.value = value
+
+    @classmethod
+    def parse(cls, spec: str) -> "SamplingSettings":
+        """Interpreta 'modo' oppure 'modo:valore' (es. 'every:10', 'lttb:300')"""
+        mode, _, value = spec.strip().partition(':')
+        try:
+            number = float(value) if value else None
+        except ValueError:
+            raise ValueError(f"valore non valido: {value}") from None
+        return cls(mode.strip().lower(), number)
+
+    def to_dict(self) -> Dict:
+        """Argomenti per ricreare le impostazioni (es. nei processi di un pool)"""
+        return {'mode': self.mode, 'value': self.value}
+
+    def sampler(self) -> "Sampler":
+        """Nuovo campionatore per un file"""
+        if self.mode == 'every':
+            return EverySampler(self.value)
+        if self.mode == 'interval':
+            return IntervalSampler(self.value)
+        if self.mode == 'reservoir':
+            return ReservoirSampler(self.value)
+        return TrackSampler(self.mode, self.value)
+
+
+def check_sampling_dependencies(settings: Optional[SamplingSettings]):
+    """Verifica che NumPy sia installato per le modalità che riducono la traccia"""
+    if settings is None or settings.mode not in TRACK_MODES:
+        return
+    try:
+        import numpy  # noqa: F401
+    except ImportError:
+        raise RuntimeError(f"Il campionamento '{settings.mode}' richiede il modulo 'numpy': "
+                           "pip install numpy") from None
+
+
+class Sampler:
+    """
+    Base dei campionatori: riceve i record uno alla volta con add() e
+    restituisce i record scelti con samples(), in ordine
+    """
+
+    # Descrizione mostrata nel .txt
+    description = ''
+
+    def __init__(self):
+        self.count = 0
+
+    def add(self, fields: List[Tuple[str, object]]):
+        raise NotImplementedError
+
+    def samples(self) -> List[Tuple[int, List[Tuple[str, object]]]]:
+        """Coppie (posizione del record, campi) dei record scelti"""
+        raise NotImplementedError
+
+    def indices(self) -> List[int]:
+        """Posizioni dei record scelti, in ordine"""
+        return [index for index, _ in self.samples()]
+
+
+class _StreamSampler(Sampler):
+    """Campionatori che decidono record per record; l'ultimo record viene sempre tenuto"""
+
+    def __init__(self):
+        super().__init__()
+        self._samples: List[Tuple[int, List]] = []
+        self._last: Optional[Tuple[int, List]] = None
+
+    def keep(self, fields) -> bool:
+        raise NotImplementedError
+
+    def add(self, fields):
+        index = self.count
+        self.count += 1
+        if self.keep(fields):
+            self._samples.append((index, fields))
+            self._last = None
+        else:
+            self._last = (index, fields)
+
+    def samples(self):
+        if self._last is not None:
+            return self._samples + [self._last]
+        return self._samples
+
+
+class EverySampler(_StreamSampler):
+    """Un record ogni step"""
+
+    def __init__(self, step: int):
+        super().__init__()
+        self.step = step
+        self.description = f"un record ogni {step}"
+
+    def keep(self, fields) -> bool:
+        return (self.count - 1) % self.step == 0
+
+
+class IntervalSampler(_StreamSampler):
+    """
+    Il primo record dopo ogni intervallo di seconds secondi dall'ultimo
+    tenuto (i record senza timestamp vengono saltati)
+    """
+
+    def __init__(self, seconds: float):
+        super().__init__()
+        self.seconds = seconds
+        self.description = f"un record ogni {seconds:g} s"
+        self._next: Optional[float] = None
+
+    def keep(self, fields) -> bool:
+        for name, value in fields:
+            if name == 'timestamp':
+                break
+        else:
+            return False
+        if not isinstance(value, datetime):
+            return False
+        moment = value.timestamp() if value.tzinfo else (value - _EPOCH).total_seconds()
+        if self._next is not None and moment < self._next:
+            return False
+        self._next = moment + self.seconds
+        return True
+
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+class ReservoirSampler(Sampler):
+    """
+    Campione casuale uniforme di size record (algoritmo R), con un seme
+    fisso: lo stesso file dà sempre lo stesso campione
+    """
+
+    def __init__(self, size: int):
+        super().__init__()
+        self.size = size
+        self.description = f"{size} record casuali"
+        self._reservoir: List[Tuple[int, List]] = []
+        self._random = random.Random(RESERVOIR_SEED)
+
+    def add(self, fields):
+        index = self.count
+        self.count += 1
+        if index < self.size:
+            self._reservoir.append((index, fields))
+        else:
+            slot = self._random.randrange(index + 1)
+            if slot < self.size:
+                self._reservoir[slot] = (index, fields)
+
+    def samples(self):
+        return sorted(self._reservoir, key=lambda sample: sample[0])
+
+
+class TrackSampler(Sampler):
+    """
+    Riduce la traccia a points punti preservandone la forma
+
+    Durante la lettura copia in array compatti i campi della traccia
+    (TRACK_FIELDS) e quelli mostrati nel .txt (SAMPLE_FIELDS), senza tenere
+    i messaggi: pochi numeri per record; alla fine sceglie i punti con
+    Ramer-Douglas-Peucker (mode 'rdp': si aggiunge ogni volta il punto più
+    lontano dalla traccia semplificata, fino a points punti) o con
+    Largest-Triangle-Three-Buckets ('lttb': un punto per intervallo, quello
+    che forma il triangolo più grande con i vicini). Le distanze sono in metri: posizione proiettata
+    e altitudine; senza GPS, distanza percorsa (o posizione del record) e
+    altitudine. Primo e ultimo punto vengono sempre tenuti.
+    """
+
+    def __init__(self, mode: str, points: int):
+        super().__init__()
+        self.mode = mode
+        self.points = points
+        if mode == 'rdp':
+            self.description = f"traccia semplificata (Ramer-Douglas-Peucker) a {points} punti"
+        else:
+            self.description = f"traccia ridotta (LTTB) a {points} punti"
+        self._index = array('l')
+        self._values = {name: array('d') for name in TRACK_FIELDS}
+        # Valori di SAMPLE_FIELDS (NaN se assenti) e loro tipo; i rari valori
+        # che non sono numeri o date restano in _other
+        self._samples = {name: (array('d'), array('b')) for name in SAMPLE_FIELDS}
+        self._other: Dict[Tuple[int, str], object] = {}
+
+    def add(self, fields):
+        index = self.count
+        self.count += 1
+        values = dict(fields)
+        if values.get('altitude') is None:
+            values['altitude'] = values.get('enhanced_altitude')
+        track = [values.get(name) for name in TRACK_FIELDS]
+        if all(value is None for value in track):
+            return
+        position = len(self._index)
+        self._index.append(index)
+        for name, value in zip(TRACK_FIELDS, track):
+            self._values[name].append(float(value) if isinstance(value, (int, float))
+                                      else math.nan)
+        for name, (numbers, kinds) in self._samples.items():
+            value = values.get(name)
+            kind = type(value)
+            if value is None:
+                numbers.append(math.nan)
+                kinds.append(_MISSING)
+            elif kind is float:
+                numbers.append(value)
+                kinds.append(_FLOAT)
+            elif kind is int and abs(value) < 2 ** 53:
+                numbers.append(value)
+                kinds.append(_INT)
+            elif kind is datetime and value.tzinfo is None:
+                numbers.append((value - _EPOCH).total_seconds())
+                kinds.append(_TIME)
+            else:
+                numbers.append(math.nan)
+                kinds.append(_OTHER)
+                self._other[position, name] = value
+
+    def samples(self):
+        samples = []
+        for position in self._choose():
+            fields = []
+            for name, (numbers, kinds) in self._samples.items():
+                kind = kinds[position]
+                if kind == _FLOAT:
+                    fields.append((name, numbers[position]))
+                elif kind == _INT:
+                    fields.append((name, int(numbers[position])))
+                elif kind == _TIME:
+                    fields.append((name, _EPOCH + timedelta(seconds=numbers[position])))
+                elif kind == _OTHER:
+                    fields.append((name, self._other[position, name]))
+            samples.append((self._index[position], fields))
+        return samples
+
+    def _coordinates(self):
+        """Punti utilizzabili (posizioni negli array) e loro coordinate in metri"""
+        import numpy as np
+
+        values = {name: np.frombuffer(self._values[name], dtype=np.float64)
+                  for name in TRACK_FIELDS}
+        latitude, longitude = values['position_lat'], values['position_long']
+        altitude = np.nan_to_num(values['altitude'])
+        has_position = ~(np.isnan(latitude) | np.isnan(longitude))
+        if has_position.any():
+            usable = np.flatnonzero(has_position)
+            latitude = np.radians(latitude[usable] * SEMICIRCLES)
+            longitude = np.radians(longitude[usable] * SEMICIRCLES)
+            x = EARTH_RADIUS * longitude * math.cos(float(latitude.mean()))
+            y = EARTH_RADIUS * latitude
+            return usable, np.column_stack((x, y, altitude[usable]))
+
+        # Senza GPS: profilo altimetrico sulla distanza (o sulla posizione del record)
+        distance = values['distance']
+        usable = np.arange(len(distance))
+        if np.isnan(distance).any():
+            x = np.asarray(self._index, dtype=np.float64)
+        else:
+            x = distance
+        return usable, np.column_stack((x, altitude, np.zeros(len(x))))
+
+    def _choose(self) -> List[int]:
+        if not self._index:
+            return []
+        usable, points = self._coordinates()
+        if len(usable) <= self.points:
+            return list(usable)
+        if self.mode == 'rdp':
+            chosen = _rdp(points, self.points)
+        else:
+            chosen = _lttb(points, self.points)
+        return [int(usable[position]) for position in chosen]
+
+
+def _rdp(points, target: int) -> List[int]:
+    """
+    Ramer-Douglas-Peucker con un numero di punti invece di una tolleranza:
+    si divide sempre il segmento con il punto più lontano dalla sua corda
+    """
+    import numpy as np
+
+    def farthest(start: int, end: int):
+        if end - start < 2:
+            return None
+        inner = points[start + 1:end] - points[start]
+        chord = points[end] - points[start]
+        length = np.linalg.norm(chord)
+        if length == 0:
+            distances = np.linalg.norm(inner, axis=1)
+        else:
+            distances = np.linalg.norm(np.cross(inner, chord), axis=1) / length
+        position = int(np.argmax(distances))
+        return -float(distances[position]), start, end, start + 1 + position
+
+    last = len(points) - 1
+    chosen = [0, last]
+    heap = []
+    segment = farthest(0, last)
+    if segment is not None:
+        heap.append(segment)
+    while heap and len(chosen) < target:
+        distance, start, end, split = heapq.heappop(heap)
+        if distance == 0:
+            break
+        chosen.append(split)
+        for part in (farthest(start, split), farthest(split, end)):
+            if part is not None:
+                heapq.heappush(heap, part)
+    return sorted(chosen)
+
+
+def _lttb(points, target: int) -> List[int]:
+    """Largest-Triangle-Three-Buckets: target - 2 intervalli tra il primo e l'ultimo punto"""
+    import numpy as np
+
+    count = len(points)
+    edges = np.linspace(1, count - 1, target - 1).astype(np.int64)
+    chosen = [0]
+    previous = points[0]
+    for bucket in range(target - 2):
+        start, end = edges[bucket], max(edges[bucket + 1], edges[bucket] + 1)
+        if bucket + 2 < len(edges):
+            following = points[edges[bucket + 1]:max(edges[bucket + 2], edges[bucket + 1] + 1)]
+            average = following.mean(axis=0)
+        else:
+            average = points[-1]
+        candidates = points[start:end]
+        areas = np.linalg.norm(np.cross(candidates - previous, average - previous), axis=1)
+        position = start + int(np.argmax(areas))
+        chosen.append(position)
+        previous = points[position]
+    chosen.append(count - 1)
+    return chosen
@@ -0,0 +1,483 @@
+"""
+Servizio di conversione HTTP
+Riceve il contenuto dei file .fit con POST su una porta locale o su un
+socket Unix e restituisce il riepilogo .txt o il formato colonnare; la
+decodifica avviene in un pool di processi con concorrenza limitata,
+rifiuto delle richieste in eccesso e timeout per richiesta
+"""
+
+import io
+import sys
+import json
+import time
+import signal
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from fit_analytics import AnalyticsSettings, check_analytics_dependencies
+from fit_constants import SERVER_MAX_BODY, SERVER_TIMEOUT
+from fit_core import ConversionOptions, convert, shared_cache
+from fit_export import check_format_dependencies
+from fit_input import DEFAULT_SOURCE_NAME
+from fit_limits import FileLimits
+from fit_metrics import FileMetrics
+from fit_sampling import SamplingSettings, check_sampling_dependencies
+
+DEFAULT_HOST = '127.0.0.1'
+
+# Una connessione keep-alive inattiva viene chiusa dopo questi secondi
+IDLE_TIMEOUT = 60.0
+
+# Dimensione massima della riga di richiesta più le intestazioni
+MAX_HEADER_SIZE = 64 * 1024
+
+CONTENT_TYPES = {
+    'txt': 'text/plain; charset=utf-8',
+    'csv': 'text/csv; charset=utf-8',
+    'tsv': 'text/tab-separated-values; charset=utf-8',
+    'npz': 'application/octet-stream',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+_REASONS = {
+    200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+    411: 'Length Required', 413: 'Payload Too Large', 422: 'Unprocessable Entity',
+    431: 'Request Header Fields Too Large', 500: 'Internal Server Error',
+    503: 'Service Unavailable', 504: 'Gateway Timeout',
+}
+
+_CRASHED = "processo di conversione terminato in modo anomalo"
+
+
+class HTTPError(Exception):
+    """
+    Risposta di errore: status HTTP e messaggio restituito come JSON
+
+    close=True chiude la connessione dopo la risposta, quando il corpo
+    della richiesta non è stato letto e la connessione non è più allineata.
+    """
+
+    def __init__(self, status: int, message: str, headers: Optional[Dict[str, str]] = None,
+                 close: bool = False):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.headers = headers or {}
+        self.close = close
+
+
+def parse_address(address: str) -> Tuple[str, str, int]:
+    """
+    Interpreta l'indirizzo di --listen
+
+    Args:
+        address: 'PORTA', 'HOST:PORTA' oppure 'unix:PATH'
+
+    Returns:
+        ('unix', path, 0) oppure ('tcp', host, porta)
+    """
+    if address.startswith('unix:'):
+        path = address[len('unix:'):]
+        if not path:
+            raise ValueError("indicare il path del socket (unix:PATH)")
+        return 'unix', path, 0
+    host, _, port = address.rpartition(':')
+    try:
+        port = int(port)
+    except ValueError:
+        raise ValueError(f"indirizzo non valido: {address} (usa [HOST:]PORTA o unix:PATH)") from None
+    if not 0 <= port <= 65535:
+        raise ValueError(f"porta non valida: {port}")
+    return 'tcp', host.strip('[]') or DEFAULT_HOST, port
+
+
+def _warmup_worker():
+    """Importa il decoder all'avvio del processo, non alla prima richiesta"""
+    import fit_stream  # noqa: F401
+
+
+def _convert_payload(options: Dict, payload: bytes, name: str, collect_metrics: bool,
+                     cache_config: Optional[Dict] = None
+                     ) -> Tuple[bool, object, int, List[Dict], Optional[Dict]]:
+    """
+    Converte il contenuto di un file .fit dentro un processo del pool
+
+    Returns:
+        (successo, output in bytes o messaggio di errore, numero di record,
+        punti danneggiati, metriche se richieste)
+    """
+    metrics = FileMetrics(name, track_messages=collect_metrics)
+    output = io.BytesIO()
+    result = convert(payload, output, ConversionOptions(**options), name=name, metrics=metrics,
+                     cache=shared_cache(cache_config))
+    detail = output.getvalue() if result.ok else result.error
+    return (result.ok, detail, result.records, result.issues,
+            metrics.to_dict() if collect_metrics else None)
+
+
+class ConversionServer:
+    """
+    Server HTTP/1.1 minimale (asyncio, solo libreria standard)
+
+    Endpoint:
+        POST /convert: il corpo è il file .fit, la risposta è l'output
+            convertito; parametri opzionali nella query: format, engine,
+            messages (separati da virgola), analytics (1 o 0), on_error
+            (fail, partial o resync), sample (come --sample, 'none' per
+            disattivarlo) e name (nome del file .fit); un file
+            convertito solo in parte ha l'header X-Fit-Issues
+        GET /health: stato del servizio in JSON
+
+    Le richieste oltre max_pending (in attesa o in conversione) ricevono
+    subito 503 con Retry-After, quelle oltre il timeout 504. Anche il
+    processo che converte ha un tempo massimo (quello di --file-timeout, al
+    massimo timeout; vedi fit_limits): una richiesta andata in timeout non
+    tiene occupato il suo posto nel pool, che non supera mai jobs
+    conversioni contemporanee, per più di timeout secondi.
+
+    Args:
+        converter: FitToTxtConverterCLI da cui prendere le opzioni di
+            default, il log, lo scrittore delle metriche e la cache dei
+            risultati (se attivi)
+        jobs: Processi di conversione
+        max_pending: Richieste accettate al massimo (default: 4 * jobs)
+        timeout: Secondi massimi per richiesta
+        max_body: Byte massimi del file .fit
+    """
+
+    def __init__(self, converter, jobs: int, max_pending: Optional[int] = None,
+                 timeout: float = SERVER_TIMEOUT, max_body: int = SERVER_MAX_BODY):
+        if jobs < 1:
+            raise ValueError("servono almeno 1 processo di conversione")
+        self.converter = converter
+        self.jobs = jobs
+        self.max_pending = max_pending or 4 * jobs
+        self.timeout = timeout
+        self.max_body = max_body
+        self.pending = 0
+        self.served = 0
+        self.failed = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._started = time.monotonic()
+
+    async def serve(self, address: str):
+        """Avvia il pool e il server, e resta in ascolto fino a SIGINT/SIGTERM"""
+        kind, host, port = parse_address(address)
+        self._pool = self._new_pool()
+        self._slots = asyncio.Semaphore(self.jobs)
+        socket_path = None
+
+        try:
+            if kind == 'unix':
+                socket_path = Path(host)
+                if socket_path.is_socket():
+                    socket_path.unlink()
+                server = await asyncio.start_unix_server(
+                    self._handle_connection, path=host, limit=MAX_HEADER_SIZE)
+                url = f"unix:{host}"
+            else:
+                server = await asyncio.start_server(
+                    self._handle_connection, host, port, limit=MAX_HEADER_SIZE)
+                bound_host, bound_port = server.sockets[0].getsockname()[:2]
+                url = f"http://{bound_host}:{bound_port}"
+            print(f"In ascolto su {url} ({self.jobs} processi)", flush=True)
+
+            stop = asyncio.Event()
+            loop = asyncio.get_running_loop()
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                try:
+                    loop.add_signal_handler(sig, stop.set)
+                except (NotImplementedError, RuntimeError):
+                    pass
+
+            await stop.wait()
+            server.close()
+            await server.wait_closed()
+        finally:
+            self._pool.shutdown(wait=False)
+            if socket_path is not None and socket_path.is_socket():
+                socket_path.unlink()
+
+    def _new_pool(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=self.jobs, initializer=_warmup_worker)
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            keep_alive = True
+            while keep_alive:
+                try:
+                    request = await asyncio.wait_for(self._read_head(reader), IDLE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    break
+                except HTTPError as e:
+                    await self._respond_error(writer, e, keep_alive=False)
+                    break
+                if request is None:
+                    break
+
+                method, target, headers, keep_alive = request
+                start = time.perf_counter()
+                try:
+                    status, body, response_headers = await self._dispatch(
+                        reader, writer, method, target, headers)
+                except HTTPError as e:
+                    keep_alive = keep_alive and not e.close
+                    status = e.status
+                    await self._respond_error(writer, e, keep_alive)
+                else:
+                    await self._respond(writer, status, body, response_headers, keep_alive)
+                self.converter.log(f"{method} {target} {status} "
+                                   f"{(time.perf_counter() - start) * 1000:.1f} ms")
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _read_head(self, reader: asyncio.StreamReader):
+        """Riga di richiesta e intestazioni, oppure None se il client ha chiuso"""
+        try:
+            head = await reader.readuntil(b'\r\n\r\n')
+        except asyncio.IncompleteReadError as e:
+            if not e.partial.strip():
+                return None
+            raise HTTPError(400, "richiesta incompleta")
+        except asyncio.LimitOverrunError:
+            raise HTTPError(431, "intestazioni troppo lunghe")
+
+        lines = head.decode('latin-1').split('\r\n')
+        try:
+            method, target, version = lines[0].split(' ')
+        except ValueError:
+            raise HTTPError(400, "riga di richiesta non valida")
+
+        headers = {}
+        for line in lines[1:]:
+            if line:
+                key, _, value = line.partition(':')
+                headers[key.strip().lower()] = value.strip()
+
+        connection = headers.get('connection', '').lower()
+        if version == 'HTTP/1.1':
+            keep_alive = connection != 'close'
+        else:
+            keep_alive = connection == 'keep-alive'
+        return method, target, headers, keep_alive
+
+    async def _dispatch(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                        method: str, target: str, headers: Dict[str, str]):
+        # Il corpo si legge sempre per primo, così dopo un errore la
+        # connessione resta allineata alla richiesta successiva
+        payload = await self._read_body(reader, writer, method, headers)
+
+        url = urlsplit(target)
+        if url.path == '/health':
+            if method != 'GET':
+                raise HTTPError(405, "usa GET", {'Allow': 'GET'})
+            return 200, json.dumps(self.health()).encode(), {'Content-Type': 'application/json'}
+        if url.path != '/convert':
+            raise HTTPError(404, f"endpoint sconosciuto: {url.path}")
+        if method != 'POST':
+            raise HTTPError(405, "usa POST con il file .fit nel corpo", {'Allow': 'POST'})
+        return await self._convert(url.query, payload)
+
+    async def _read_body(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                         method: str, headers: Dict[str, str]) -> bytes:
+        if 'transfer-encoding' in headers:
+            raise HTTPError(411, "indicare Content-Length", close=True)
+        length = headers.get('content-length')
+        if length is None:
+            if method == 'POST':
+                raise HTTPError(411, "indicare Content-Length")
+            return b''
+        try:
+            length = int(length)
+        except ValueError:
+            raise HTTPError(400, "Content-Length non valido", close=True)
+        if length > self.max_body:
+            raise HTTPError(413, f"file oltre il limite di {self.max_body} byte", close=True)
+        # I client che aspettano conferma prima di inviare il corpo (es. curl
+        # per i file oltre 1 MB) altrimenti attendono un secondo
+        if headers.get('expect', '').lower() == '100-continue':
+            writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+            await writer.drain()
+        return await reader.readexactly(length)
+
+    async def _convert(self, query: str, payload: bytes):
+        params = parse_qs(query)
+
+        def param(key: str, default=None):
+            values = params.get(key)
+            return values[-1] if values else default
+
+        defaults = self.converter.options
+        messages = param('messages')
+        # Il processo smette di convertire quando la richiesta va in timeout
+        limits = defaults.limits or FileLimits()
+        limits = FileLimits(limits.max_size, min(limits.timeout or self.timeout, self.timeout),
+                            limits.cpu_timeout)
+        analytics = defaults.analytics
+        try:
+            if param('analytics') is not None:
+                enabled = param('analytics').lower() not in ('0', 'false', 'no', '')
+                analytics = (analytics or AnalyticsSettings()) if enabled else None
+            sampling = defaults.sampling
+            if param('sample') is not None:
+                sampling = (SamplingSettings.parse(param('sample'))
+                            if param('sample').lower() not in ('', 'none') else None)
+            options = ConversionOptions(
+                output_format=param('format', defaults.output_format),
+                engine=param('engine', defaults.engine),
+                messages=([name.strip() for name in messages.split(',') if name.strip()]
+                          if messages is not None else defaults.messages),
+                input_mode=defaults.input_mode, analytics=analytics,
+                on_error=param('on_error', defaults.on_error), limits=limits,
+                sampling=sampling)
+            check_format_dependencies(options.output_format)
+            if analytics is not None:
+                check_analytics_dependencies()
+            check_sampling_dependencies(sampling)
+        except (ValueError, RuntimeError) as e:
+            raise HTTPError(400, str(e))
+        if not payload:
+            raise HTTPError(400, "corpo vuoto: inviare il contenuto del file .fit")
+        name = Path(param('name', DEFAULT_SOURCE_NAME)).name
+
+        # Contropressione: oltre max_pending si rifiuta subito invece di accodare
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HTTPError(503, "troppe conversioni in corso, riprovare", {'Retry-After': '1'})
+
+        self.pending += 1
+        try:
+            ok, detail, records, issues, metrics = await asyncio.wait_for(
+                self._submit(options.to_dict(), payload, name), self.timeout)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            raise HTTPError(504, f"conversione non completata entro {self.timeout:g} s")
+        finally:
+            self.pending -= 1
+
+        if metrics is not None and self.converter.metrics is not None:
+            self.converter.metrics.write(metrics)
+        if not ok:
+            self.failed += 1
+            raise HTTPError(422, detail)
+
+        self.served += 1
+        output_name = options.output_name(Path(name))
+        headers = {
+            'Content-Type': CONTENT_TYPES[options.output_format],
+            'Content-Disposition': f'attachment; filename="{output_name}"',
+            'X-Fit-Records': str(records),
+        }
+        if issues:
+            headers['X-Fit-Issues'] = str(len(issues))
+        return 200, detail, headers
+
+    async def _submit(self, options: Dict, payload: bytes, name: str):
+        """
+        Converte nel pool, con al massimo jobs conversioni contemporanee
+
+        Il posto nel pool viene liberato quando il processo finisce il file
+        (o raggiunge il suo tempo massimo), non quando la richiesta va in
+        timeout: così le richieste successive aspettano invece di
+        accumularsi nella coda interna del pool.
+        """
+        await self._slots.acquire()
+        pool = self._pool
+        try:
+            cache = self.converter.cache
+            future = asyncio.get_running_loop().run_in_executor(
+                pool, _convert_payload, options, payload, name,
+                self.converter.metrics is not None,
+                cache.config() if cache is not None else None)
+        except BrokenProcessPool:
+            self._slots.release()
+            self._restart_pool(pool)
+            return False, _CRASHED, 0, [], None
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(self._release_slot)
+
+        try:
+            return await asyncio.shield(future)
+        except BrokenProcessPool:
+            self._restart_pool(pool)
+            return False, _CRASHED, 0, [], None
+
+    def _release_slot(self, future: asyncio.Future):
+        self._slots.release()
+        # Le conversioni andate in timeout non hanno più nessuno in attesa
+        if not future.cancelled():
+            future.exception()
+
+    def _restart_pool(self, broken: ProcessPoolExecutor):
+        """Sostituisce il pool dopo il crash di un processo (una volta sola)"""
+        if self._pool is broken:
+            broken.shutdown(wait=False)
+            self._pool = self._new_pool()
+
+    def health(self) -> Dict:
+        health = {
+            'status': 'ok',
+            'jobs': self.jobs,
+            'pending': self.pending,
+            'max_pending': self.max_pending,
+            'served': self.served,
+            'failed': self.failed,
+            'rejected': self.rejected,
+            'timed_out': self.timed_out,
+            'uptime': round(time.monotonic() - self._started, 3),
+        }
+        if self.converter.cache is not None:
+            health['cache'] = self.converter.cache.stats()
+        return health
+
+    async def _respond(self, writer: asyncio.StreamWriter, status: int, body: bytes,
+                       headers: Dict[str, str], keep_alive: bool):
+        lines = [f"HTTP/1.1 {status} {_REASONS.get(status, '')}",
+                 f"Content-Length: {len(body)}",
+                 f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+        lines.extend(f"{key}: {value}" for key, value in headers.items())
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode('latin-1'))
+        writer.write(body)
+        # Contropressione verso i client lenti a leggere la risposta
+        await writer.drain()
+
+    async def _respond_error(self, writer: asyncio.StreamWriter, error: HTTPError,
+                             keep_alive: bool):
+        body = json.dumps({'ok': False, 'error': error.message}).encode()
+        headers = dict(error.headers, **{'Content-Type': 'application/json'})
+        await self._respond(writer, error.status, body, headers, keep_alive)
+
+
+def run_server(converter, address: str, jobs: int, **options) -> int:
+    """
+    Esegue il servizio fino a SIGINT/SIGTERM
+
+    Args:
+        converter: FitToTxtConverterCLI con le opzioni di default
+        address: Indirizzo di ascolto (vedi parse_address)
+        jobs: Processi di conversione
+        **options: max_pending, timeout, max_body (vedi ConversionServer)
+
+    Returns:
+        Codice di uscita
+    """
+    server = ConversionServer(converter, jobs, **options)
+    try:
+        asyncio.run(server.serve(address))
+    except KeyboardInterrupt:
+        pass
+    except (OSError, ValueError) as e:
+        print(f"Errore: {e}", file=sys.stderr)
+        return 1
+    return 0
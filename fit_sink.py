@@ -0,0 +1,367 @@
+"""
+Destinazioni dell'output
+Scrittura atomica (file temporaneo + rename) nella cartella di output, con
+compressione gzip o zstd opzionale, oppure un unico archivio .tar, .zip o
+JSON lines per tutti i risultati; i nomi di output sono sempre univoci,
+anche quando file .fit di cartelle diverse hanno lo stesso nome
+"""
+
+import io
+import os
+import json
+import time
+import base64
+from contextlib import contextmanager
+from pathlib import Path
+from typing import IO, Dict, Iterator, Optional, Tuple
+
+# Compressioni dei file nella cartella di output e relativo suffisso
+COMPRESSIONS = {'gzip': '.gz', 'zstd': '.zst'}
+
+# Disposizione dei file di output:
+# - flat: tutti nella cartella di output (i nomi ripetuti ricevono un prefisso)
+# - tree: stessa struttura di sottocartelle dell'input
+LAYOUTS = ('flat', 'tree')
+
+# Archivi riconosciuti dall'estensione
+ARCHIVE_SUFFIXES = {
+    '.tar': 'tar',
+    '.tar.gz': 'tar',
+    '.tgz': 'tar',
+    '.zip': 'zip',
+    '.jsonl': 'jsonl',
+    '.jsonl.gz': 'jsonl',
+}
+
+# Formati di output testuali, inseriti come testo nelle righe JSON
+TEXT_FORMATS = ('.txt', '.csv', '.tsv')
+
+# Livello gzip: quasi la compressione del livello 9 a una frazione del tempo
+GZIP_LEVEL = 6
+
+
+def archive_kind(path) -> Optional[str]:
+    """Tipo di archivio ('tar', 'zip', 'jsonl') dal nome del file, None se non riconosciuto"""
+    name = Path(path).name.lower()
+    for suffix in sorted(ARCHIVE_SUFFIXES, key=len, reverse=True):
+        if name.endswith(suffix):
+            return ARCHIVE_SUFFIXES[suffix]
+    return None
+
+
+def check_compression_dependencies(compression: Optional[str]):
+    """Verifica che il modulo richiesto dalla compressione sia installato"""
+    if compression is None:
+        return
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Compressione non supportata: {compression}")
+    if compression == 'zstd':
+        try:
+            import zstandard  # noqa: F401
+        except ImportError:
+            raise RuntimeError("La compressione zstd richiede il modulo 'zstandard': "
+                               "pip install zstandard") from None
+
+
+class OutputSink:
+    """
+    Base delle destinazioni: assegna i nomi dei file di output
+
+    Ogni file .fit riceve un nome univoco (senza distinzione tra maiuscole
+    e minuscole, come sui filesystem di Windows e macOS): con layout 'flat'
+    il secondo 'run.fit' di una cartella diversa diventa 'b_run.txt',
+    con layout 'tree' il nome comprende le sottocartelle ('b/run.txt').
+    I nomi vanno assegnati nel processo principale, nell'ordine dei file;
+    un file già visto (o riservato con reserve) riceve di nuovo lo stesso nome.
+
+    Con shared i nomi non dipendono dai file già visti, perché più processi
+    (shard o coda di lavoro, vedi fit_queue) scrivono nella stessa
+    destinazione: il nome di ogni file si ricava dall'elenco dei file .fit
+    della sua cartella, in ordine alfabetico, e tutti i processi arrivano
+    allo stesso risultato. Richiede il layout 'tree', perché con 'flat' un
+    nome dipenderebbe dai file di tutte le cartelle.
+
+    Args:
+        layout: 'flat' oppure 'tree' (vedi LAYOUTS)
+        root: Cartella di input, per ricavare le sottocartelle dei file
+        compression: 'gzip', 'zstd' oppure None
+        shared: Nomi uguali in tutti i processi che usano la destinazione
+    """
+
+    # True se i risultati vengono raccolti in un unico file dal processo principale
+    aggregate = False
+
+    def __init__(self, layout: str = 'flat', root: Optional[Path] = None,
+                 compression: Optional[str] = None, shared: bool = False):
+        if layout not in LAYOUTS:
+            raise ValueError(f"Disposizione non supportata: {layout}")
+        if shared and layout != 'tree':
+            raise ValueError("più processi sulla stessa destinazione richiedono il layout 'tree'")
+        if compression is not None and compression not in COMPRESSIONS:
+            raise ValueError(f"Compressione non supportata: {compression}")
+        self.layout = layout
+        self.root = Path(root) if root is not None else None
+        self.compression = compression
+        self.suffix = COMPRESSIONS[compression] if compression else ''
+        self.shared = shared
+        # Nome in minuscolo -> file .fit che lo usa, e viceversa
+        self._owners: Dict[str, str] = {}
+        self._names: Dict[str, str] = {}
+        # Con shared: (cartella, estensione) -> nome del file .fit -> nome di output
+        self._directories: Dict[Tuple[str, str], Dict[str, str]] = {}
+
+    def reserve(self, name: str, owner: str):
+        """
+        Riserva un nome per un file .fit (es. le voci del manifest)
+
+        Args:
+            owner: Path assoluto e risolto del file .fit (Path.resolve)
+        """
+        if self._claim(name, owner):
+            self._names.setdefault(owner, name)
+
+    def name(self, fit_file: Path, base: str) -> str:
+        """
+        Nome univoco, relativo alla destinazione, dell'output di fit_file
+
+        Args:
+            base: Nome dell'output senza cartelle (es. ConversionOptions.output_name)
+        """
+        owner = str(Path(fit_file).resolve())
+        previous = self._names.get(owner)
+        if previous is not None and previous.lower().endswith(
+                (os.path.splitext(base)[1] + self.suffix).lower()):
+            return previous
+        name = self._assign(fit_file, owner, base)
+        self._names[owner] = name
+        return name
+
+    def _assign(self, fit_file: Path, owner: str, base: str) -> str:
+        folders = self._folders(fit_file)
+        if self.shared:
+            extension = os.path.splitext(base)[1]
+            names = self._directory_names(Path(fit_file).parent, extension)
+            candidate = '/'.join(folders + [names.get(Path(fit_file).name, base)]) + self.suffix
+            self._claim(candidate, owner)
+            return candidate
+        if self.layout == 'tree':
+            candidate = '/'.join(folders + [base]) + self.suffix
+        else:
+            candidate = base + self.suffix
+        if self._claim(candidate, owner):
+            return candidate
+
+        # Collisione: con layout 'flat' si antepongono le cartelle del file,
+        # poi (e sempre con layout 'tree') si aggiunge un numero
+        stem, extension = os.path.splitext(base)
+        if self.layout == 'tree':
+            directory, prefix = '/'.join(folders + ['']), ''
+        else:
+            directory, prefix = '', '_'.join(folders or [Path(owner).parent.name]) + '_'
+            candidate = f"{prefix}{base}{self.suffix}"
+            if self._claim(candidate, owner):
+                return candidate
+        for number in range(2, 1000000):
+            candidate = f"{directory}{prefix}{stem}_{number}{extension}{self.suffix}"
+            if self._claim(candidate, owner):
+                return candidate
+        raise RuntimeError(f"Nessun nome di output disponibile per {fit_file}")
+
+    def _directory_names(self, directory: Path, extension: str) -> Dict[str, str]:
+        """
+        Nomi di output (senza cartelle né compressione) di tutti i file .fit
+        di una cartella, assegnati in ordine alfabetico: i nomi ripetuti
+        ricevono un numero come con reserve() e name()
+        """
+        key = (str(directory), extension)
+        names = self._directories.get(key)
+        if names is not None:
+            return names
+        try:
+            with os.scandir(directory) as scan:
+                files = sorted(entry.name for entry in scan
+                               if entry.name[-4:].lower() == '.fit' and entry.is_file())
+        except OSError:
+            files = []
+        names = {}
+        taken = set()
+        for file_name in files:
+            stem = file_name[:-4]
+            candidate = stem + extension
+            number = 2
+            while candidate.lower() in taken:
+                candidate = f"{stem}_{number}{extension}"
+                number += 1
+            taken.add(candidate.lower())
+            names[file_name] = candidate
+        self._directories[key] = names
+        return names
+
+    def _claim(self, name: str, owner: str) -> bool:
+        current = self._owners.setdefault(name.lower(), owner)
+        return current == owner
+
+    def _folders(self, fit_file: Path):
+        if self.root is None:
+            return []
+        try:
+            return list(fit_file.parent.relative_to(self.root).parts)
+        except ValueError:
+            return []
+
+    def close(self):
+        pass
+
+    def __enter__(self) -> "OutputSink":
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+class DirectorySink(OutputSink):
+    """
+    Un file per risultato nella cartella di output, scritto in modo atomico
+
+    Ogni file viene scritto in un file temporaneo nella stessa cartella e
+    rinominato solo a scrittura completata: un'interruzione non lascia mai
+    file di output troncati. Può essere usata da più processi insieme.
+
+    Args:
+        directory: Cartella di output
+        layout, root, compression, shared: Vedi OutputSink
+    """
+
+    def __init__(self, directory, layout: str = 'flat', root: Optional[Path] = None,
+                 compression: Optional[str] = None, shared: bool = False):
+        super().__init__(layout, root, compression, shared)
+        self.directory = Path(directory)
+
+    def config(self) -> Dict:
+        """Argomenti per ricreare la destinazione in un processo del pool"""
+        return {'directory': str(self.directory), 'compression': self.compression}
+
+    def path(self, name: str) -> Path:
+        return self.directory / name
+
+    @contextmanager
+    def open(self, name: str) -> Iterator[IO[bytes]]:
+        """File binario su cui scrivere l'output (già compresso se richiesto)"""
+        path = self.path(name)
+        if self.layout == 'tree' or '/' in name:
+            path.parent.mkdir(parents=True, exist_ok=True)
+        with atomic_writer(path) as f:
+            with compressor(f, self.compression, path.name[:-len(self.suffix) or None]) as out:
+                yield out
+
+
+class ArchiveSink(OutputSink):
+    """
+    Tutti i risultati in un unico file: .tar (.tar.gz, .tgz), .zip oppure
+    JSON lines (.jsonl, .jsonl.gz), con una riga per file e il contenuto in
+    'content' (testo) o 'content_base64' (npz e parquet)
+
+    L'archivio viene scritto in un file temporaneo e compare con il nome
+    finale solo alla chiusura. add() va chiamata dal processo principale.
+
+    Args:
+        path: File dell'archivio; il tipo dipende dall'estensione
+        layout, root: Vedi OutputSink (la compressione è quella dell'archivio)
+    """
+
+    aggregate = True
+
+    def __init__(self, path, layout: str = 'flat', root: Optional[Path] = None):
+        super().__init__(layout, root)
+        self.path = Path(path)
+        self.kind = archive_kind(self.path)
+        if self.kind is None:
+            raise ValueError(f"Archivio non supportato: {self.path.name} "
+                             f"(usa {', '.join(ARCHIVE_SUFFIXES)})")
+        self.count = 0
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._tmp_path = _temporary_path(self.path)
+        self._file = open(self._tmp_path, 'wb')
+        self._archive = None
+        compressed = self.path.name.lower().endswith(('.gz', '.tgz'))
+        if self.kind == 'tar':
+            import tarfile
+            self._archive = tarfile.open(fileobj=self._file, mode='w|gz' if compressed else 'w|')
+        elif self.kind == 'zip':
+            import zipfile
+            self._archive = zipfile.ZipFile(self._file, 'w', zipfile.ZIP_DEFLATED)
+        elif compressed:
+            import gzip
+            self._archive = gzip.GzipFile(filename=self.path.name[:-3], fileobj=self._file,
+                                          mode='wb', compresslevel=GZIP_LEVEL)
+
+    def add(self, name: str, data: bytes, fit_file: Optional[Path] = None, records: int = 0):
+        """Aggiunge il risultato di un file"""
+        if self.kind == 'tar':
+            import tarfile
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = int(time.time())
+            info.mode = 0o644
+            self._archive.addfile(info, io.BytesIO(data))
+        elif self.kind == 'zip':
+            import zipfile
+            info = zipfile.ZipInfo(name, time.localtime()[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED
+            self._archive.writestr(info, data)
+        else:
+            entry = {'input': str(fit_file) if fit_file is not None else None,
+                     'output': name, 'records': records}
+            if name.lower().endswith(TEXT_FORMATS):
+                entry['content'] = data.decode('utf-8')
+            else:
+                entry['content_base64'] = base64.b64encode(data).decode('ascii')
+            (self._archive or self._file).write(json.dumps(entry).encode('utf-8') + b"\n")
+        self.count += 1
+
+    def close(self):
+        """Completa l'archivio e lo rende visibile con il nome finale"""
+        if self._file.closed:
+            return
+        if self._archive is not None:
+            self._archive.close()
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+
+
+def _temporary_path(path: Path) -> Path:
+    """File temporaneo accanto a path, nascosto e diverso per ogni processo"""
+    return path.with_name(f".{path.name}.{os.getpid()}.tmp")
+
+
+@contextmanager
+def atomic_writer(path: Path) -> Iterator[IO[bytes]]:
+    """Scrive in un file temporaneo e lo rinomina in path solo se il blocco termina senza errori"""
+    tmp_path = _temporary_path(path)
+    try:
+        with open(tmp_path, 'wb') as f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+@contextmanager
+def compressor(f: IO[bytes], compression: Optional[str], name: str = '') -> Iterator[IO[bytes]]:
+    """Avvolge f in uno stream che comprime (gzip o zstd); senza compressione restituisce f"""
+    if compression is None:
+        yield f
+    elif compression == 'gzip':
+        import gzip
+        with gzip.GzipFile(filename=name, fileobj=f, mode='wb', compresslevel=GZIP_LEVEL) as out:
+            yield out
+    elif compression == 'zstd':
+        import zstandard
+        with zstandard.ZstdCompressor().stream_writer(f, closefd=False) as out:
+            yield out
+    else:
+        raise ValueError(f"Compressione non supportata: {compression}")
@@ -0,0 +1,284 @@
+"""
+Estrazione in streaming dei messaggi FIT
+Legge un file .fit in un solo passaggio mantenendo in memoria solo i dati
+necessari al file .txt (sessione, lap e un campione dei record), così la
+memoria usata non cresce con la durata dell'attività
+"""
+
+from collections import deque
+from datetime import datetime
+from functools import lru_cache
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple, TypeVar
+
+from fitparse import FitFile
+from fitparse.profile import FIELD_TYPE_TIMESTAMP
+from fitparse.utils import FitParseError
+
+from fit_constants import DEFAULT_MESSAGES, DEVELOPER_MESSAGES
+from fit_decoder import DECODE_ERRORS, FastPathUnsupported, fast_messages
+from fit_input import FitSource, Source
+
+T = TypeVar('T')
+
+# Numero di record mostrati all'inizio e alla fine della sezione punti dati
+SAMPLE_SIZE = 10
+
+
+class _SkippedMessage:
+    """Segnaposto per un messaggio dati saltato (mai restituito da get_messages)"""
+
+    type = 'skipped'
+    mesg_type = None
+
+
+_SKIPPED = _SkippedMessage()
+
+
+class StreamingFitFile(FitFile):
+    """
+    FitFile che non conserva i messaggi già letti
+
+    fitparse accumula ogni messaggio in self._messages per poterlo rileggere;
+    qui la lista viene svuotata dopo ogni messaggio perché il file viene
+    sempre letto una sola volta.
+
+    Args:
+        names: Se indicato, solo questi messaggi vengono decodificati; gli
+            altri vengono saltati leggendo la lunghezza della definizione
+    """
+
+    def __init__(self, fileish, names: Optional[Set[str]] = None, **kwargs):
+        self._names = set(names) | DEVELOPER_MESSAGES if names is not None else None
+        # definizione -> (dimensione, offset del timestamp, tipo base del timestamp)
+        self._skip_plans = {}
+        super().__init__(fileish, **kwargs)
+
+    def _parse_message(self):
+        message = super()._parse_message()
+        del self._messages[:]
+        return message
+
+    def _parse_data_message(self, header):
+        def_mesg = self._local_mesgs.get(header.local_mesg_num)
+        if self._names is None or def_mesg is None or def_mesg.name in self._names:
+            return super()._parse_data_message(header)
+
+        plan = self._skip_plans.get(id(def_mesg))
+        if plan is None or plan[0] is not def_mesg:
+            plan = self._skip_plans[id(def_mesg)] = (def_mesg,) + self._skip_plan(def_mesg)
+        _, size, ts_offset, ts_base_type = plan
+
+        data = self._read(size)
+
+        # Il timestamp serve comunque per i timestamp compressi successivi
+        if ts_offset is not None:
+            raw = ts_base_type.parse(self._read_struct(
+                ts_base_type.fmt, endian=def_mesg.endian,
+                data=data[ts_offset:ts_offset + ts_base_type.size]))
+            if raw is not None:
+                self._compressed_ts_accumulator = raw
+        if header.time_offset is not None:
+            self._compressed_ts_accumulator = self._apply_compressed_accumulation(
+                header.time_offset, self._compressed_ts_accumulator, 5)
+
+        return _SKIPPED
+
+    @staticmethod
+    def _skip_plan(def_mesg):
+        size = 0
+        ts_offset = ts_base_type = None
+        for field_def in def_mesg.field_defs + def_mesg.dev_field_defs:
+            if (field_def.def_num == FIELD_TYPE_TIMESTAMP.def_num
+                    and field_def.size == field_def.base_type.size):
+                ts_offset, ts_base_type = size, field_def.base_type
+            size += field_def.size
+        return size, ts_offset, ts_base_type
+
+
+def fitparse_messages(fit_file, names: Optional[Set[str]] = None,
+                      issues: Optional[List[Dict]] = None) -> Iterator[Tuple[str, List[Tuple[str, object]]]]:
+    """
+    Legge i messaggi di un file .fit con fitparse
+
+    Args:
+        fit_file: Path al file .fit oppure oggetto file-like
+        names: Messaggi da decodificare (None = tutti)
+        issues: Se indicata, un errore di lettura non viene sollevato: la
+            lettura si ferma al punto danneggiato, annotato nella lista
+            (offset, errore), e il CRC non viene verificato
+
+    Yields:
+        Tuple (nome messaggio, lista di coppie (campo, valore)) con i soli
+        campi valorizzati
+    """
+    if isinstance(fit_file, Path):
+        fit_file = str(fit_file)
+    fitfile = StreamingFitFile(fit_file, names=names, check_crc=issues is None)
+    messages = fitfile.get_messages()
+
+    while True:
+        offset = _tell(fitfile) if issues is not None else None
+        try:
+            message = next(messages)
+        except StopIteration:
+            return
+        except (FitParseError,) + DECODE_ERRORS as e:
+            if issues is None:
+                raise
+            issues.append({'offset': offset, 'error': str(e) or type(e).__name__,
+                           'skipped': None})
+            return
+        yield message.name, [(field.name, field.value) for field in message
+                             if field.value is not None]
+
+
+def _tell(fitfile: FitFile) -> Optional[int]:
+    try:
+        return fitfile._file.tell()
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+@lru_cache(maxsize=1024)
+def format_datetime(value: datetime) -> str:
+    """Data nel formato del file .txt (le stesse date tornano spesso: session, lap, record)"""
+    return value.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def format_fields(fields: Iterable[Tuple[str, object]]) -> Dict:
+    """Dizionario campo -> valore di un messaggio, con le date già formattate"""
+    return {name: format_datetime(value) if isinstance(value, datetime) else value
+            for name, value in fields}
+
+
+def decode(fit_file: Source, consume: Callable[[Iterator], T], engine: str = 'fitparse',
+           names: Optional[Set[str]] = DEFAULT_MESSAGES, input_mode: str = 'mmap',
+           recovery: str = 'fail', issues: Optional[List[Dict]] = None) -> T:
+    """
+    Passa i messaggi del file a consume() usando il motore di decodifica scelto
+
+    Con engine='fast' viene usato fit_decoder; se il file contiene qualcosa
+    che il decoder veloce non gestisce, la lettura riparte da capo con
+    fitparse, quindi consume() deve poter essere richiamata.
+
+    Args:
+        fit_file: Path al file .fit, contenuto in memoria o file-like
+            (vedi fit_input.FitSource)
+        consume: Funzione che riceve l'iteratore di (nome, coppie campo/valore)
+        engine: 'fast' oppure 'fitparse'
+        names: Messaggi da decodificare; gli altri vengono saltati senza
+            essere decodificati (None = tutti, solo con fitparse)
+        input_mode: Modalità di lettura dei file su disco (fit_input.INPUT_MODES)
+        recovery: Gestione dei file danneggiati (fit_constants.RECOVERY_MODES):
+            con 'partial' e 'resync' consume() riceve i messaggi letti fino
+            al punto danneggiato e i punti danneggiati finiscono in issues;
+            'resync' (riprendere dopo il punto danneggiato) richiede il
+            decoder veloce
+        issues: Lista in cui annotare i punti danneggiati
+    """
+    if recovery != 'fail' and issues is None:
+        issues = []
+    with FitSource(fit_file, input_mode) as source:
+        if engine == 'fast' and names is not None:
+            try:
+                return consume(fast_messages(source.buffer, names, recovery, issues))
+            except FastPathUnsupported:
+                if issues:
+                    # Si rilegge da capo: i punti annotati verranno ritrovati
+                    del issues[:]
+        return consume(fitparse_messages(source.reader(), names,
+                                         issues if recovery != 'fail' else None))
+
+
+class RecordSummary:
+    """
+    Riepilogo a memoria costante dei messaggi 'record'
+
+    Conserva i primi e gli ultimi SAMPLE_SIZE record, il numero totale e
+    l'unione ordinata dei campi incontrati.
+
+    Args:
+        sampler: Campionatore di fit_sampling che sostituisce testa e coda;
+            dopo format_samples() i record scelti sono in samples, come
+            coppie (posizione del record, dizionario formattato). La memoria
+            dipende allora dal campionatore: i record scelti (every,
+            interval, reservoir) o pochi numeri per record (rdp, lttb)
+    """
+
+    def __init__(self, sample_size: int = SAMPLE_SIZE, sampler=None):
+        self.sample_size = sample_size
+        self.sampler = sampler
+        self.count = 0
+        self.head: List[Dict] = []
+        self.tail = deque(maxlen=sample_size)
+        self.samples: List[Tuple[int, Dict]] = []
+        # dict usato come insieme ordinato (ordine di prima apparizione)
+        self._fields: Dict[str, None] = {}
+
+    def add_fields(self, fields: List[Tuple[str, object]]):
+        """
+        Aggiunge un record, come coppie (campo, valore) di decode()
+
+        I campioni restano coppie finché non viene chiamata format_samples().
+        """
+        self.count += 1
+        if self.sampler is not None:
+            self.sampler.add(fields)
+        else:
+            if len(self.head) < self.sample_size:
+                self.head.append(fields)
+            self.tail.append(fields)
+        known = self._fields
+        for key, _ in fields:
+            if key not in known:
+                known[key] = None
+
+    def format_samples(self):
+        """Converte i campioni aggiunti con add_fields() in dizionari formattati"""
+        if self.sampler is not None:
+            self.samples = [(index, format_fields(fields))
+                            for index, fields in self.sampler.samples()]
+        self.head = [format_fields(fields) for fields in self.head]
+        self.tail = deque(map(format_fields, self.tail), maxlen=self.sample_size)
+
+    @property
+    def fields(self) -> List[str]:
+        return list(self._fields)
+
+    @property
+    def has_tail(self) -> bool:
+        """True se ci sono record omessi tra la testa e la coda"""
+        return self.count > 2 * self.sample_size
+
+    def __len__(self):
+        return self.count
+
+
+def summarize_fields(messages: Iterable[Tuple[str, List]],
+                     sampler=None) -> Tuple[Dict, List[Dict], RecordSummary]:
+    """
+    Categorizza in un solo passaggio i messaggi (coppie campo/valore) di decode()
+
+    Solo i messaggi conservati (sessione, lap e campioni dei record) vengono
+    convertiti in dizionari con le date formattate: per tutti gli altri
+    record si aggiornano solo il conteggio e l'elenco dei campi.
+
+    Args:
+        sampler: Campionatore dei record (vedi RecordSummary)
+    """
+    session_fields = None
+    lap_fields = []
+    records = RecordSummary(sampler=sampler)
+
+    for name, fields in messages:
+        if name == 'record':
+            records.add_fields(fields)
+        elif name == 'session':
+            session_fields = fields
+        elif name == 'lap':
+            lap_fields.append(fields)
+
+    records.format_samples()
+    session_data = format_fields(session_fields) if session_fields is not None else {}
+    return session_data, [format_fields(fields) for fields in lap_fields], records
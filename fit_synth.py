@@ -0,0 +1,295 @@
+"""
+Generatore di file FIT sintetici
+Produce attività deterministiche (stesso seme -> stessi byte) con durata,
+frequenza di campionamento, campi, developer field, lap e messaggi HRV
+configurabili, da usare come corpus per benchmark e prove di regressione
+"""
+
+import math
+import random
+import struct
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# Inizio delle attività generate (secondi dall'epoch FIT 1989-12-31)
+START_TIMESTAMP = 1_000_000_000
+
+# Campi dei messaggi 'record' nell'ordine in cui vengono aggiunti:
+# nome -> (numero campo, tipo base FIT)
+RECORD_FIELDS = {
+    'position_lat': (0, 0x85),
+    'position_long': (1, 0x85),
+    'altitude': (2, 0x84),
+    'heart_rate': (3, 0x02),
+    'cadence': (4, 0x02),
+    'distance': (5, 0x86),
+    'speed': (6, 0x84),
+    'power': (7, 0x84),
+    'grade': (9, 0x83),
+    'temperature': (13, 0x01),
+    'accumulated_power': (29, 0x86),
+    'left_right_balance': (30, 0x02),
+    'vertical_oscillation': (39, 0x84),
+    'stance_time': (41, 0x84),
+    'enhanced_speed': (73, 0x86),
+    'enhanced_altitude': (78, 0x86),
+}
+
+# Campi 'record' generati di default: quelli mostrati nel riepilogo .txt
+DEFAULT_FIELDS = 8
+
+# Formato struct dei tipi base FIT usati
+_BASE_FORMATS = {
+    0x00: 'B', 0x01: 'b', 0x02: 'B', 0x0D: 'B', 0x83: 'h', 0x84: 'H',
+    0x85: 'i', 0x86: 'I', 0x88: 'f', 0x8C: 'I',
+}
+_STRING = 0x07
+
+# Tipi dei developer field, assegnati a rotazione
+_DEV_BASE_TYPES = (0x84, 0x88)
+
+_SEMICIRCLES = 2 ** 31 / 180
+
+
+def _crc_table() -> List[int]:
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+
+_CRC_TABLE = _crc_table()
+
+
+def fit_crc(data: bytes, crc: int = 0) -> int:
+    """CRC-16 dei file FIT"""
+    table = _CRC_TABLE
+    for byte in data:
+        crc = (crc >> 8) ^ table[(crc ^ byte) & 0xFF]
+    return crc
+
+
+class _Message:
+    """Definizione di un messaggio con lo struct per i dati già compilato"""
+
+    def __init__(self, local: int, global_num: int, fields: List[tuple],
+                 dev_fields: Optional[List[tuple]] = None):
+        self.header = bytes([local])
+        dev_fields = dev_fields or []
+
+        fmt = '<'
+        definition = bytearray([0x40 | local | (0x20 if dev_fields else 0), 0, 0])
+        definition += struct.pack('<HB', global_num, len(fields))
+        for num, base_type, count in fields:
+            if base_type == _STRING:
+                size, code = count, f'{count}s'
+            else:
+                code = f'{count}{_BASE_FORMATS[base_type]}'
+                size = struct.calcsize('<' + code)
+            definition += bytes([num, size, base_type])
+            fmt += code
+        if dev_fields:
+            definition.append(len(dev_fields))
+            for num, base_type in dev_fields:
+                code = _BASE_FORMATS[base_type]
+                definition += bytes([num, struct.calcsize('<' + code), 0])
+                fmt += code
+        self.definition = bytes(definition)
+        self.struct = struct.Struct(fmt)
+
+    def data(self, *values) -> bytes:
+        return self.header + self.struct.pack(*values)
+
+
+def generate_fit(duration: int = 3600, sample_rate: float = 1.0,
+                 fields: int = DEFAULT_FIELDS, dev_fields: int = 0, laps: int = 1,
+                 hrv: int = 0, seed: int = 0, start: int = START_TIMESTAMP,
+                 serial_number: Optional[int] = None) -> bytes:
+    """
+    Genera il contenuto di un file FIT di attività
+
+    Args:
+        duration: Durata dell'attività in secondi
+        sample_rate: Record al secondo (es. 1, 4, oppure 0.25 per la
+            registrazione "smart" ogni 4 secondi)
+        fields: Numero di campi per record, oltre al timestamp (vedi RECORD_FIELDS)
+        dev_fields: Numero di developer field aggiunti a ogni record
+        laps: Numero di lap in cui è divisa l'attività
+        hrv: Messaggi 'hrv' (intervalli R-R) scritti dopo ogni record
+        seed: Seme del generatore casuale
+        start: Timestamp FIT del primo record
+        serial_number: Numero di serie del dispositivo (default: dal seme),
+            es. lo stesso per i file di un'attività divisa (vedi fit_merge)
+
+    Returns:
+        I byte del file, CRC compresi
+    """
+    if duration < 1 or sample_rate <= 0:
+        raise ValueError("Durata e frequenza di campionamento devono essere positive")
+    if not 0 <= fields <= len(RECORD_FIELDS):
+        raise ValueError(f"Il numero di campi deve essere tra 0 e {len(RECORD_FIELDS)}")
+    if dev_fields < 0 or laps < 1 or hrv < 0:
+        raise ValueError("Developer field, lap e HRV non possono essere negativi")
+
+    rnd = random.Random(seed)
+    chunks = []
+
+    file_id = _Message(0, 0, [(0, 0x00, 1), (1, 0x84, 1), (2, 0x84, 1),
+                              (3, 0x8C, 1), (4, 0x86, 1)])
+    if serial_number is None:
+        serial_number = 3_000_000_000 + seed
+    chunks += [file_id.definition, file_id.data(4, 1, 3121, serial_number, start)]
+
+    if dev_fields:
+        data_id = _Message(1, 207, [(1, 0x0D, 16), (3, 0x02, 1)])
+        chunks += [data_id.definition, data_id.data(*range(16), 0)]
+        description = _Message(1, 206, [(0, 0x02, 1), (1, 0x02, 1), (2, 0x02, 1),
+                                         (3, _STRING, 16), (8, _STRING, 8)])
+        chunks.append(description.definition)
+        for num in range(dev_fields):
+            base_type = _DEV_BASE_TYPES[num % len(_DEV_BASE_TYPES)]
+            chunks.append(description.data(0, num, base_type, f'dev_{num}'.encode(), b'u'))
+
+    event = _Message(2, 21, [(253, 0x86, 1), (0, 0x00, 1), (1, 0x00, 1), (3, 0x86, 1)])
+    chunks += [event.definition, event.data(start, 0, 0, 0)]
+
+    names = list(RECORD_FIELDS)[:fields]
+    dev_types = [_DEV_BASE_TYPES[num % len(_DEV_BASE_TYPES)] for num in range(dev_fields)]
+    record = _Message(3, 20, [(253, 0x86, 1)] + [RECORD_FIELDS[name] + (1,) for name in names],
+                      list(enumerate(dev_types)))
+    chunks.append(record.definition)
+
+    hrv_message = _Message(4, 78, [(0, 0x84, 5)])
+    if hrv:
+        chunks.append(hrv_message.definition)
+
+    lap = _Message(5, 19, [(253, 0x86, 1), (2, 0x86, 1), (7, 0x86, 1), (8, 0x86, 1),
+                           (9, 0x86, 1), (15, 0x02, 1), (16, 0x02, 1)])
+    chunks.append(lap.definition)
+
+    count = max(1, int(duration * sample_rate))
+    lap_size = max(1, math.ceil(count / laps))
+
+    # Stato dell'atleta simulato, aggiornato con passeggiate casuali
+    lat, lon, heading = 45.46, 9.19, rnd.uniform(0, 2 * math.pi)
+    altitude, speed, heart_rate, cadence, power = 120.0, 8.0, 120.0, 85.0, 200.0
+    distance = accumulated = 0.0
+    lap_start, lap_distance, lap_hr, lap_max_hr, lap_count = start, 0.0, 0, 0, 0
+    dt = 1 / sample_rate
+    session_max_hr = 0
+    timestamp = start
+
+    for i in range(count):
+        timestamp = start + int(i / sample_rate)
+        speed = min(14.0, max(1.5, speed + rnd.gauss(0, 0.15)))
+        heart_rate = min(190.0, max(80.0, heart_rate + rnd.gauss(0, 0.8)))
+        cadence = min(120.0, max(50.0, cadence + rnd.gauss(0, 1.0)))
+        power = min(600.0, max(0.0, power + rnd.gauss(0, 8.0)))
+        grade = rnd.gauss(0, 2.0)
+        altitude += speed * dt * grade / 100
+        heading += rnd.gauss(0, 0.05)
+        step = speed * dt / 111_320
+        lat += step * math.cos(heading)
+        lon += step * math.sin(heading) / math.cos(math.radians(lat))
+        distance += speed * dt
+        accumulated += power * dt
+
+        hr = int(heart_rate)
+        values = {
+            'position_lat': int(lat * _SEMICIRCLES),
+            'position_long': int(lon * _SEMICIRCLES),
+            'altitude': int((altitude + 500) * 5),
+            'heart_rate': hr,
+            'cadence': int(cadence),
+            'distance': int(distance * 100),
+            'speed': int(speed * 1000),
+            'power': int(power),
+            'grade': int(grade * 100),
+            'temperature': 18 + i * 10 // count,
+            'accumulated_power': int(accumulated) & 0xFFFFFFFF,
+            'left_right_balance': 0x80 | rnd.randint(45, 55),
+            'vertical_oscillation': rnd.randint(700, 1100),
+            'stance_time': rnd.randint(2200, 2800),
+            'enhanced_speed': int(speed * 1000),
+            'enhanced_altitude': int((altitude + 500) * 5),
+        }
+        dev_values = [rnd.randint(0, 1000) if base_type == 0x84 else rnd.uniform(0, 100)
+                      for base_type in dev_types]
+        chunks.append(record.data(timestamp, *[values[name] for name in names], *dev_values))
+
+        for _ in range(hrv):
+            rr = int(60_000 / heart_rate)
+            chunks.append(hrv_message.data(rr, rr + rnd.randint(-20, 20), 0xFFFF, 0xFFFF, 0xFFFF))
+
+        lap_distance += speed * dt
+        lap_hr += hr
+        lap_max_hr = max(lap_max_hr, hr)
+        session_max_hr = max(session_max_hr, hr)
+        lap_count += 1
+        if lap_count == lap_size or i == count - 1:
+            elapsed = int((timestamp - lap_start + dt) * 1000)
+            chunks.append(lap.data(timestamp, lap_start, elapsed, elapsed,
+                                   int(lap_distance * 100), lap_hr // lap_count, lap_max_hr))
+            lap_start, lap_distance, lap_hr, lap_max_hr, lap_count = timestamp, 0.0, 0, 0, 0
+
+    chunks.append(event.data(timestamp, 0, 4, 0))
+
+    elapsed = int(duration * 1000)
+    session = _Message(6, 18, [(253, 0x86, 1), (2, 0x86, 1), (5, 0x00, 1), (6, 0x00, 1),
+                               (7, 0x86, 1), (8, 0x86, 1), (9, 0x86, 1), (17, 0x02, 1),
+                               (26, 0x84, 1)])
+    chunks += [session.definition,
+               session.data(timestamp, start, 2, 0, elapsed, elapsed,
+                            int(distance * 100), session_max_hr, laps)]
+
+    body = b''.join(chunks)
+    header = struct.pack('<BBHI4s', 14, 0x20, 2132, len(body), b'.FIT')
+    header += struct.pack('<H', fit_crc(header))
+    return header + body + struct.pack('<H', fit_crc(body, fit_crc(header)))
+
+
+def write_corpus(output_dir: Path, files: int = 10, seed: int = 0, **options) -> List[Path]:
+    """
+    Scrive un corpus di file sintetici (synthetic_0001.fit, ...)
+
+    Ogni file usa il seme seed + indice, quindi lo stesso comando produce
+    sempre gli stessi file. Le altre opzioni sono quelle di generate_fit.
+    """
+    output_dir.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for index in range(files):
+        path = output_dir / f"synthetic_{index + 1:04d}.fit"
+        path.write_bytes(generate_fit(seed=seed + index, **options))
+        paths.append(path)
+    return paths
+
+
+def corpus_options(args) -> Dict:
+    """Opzioni di generate_fit prese dagli argomenti della riga di comando"""
+    return {'duration': args.duration, 'sample_rate': args.sample_rate,
+            'fields': args.fields, 'dev_fields': args.dev_fields,
+            'laps': args.laps, 'hrv': args.hrv}
+
+
+def add_corpus_arguments(parser):
+    """Aggiunge a un parser argparse le opzioni del generatore"""
+    parser.add_argument('--files', type=int, default=10,
+                        help='Numero di file da generare (default: 10)')
+    parser.add_argument('--duration', type=int, default=3600,
+                        help='Durata di ogni attività in secondi (default: 3600)')
+    parser.add_argument('--sample-rate', type=float, default=1.0,
+                        help='Record al secondo (default: 1)')
+    parser.add_argument('--fields', type=int, default=DEFAULT_FIELDS,
+                        help=f'Campi per record oltre al timestamp, 0-{len(RECORD_FIELDS)} '
+                             f'(default: {DEFAULT_FIELDS})')
+    parser.add_argument('--dev-fields', type=int, default=0,
+                        help='Developer field per record (default: 0)')
+    parser.add_argument('--laps', type=int, default=1,
+                        help='Numero di lap (default: 1)')
+    parser.add_argument('--hrv', type=int, default=0,
+                        help='Messaggi HRV dopo ogni record (default: 0)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seme del generatore (default: 0)')
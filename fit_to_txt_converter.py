@@ -5,21 +5,28 @@ Converte file .fit (Garmin/fitness) in file .txt leggibili
 """
 
 import os
-import sys
+import queue
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, scrolledtext
+from contextlib import closing
 from datetime import datetime
 import threading
 from pathlib import Path
 
-# Prova a importare fitparse
-try:
-    from fitparse import FitFile
-except ImportError:
-    print("Installazione di fitparse in corso...")
-    import subprocess
-    subprocess.check_call([sys.executable, "-m", "pip", "install", "fitparse", "--break-system-packages"])
-    from fitparse import FitFile
+from fit_core import ConversionOptions, check_dependencies, convert_parallel
+from fit_discovery import discover
+
+# Intervallo tra due aggiornamenti dell'interfaccia durante la conversione (ms)
+REFRESH_MS = 50
+
+# Risultati elaborati al massimo per ogni aggiornamento, per non bloccare la finestra
+MAX_RESULTS_PER_REFRESH = 500
+
+# Righe mantenute nel log: le più vecchie vengono eliminate
+MAX_LOG_LINES = 2000
+
+# Segnala alla finestra che il thread di conversione ha finito
+_DONE = object()
 
 
 class FitToTxtConverter:
@@ -34,6 +41,14 @@ class FitToTxtConverter:
         self.processing = False
         self.files_to_process = []
         
+        # Stato della conversione in corso: il thread di conversione scrive
+        # solo nella coda, la finestra la svuota con root.after()
+        self.results = None
+        self.cancel_event = None
+        self.converted = 0
+        self.successful = 0
+        self.failed = 0
+        
         self.setup_ui()
         
     def setup_ui(self):
@@ -74,6 +89,10 @@ class FitToTxtConverter:
                                         command=self.start_conversion, state='disabled')
         self.convert_button.pack(side=tk.LEFT, padx=5)
         
+        self.cancel_button = ttk.Button(button_frame, text="Annulla",
+                                       command=self.cancel_conversion, state='disabled')
+        self.cancel_button.pack(side=tk.LEFT, padx=5)
+        
         # Progress bar
         self.progress = ttk.Progressbar(main_frame, mode='determinate')
         self.progress.grid(row=5, column=0, columnspan=3, sticky=(tk.W, tk.E), pady=10)
@@ -100,10 +119,17 @@ class FitToTxtConverter:
         
     def log(self, message):
         """Aggiunge un messaggio al log"""
+        self.append_log([message])
+        
+    def append_log(self, messages):
+        """Aggiunge più messaggi al log con un solo inserimento, tenendo al massimo MAX_LOG_LINES righe"""
         timestamp = datetime.now().strftime("%H:%M:%S")
-        self.log_text.insert(tk.END, f"[{timestamp}] {message}\n")
+        self.log_text.insert(tk.END, "".join(f"[{timestamp}] {message}\n" for message in messages))
+        
+        lines = int(self.log_text.index('end-1c').split('.')[0])
+        if lines > MAX_LOG_LINES:
+            self.log_text.delete('1.0', f'{lines - MAX_LOG_LINES}.0')
         self.log_text.see(tk.END)
-        self.root.update_idletasks()
         
     def select_input_folder(self):
         """Seleziona la cartella con i file .fit"""
@@ -146,7 +172,7 @@ class FitToTxtConverter:
             return
             
         folder = Path(self.input_folder.get())
-        self.files_to_process = list(folder.glob("*.fit")) + list(folder.glob("*.FIT"))
+        self.files_to_process = list(discover(folder))
         
         if not self.files_to_process:
             self.log("Nessun file .fit trovato nella cartella")
@@ -166,135 +192,122 @@ class FitToTxtConverter:
             messagebox.showwarning("Attenzione", "Scansiona prima i file")
             return
             
-        # Avvia conversione in thread separato
-        thread = threading.Thread(target=self.convert_files)
-        thread.daemon = True
-        thread.start()
-        
-    def convert_files(self):
-        """Converte tutti i file .fit in .txt"""
         self.processing = True
         self.convert_button.config(state='disabled')
         self.scan_button.config(state='disabled')
+        self.cancel_button.config(state='normal')
         
         output_dir = Path(self.output_folder.get() or self.input_folder.get())
         output_dir.mkdir(parents=True, exist_ok=True)
         
-        total_files = len(self.files_to_process)
-        successful = 0
-        failed = 0
+        self.converted = self.successful = self.failed = 0
+        self.progress['maximum'] = len(self.files_to_process)
+        self.progress['value'] = 0
+        self.status_label.config(text=f"Conversione di {len(self.files_to_process)} file...")
         
-        self.progress['maximum'] = total_files
+        # Avvia conversione in thread separato, che a sua volta usa un pool di processi
+        self.results = queue.Queue()
+        self.cancel_event = threading.Event()
+        thread = threading.Thread(target=self.convert_files,
+                                  args=(list(self.files_to_process), output_dir,
+                                        self.results, self.cancel_event))
+        thread.daemon = True
+        thread.start()
         
-        for i, fit_file in enumerate(self.files_to_process, 1):
-            self.status_label.config(text=f"Conversione {i}/{total_files}: {fit_file.name}")
-            self.log(f"Conversione di {fit_file.name}...")
-            
+        self.root.after(REFRESH_MS, self.poll_results)
+        
+    def cancel_conversion(self):
+        """
+        Interrompe la conversione: i file in attesa vengono annullati subito
+        (vedi convert_parallel), quelli già avviati vengono completati
+        """
+        if self.processing and self.cancel_event is not None:
+            self.cancel_event.set()
+            self.cancel_button.config(state='disabled')
+            self.status_label.config(text="Annullamento in corso...")
+        
+    @staticmethod
+    def convert_files(files, output_dir, results, cancel_event):
+        """
+        Converte i file .fit in .txt (eseguito nel thread di conversione)
+        
+        Non tocca mai i widget: ogni risultato viene messo nella coda e
+        alla fine viene inviato _DONE.
+        """
+        try:
+            jobs = os.cpu_count() or 1
+            with closing(convert_parallel(files, output_dir, ConversionOptions(), jobs,
+                                          cancel=cancel_event)) as conversions:
+                for fit_file, ok, detail, _ in conversions:
+                    results.put((fit_file, ok, detail))
+        except Exception as e:
+            results.put((None, False, str(e)))
+        finally:
+            results.put(_DONE)
+        
+    def poll_results(self):
+        """Svuota la coda dei risultati e aggiorna la finestra (chiamato con root.after)"""
+        messages = []
+        done = False
+        for _ in range(MAX_RESULTS_PER_REFRESH):
             try:
-                # Leggi il file FIT
-                fitfile = FitFile(str(fit_file))
-                
-                # Nome file output
-                txt_file = output_dir / f"{fit_file.stem}.txt"
-                
-                with open(txt_file, 'w', encoding='utf-8') as f:
-                    f.write(f"=== Conversione file FIT: {fit_file.name} ===\n")
-                    f.write(f"Data conversione: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-                    f.write("=" * 60 + "\n\n")
-                    
-                    # Informazioni sessione
-                    f.write("INFORMAZIONI SESSIONE\n")
-                    f.write("-" * 30 + "\n")
-                    
-                    session_data = {}
-                    lap_data = []
-                    records = []
-                    
-                    # Estrai tutti i dati
-                    for record in fitfile.get_messages():
-                        record_dict = {}
-                        
-                        for field in record:
-                            if field.value is not None:
-                                field_name = field.name
-                                field_value = field.value
-                                
-                                # Formatta alcuni valori speciali
-                                if isinstance(field_value, datetime):
-                                    field_value = field_value.strftime('%Y-%m-%d %H:%M:%S')
-                                
-                                record_dict[field_name] = field_value
-                        
-                        # Categorizza i record
-                        if record.name == 'session':
-                            session_data = record_dict
-                        elif record.name == 'lap':
-                            lap_data.append(record_dict)
-                        elif record.name == 'record':
-                            records.append(record_dict)
-                    
-                    # Scrivi dati sessione
-                    if session_data:
-                        for key, value in session_data.items():
-                            f.write(f"{key}: {value}\n")
-                    
-                    # Scrivi dati lap
-                    if lap_data:
-                        f.write("\n\nDAT LAP\n")
-                        f.write("-" * 30 + "\n")
-                        for i, lap in enumerate(lap_data, 1):
-                            f.write(f"\nLap {i}:\n")
-                            for key, value in lap.items():
-                                f.write(f"  {key}: {value}\n")
-                    
-                    # Scrivi record (punti dati)
-                    if records:
-                        f.write("\n\nPUNTI DATI REGISTRATI\n")
-                        f.write("-" * 30 + "\n")
-                        f.write(f"Totale punti: {len(records)}\n\n")
-                        
-                        # Scrivi intestazioni
-                        if records:
-                            headers = list(records[0].keys())
-                            f.write("Campi disponibili: " + ", ".join(headers) + "\n\n")
-                            
-                            # Scrivi primi 10 e ultimi 10 record come esempio
-                            f.write("Primi 10 record:\n")
-                            for record in records[:10]:
-                                f.write(str(record) + "\n")
-                            
-                            if len(records) > 20:
-                                f.write("\n... [record intermedi omessi] ...\n\n")
-                                f.write("Ultimi 10 record:\n")
-                                for record in records[-10:]:
-                                    f.write(str(record) + "\n")
-                
-                self.log(f"✓ Convertito: {fit_file.name} -> {txt_file.name}")
-                successful += 1
-                
-            except Exception as e:
-                self.log(f"✗ Errore con {fit_file.name}: {str(e)}")
-                failed += 1
+                item = self.results.get_nowait()
+            except queue.Empty:
+                break
+            if item is _DONE:
+                done = True
+                break
             
-            self.progress['value'] = i
-            self.root.update_idletasks()
+            fit_file, ok, detail = item
+            if fit_file is None:
+                messages.append(f"✗ Errore: {detail}")
+                continue
+            self.converted += 1
+            if ok:
+                self.successful += 1
+                messages.append(f"✓ Convertito: {fit_file.name} -> {Path(detail).name}")
+            else:
+                self.failed += 1
+                messages.append(f"✗ Errore con {fit_file.name}: {detail}")
+        
+        if messages:
+            self.append_log(messages)
+            self.progress['value'] = self.converted
+            if not self.cancel_event.is_set():
+                self.status_label.config(
+                    text=f"Conversione {self.converted}/{len(self.files_to_process)}")
+        
+        if done:
+            self.finish_conversion()
+        else:
+            self.root.after(REFRESH_MS, self.poll_results)
+        
+    def finish_conversion(self):
+        """Ripristina la finestra alla fine (o all'annullamento) della conversione"""
+        cancelled = self.cancel_event.is_set()
+        skipped = len(self.files_to_process) - self.converted
         
-        # Completamento
         self.processing = False
         self.convert_button.config(state='normal')
         self.scan_button.config(state='normal')
+        self.cancel_button.config(state='disabled')
         
-        message = f"Conversione completata!\n\n✓ Successo: {successful} file\n✗ Falliti: {failed} file"
-        self.status_label.config(text="Conversione completata")
+        title = "Conversione annullata" if cancelled else "Conversione completata"
+        message = f"{title}!\n\n✓ Successo: {self.successful} file\n✗ Falliti: {self.failed} file"
+        if cancelled:
+            message += f"\n↷ Non convertiti: {skipped} file"
+        self.status_label.config(text=title)
         self.log(message)
         messagebox.showinfo("Completato", message)
         
         # Reset
         self.files_to_process = []
         self.progress['value'] = 0
+        self.results = None
 
 
 def main():
+    check_dependencies()
     root = tk.Tk()
     app = FitToTxtConverter(root)
     root.mainloop()
@@ -6,24 +6,69 @@ Converte file .fit (Garmin/fitness) in file .txt leggibili
 
 import os
 import sys
+import json
 import argparse
 from datetime import datetime
 from pathlib import Path
-from typing import List, Tuple
+from typing import Iterable, Optional, TextIO, Tuple
 
-# Prova a importare fitparse
-try:
-    from fitparse import FitFile
-except ImportError:
-    print("Installazione di fitparse in corso...")
-    import subprocess
-    subprocess.check_call([sys.executable, "-m", "pip", "install", "fitparse", "--break-system-packages"])
-    from fitparse import FitFile
+# fitparse, il pool di processi e il manifest vengono importati solo quando
+# servono: l'avvio della CLI resta veloce anche quando viene lanciata una
+# volta per file
+from fit_analytics import SPLIT_UNITS, AnalyticsSettings, check_analytics_dependencies
+from fit_constants import (DEFAULT_CACHE_SIZE, DEFAULT_MESSAGES, ENGINES, RECOVERY_MODES,
+                           SERVER_MAX_BODY, SERVER_TIMEOUT)
+from fit_core import ConversionOptions, Sink, check_dependencies, convert, convert_parallel
+from fit_input import INPUT_MODES, Source, source_path
+from fit_limits import FileLimits, quarantine
+from fit_merge import MERGE_GAP, MergedActivity
+from fit_queue import DEFAULT_LEASE, WorkQueue, parse_shard
+from fit_metrics import PROFILE_MODES, FileMetrics, MetricsWriter, profile_run
+from fit_sampling import SamplingSettings, check_sampling_dependencies
+from fit_export import EXPORT_FORMATS, check_format_dependencies
+from fit_sink import (ARCHIVE_SUFFIXES, COMPRESSIONS, LAYOUTS, ArchiveSink, DirectorySink,
+                      archive_kind, check_compression_dependencies)
+
+__version__ = "1.1.0"
 
 
 class FitToTxtConverterCLI:
-    def __init__(self, verbose: bool = True):
+    def __init__(self, verbose: bool = True, output_format: str = 'txt',
+                 engine: str = 'fitparse', messages: Optional[Iterable[str]] = None,
+                 input_mode: str = 'mmap', metrics: Optional[MetricsWriter] = None,
+                 cache=None, analytics: Optional[AnalyticsSettings] = None,
+                 on_error: str = 'fail', limits: Optional[FileLimits] = None,
+                 quarantine_dir: Optional[Path] = None, catalog=None,
+                 sampling: Optional[SamplingSettings] = None):
+        """
+        Args:
+            verbose: Stampa i messaggi di log
+            output_format, engine, messages, input_mode, analytics, on_error,
+                limits, sampling: Opzioni di conversione (vedi fit_core.ConversionOptions)
+            metrics: Se indicato, riceve tempi per fase e contatori di ogni
+                file convertito (vedi fit_metrics)
+            cache: Cache dei risultati (fit_cache.ResultCache) consultata
+                prima di decodificare ogni file
+            quarantine_dir: Se indicata, i file .fit non convertibili vengono
+                spostati qui con un report JSON dell'errore (vedi
+                fit_limits.quarantine)
+            catalog: Catalogo delle attività (fit_catalog.ActivityCatalog) in
+                cui registrare il riepilogo di ogni file convertito
+        """
         self.verbose = verbose
+        self.options = ConversionOptions(output_format, engine, messages, input_mode, analytics,
+                                         on_error, limits, catalog is not None, sampling)
+        self.metrics = metrics
+        self.cache = cache
+        self.quarantine_dir = quarantine_dir
+        self.catalog = catalog
+        # File saltati dall'ultima convert_batch incrementale
+        self.skipped = 0
+        # File convertiti in parte (danneggiati) e messi in quarantena
+        self.partial = 0
+        self.quarantined = 0
+        # Cartella di input, per riprodurne le sottocartelle nella quarantena
+        self._root: Optional[Path] = None
         
     def log(self, message: str):
         """Stampa un messaggio se verbose è attivo"""
@@ -31,127 +76,144 @@ class FitToTxtConverterCLI:
             timestamp = datetime.now().strftime("%H:%M:%S")
             print(f"[{timestamp}] {message}")
     
-    def convert_file(self, fit_file: Path, output_dir: Path) -> bool:
+    def convert_file(self, fit_file: Source, output_dir: Sink, name: Optional[str] = None,
+                     output_name: Optional[str] = None) -> bool:
         """
         Converte un singolo file .fit in .txt
         
         Args:
-            fit_file: Path al file .fit
-            output_dir: Directory dove salvare il file .txt
+            fit_file: Path al file .fit, oppure il suo contenuto (bytes) o un
+                oggetto file-like, es. un upload senza file temporaneo
+            output_dir: Directory dove salvare il file .txt, oppure una
+                destinazione di fit_sink (cartella con compressione o archivio)
+            name: Nome del file .fit, usato per l'output quando fit_file non
+                è un path (default: nome dell'oggetto file o "upload.fit")
+            output_name: Nome dell'output già assegnato dalla destinazione
             
         Returns:
             True se la conversione ha successo, False altrimenti
         """
+        return self.try_convert(fit_file, output_dir, name, output_name)[0]
+    
+    def try_convert(self, fit_file: Source, output_dir: Sink, name: Optional[str] = None,
+                    output_name: Optional[str] = None) -> Tuple[bool, str]:
+        """
+        Come convert_file, ma restituisce anche il dettaglio del risultato
+        
+        Returns:
+            Tupla (successo, path del file di output, o nome nell'archivio,
+            oppure messaggio di errore)
+        """
+        metrics = FileMetrics(str(source_path(fit_file, name)),
+                              track_messages=self.metrics is not None)
+        result = convert(fit_file, output_dir, self.options, name, metrics, self.cache,
+                         output_name)
+        if self.metrics is not None:
+            self.metrics.write(metrics.to_dict())
+        
+        if result.ok:
+            self.log(f"✓ Convertito: {result.source} -> {result.output.name}")
+            self._report_issues(result.source, result.issues)
+            if self.catalog is not None and result.summary is not None:
+                # Un'attività unita (fit_merge) ha come chiave il primo file + '_merged'
+                if isinstance(fit_file, MergedActivity):
+                    catalog_path = Path(fit_file.name)
+                elif isinstance(fit_file, (str, Path)):
+                    catalog_path = Path(fit_file)
+                else:
+                    catalog_path = None
+                if catalog_path is not None:
+                    self.catalog.add(catalog_path, result.summary, result.records, result.output)
+            return True, str(result.output)
+        
+        self.log(f"✗ Errore con {result.source}: {result.error}")
+        if isinstance(fit_file, (str, Path)):
+            self._quarantine(Path(fit_file), result.error, result.error_type, result.issues)
+        return False, result.error
+    
+    def _report_issues(self, source: str, issues):
+        """Conta e segnala un file convertito solo in parte"""
+        if not issues:
+            return
+        self.partial += 1
+        first = issues[0]
+        self.log(f"⚠ {source}: file danneggiato, convertito in parte (punti danneggiati: "
+                 f"{len(issues)}, il primo all'offset {first['offset']}: {first['error']})")
+    
+    def _quarantine(self, fit_file: Path, error: str, error_type: Optional[str] = None,
+                    issues=None):
+        """Sposta un file non convertibile nella cartella di quarantena, se indicata"""
+        if self.quarantine_dir is None or not fit_file.is_file():
+            return
+        details = {'error_type': error_type, 'issues': issues or [], 'version': __version__,
+                   'options': self.options.to_dict()}
         try:
-            # Leggi il file FIT
-            fitfile = FitFile(str(fit_file))
-            
-            # Nome file output
-            txt_file = output_dir / f"{fit_file.stem}.txt"
-            
-            with open(txt_file, 'w', encoding='utf-8') as f:
-                f.write(f"=== Conversione file FIT: {fit_file.name} ===\n")
-                f.write(f"Data conversione: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-                f.write("=" * 60 + "\n\n")
-                
-                # Informazioni sessione
-                f.write("INFORMAZIONI SESSIONE\n")
-                f.write("-" * 30 + "\n")
-                
-                session_data = {}
-                lap_data = []
-                records = []
-                
-                # Estrai tutti i dati
-                for record in fitfile.get_messages():
-                    record_dict = {}
-                    
-                    for field in record:
-                        if field.value is not None:
-                            field_name = field.name
-                            field_value = field.value
-                            
-                            # Formatta alcuni valori speciali
-                            if isinstance(field_value, datetime):
-                                field_value = field_value.strftime('%Y-%m-%d %H:%M:%S')
-                            
-                            record_dict[field_name] = field_value
-                    
-                    # Categorizza i record
-                    if record.name == 'session':
-                        session_data = record_dict
-                    elif record.name == 'lap':
-                        lap_data.append(record_dict)
-                    elif record.name == 'record':
-                        records.append(record_dict)
-                
-                # Scrivi dati sessione
-                if session_data:
-                    for key, value in session_data.items():
-                        f.write(f"{key}: {value}\n")
-                
-                # Scrivi dati lap
-                if lap_data:
-                    f.write("\n\nDATI LAP\n")
-                    f.write("-" * 30 + "\n")
-                    for i, lap in enumerate(lap_data, 1):
-                        f.write(f"\nLap {i}:\n")
-                        for key, value in lap.items():
-                            f.write(f"  {key}: {value}\n")
-                
-                # Scrivi record (punti dati)
-                if records:
-                    f.write("\n\nPUNTI DATI REGISTRATI\n")
-                    f.write("-" * 30 + "\n")
-                    f.write(f"Totale punti: {len(records)}\n\n")
-                    
-                    # Scrivi intestazioni
-                    if records:
-                        headers = list(records[0].keys())
-                        f.write("Campi disponibili: " + ", ".join(headers) + "\n\n")
-                        
-                        # Scrivi primi 10 e ultimi 10 record come esempio
-                        f.write("Primi 10 record:\n")
-                        for record in records[:10]:
-                            # Formatta output più leggibile
-                            formatted = []
-                            for k, v in record.items():
-                                if k in ['timestamp', 'position_lat', 'position_long', 'altitude', 
-                                        'heart_rate', 'power', 'cadence', 'speed', 'distance']:
-                                    formatted.append(f"{k}={v}")
-                            f.write("  " + " | ".join(formatted) + "\n")
-                        
-                        if len(records) > 20:
-                            f.write("\n... [record intermedi omessi] ...\n\n")
-                            f.write("Ultimi 10 record:\n")
-                            for record in records[-10:]:
-                                formatted = []
-                                for k, v in record.items():
-                                    if k in ['timestamp', 'position_lat', 'position_long', 'altitude', 
-                                            'heart_rate', 'power', 'cadence', 'speed', 'distance']:
-                                        formatted.append(f"{k}={v}")
-                                f.write("  " + " | ".join(formatted) + "\n")
-            
-            self.log(f"✓ Convertito: {fit_file.name} -> {txt_file.name}")
-            return True
-            
-        except Exception as e:
-            self.log(f"✗ Errore con {fit_file.name}: {str(e)}")
-            return False
+            target = quarantine(fit_file, self.quarantine_dir, error, details, self._root)
+        except OSError as e:
+            self.log(f"✗ Quarantena non riuscita per {fit_file.name}: {e}")
+            return
+        self.quarantined += 1
+        self.log(f"→ In quarantena: {fit_file.name} -> {target}")
+    
+    def output_name(self, fit_file: Path) -> str:
+        """Nome del file di output per un file .fit"""
+        return self.options.output_name(fit_file)
     
     def convert_batch(self, input_path: Path, output_path: Path = None, 
-                     recursive: bool = False) -> Tuple[int, int]:
+                     recursive: bool = False, jobs: int = 1,
+                     incremental: bool = False, include: Iterable[str] = (),
+                     exclude: Iterable[str] = (), max_depth: Optional[int] = None,
+                     since: Optional[float] = None, layout: str = 'flat',
+                     compression: Optional[str] = None,
+                     archive: Optional[Path] = None,
+                     merge_gap: Optional[float] = None,
+                     shard: Optional[Tuple[int, int]] = None, queue=None) -> Tuple[int, int]:
         """
         Converte file .fit in batch
         
+        I file vengono convertiti man mano che la ricerca li trova (vedi
+        fit_discovery.discover e Prefetch), senza attendere l'elenco
+        completo; il totale compare nel progresso appena è noto. Ogni
+        file di output viene scritto in modo atomico e riceve un nome
+        univoco anche quando due file .fit di cartelle diverse hanno lo
+        stesso nome (vedi fit_sink).
+        
         Args:
             input_path: Path alla cartella o file .fit
             output_path: Path alla cartella di output (opzionale)
             recursive: Se True, cerca file .fit anche nelle sottocartelle
+            jobs: Numero di processi paralleli (None = numero di core)
+            incremental: Se True, salta i file già convertiti e non modificati
+                (vedi fit_manifest.ConversionManifest)
+            include, exclude: Pattern glob dei file da convertire o da saltare
+            max_depth: Livelli massimi di sottocartelle (implica recursive)
+            since: Solo i file modificati da questo timestamp Unix in poi
+            layout: 'flat' (tutto nella cartella di output) o 'tree' (stesse
+                sottocartelle dell'input)
+            compression: Comprime ogni file di output ('gzip' o 'zstd')
+            archive: Scrive tutti i risultati in questo archivio (.tar,
+                .tar.gz, .zip, .jsonl, .jsonl.gz) invece che in file separati;
+                non compatibile con incremental
+            merge_gap: Se indicato, i file dello stesso dispositivo separati da
+                non più di merge_gap secondi vengono uniti in un solo output
+                (vedi fit_merge); i file vengono prima letti tutti per
+                formare i gruppi. Non compatibile con incremental
+            shard: Tupla (i, N): converte solo i file dello shard i di N
+                (hash stabile del path relativo a input_path, vedi fit_queue)
+            queue: Coda di lavoro condivisa (fit_queue.WorkQueue): i file
+                già convertiti o presi da altri processi vengono saltati, e
+                l'esito di ogni file viene registrato. Non compatibile con
+                incremental
+            
+            Con shard o queue più processi scrivono nella stessa cartella di
+            output: serve il layout 'tree', con nomi uguali in tutti i
+            processi (vedi fit_sink.OutputSink)
             
         Returns:
             Tupla (successi, fallimenti)
         """
+        from fit_discovery import discover
+        
         # Se output_path non è specificato, usa la stessa cartella dell'input
         if output_path is None:
             if input_path.is_file():
@@ -159,42 +221,383 @@ class FitToTxtConverterCLI:
             else:
                 output_path = input_path
         
-        # Crea cartella output se non esiste
-        output_path.mkdir(parents=True, exist_ok=True)
+        if archive is not None and incremental:
+            raise ValueError("la conversione incrementale non è compatibile con un archivio")
+        if merge_gap is not None and incremental:
+            raise ValueError("la conversione incrementale non è compatibile con l'unione dei file")
+        if queue is not None and incremental:
+            raise ValueError("la conversione incrementale non è compatibile con la coda di lavoro")
+        shared = shard is not None or queue is not None
+        if shared and archive is None and layout != 'tree':
+            raise ValueError("shard e coda di lavoro richiedono il layout 'tree'")
         
-        # Trova tutti i file .fit
-        fit_files = []
-        if input_path.is_file() and input_path.suffix.lower() == '.fit':
-            fit_files = [input_path]
-        elif input_path.is_dir():
-            if recursive:
-                fit_files = list(input_path.rglob("*.fit")) + list(input_path.rglob("*.FIT"))
-            else:
-                fit_files = list(input_path.glob("*.fit")) + list(input_path.glob("*.FIT"))
+        # Trova i file .fit (un solo passaggio, restituiti man mano)
+        fit_files = discover(input_path, recursive, include, exclude, max_depth, since)
+        
+        root = input_path if input_path.is_dir() else None
+        self._root = root
+        if archive is not None:
+            sink = ArchiveSink(archive, layout, root)
+        else:
+            # Crea cartella output se non esiste
+            output_path.mkdir(parents=True, exist_ok=True)
+            sink = DirectorySink(output_path, layout, root, compression, shared)
+        
+        manifest = None
+        self.skipped = 0
+        self.partial = 0
+        self.quarantined = 0
+        if incremental:
+            from fit_manifest import ConversionManifest
+            
+            # Anche la destinazione cambia i file di output (non la chiave della cache)
+            options = dict(self.output_options(), layout=layout, compression=compression,
+                           archive=str(archive) if archive is not None else None)
+            manifest = ConversionManifest.load(output_path, __version__, options)
+            # I file già convertiti mantengono il nome di output
+            for key, entry in manifest.entries.items():
+                if entry.get('output'):
+                    sink.reserve(entry['output'], key)
+            fit_files = manifest.changed(fit_files)
+        
+        # Chiavi di shard e coda relative all'input: uguali su tutte le macchine
+        key_root = input_path if input_path.is_dir() else input_path.parent
+        if shard is not None:
+            from fit_queue import in_shard
+            
+            fit_files = in_shard(fit_files, *shard, key_root)
         
-        if not fit_files:
-            self.log(f"Nessun file .fit trovato in {input_path}")
-            return 0, 0
+        merged = []
+        prefetch = None
+        if merge_gap is not None:
+            from fit_merge import group_files
+            
+            groups = group_files(fit_files, merge_gap, self.options.engine,
+                                 self.options.input_mode, self.options.on_error)
+            merged = [MergedActivity(group) for group in groups if len(group) > 1]
+            fit_files = [group[0].path for group in groups if len(group) == 1]
+            if merged:
+                self.log(f"Attività divise in più file: {len(merged)}, "
+                         f"{sum(len(activity.spans) for activity in merged)} file da unire")
+        else:
+            # La ricerca prosegue in un thread mentre si converte: appena
+            # finisce, il progresso mostra anche il totale
+            from fit_discovery import Prefetch
+            
+            fit_files = prefetch = Prefetch(fit_files)
         
-        self.log(f"Trovati {len(fit_files)} file .fit da convertire")
+        if queue is not None:
+            # Ogni file viene preso solo quando tocca a lui (anche con il pool)
+            fit_files = queue.claimed(fit_files, key_root)
+        
+        def progress(position: int) -> str:
+            """[posizione/totale], oppure [posizione] finché il totale non è noto"""
+            if queue is not None:
+                # Parte dei file viene presa da altri processi
+                count = None
+            elif prefetch is None:
+                count = len(merged) + len(fit_files)
+            else:
+                count = prefetch.total
+            return f"[{position}/{count}]" if count is not None else f"[{position}]"
         
         successful = 0
         failed = 0
+        total = 0
         
-        for i, fit_file in enumerate(fit_files, 1):
-            print(f"[{i}/{len(fit_files)}] Conversione di {fit_file.name}...", end=" ")
+        if jobs is None:
+            jobs = os.cpu_count() or 1
+        
+        try:
+            # Le attività da unire vengono convertite qui, una alla volta
+            for total, activity in enumerate(merged, 1):
+                names = " + ".join(path.name for path in activity.paths)
+                print(f"{progress(total)} Unione di {names}...", end=" ")
+                
+                ok = self.convert_file(activity, sink)
+                if activity.duplicates:
+                    self.log(f"Record duplicati scartati: {activity.duplicates}")
+                if ok:
+                    successful += 1
+                    print("✓")
+                else:
+                    failed += 1
+                    print("✗")
+            
+            if jobs <= 1 or input_path.is_file():
+                for total, fit_file in enumerate(fit_files, total + 1):
+                    print(f"{progress(total)} Conversione di {fit_file.name}...", end=" ")
+                    
+                    output_name = sink.name(fit_file, self.output_name(fit_file))
+                    ok, detail = self.try_convert(fit_file, sink, output_name=output_name)
+                    self._update_manifest(manifest, fit_file, ok, output_name)
+                    if queue is not None:
+                        queue.finish(fit_file, ok, detail)
+                    if ok:
+                        successful += 1
+                        print("✓")
+                    else:
+                        failed += 1
+                        print("✗")
+                
+                return successful, failed
             
-            if self.convert_file(fit_file, output_path):
-                successful += 1
-                print("✓")
+            self.log(f"Conversione parallela con {jobs} processi")
+            
+            # I risultati arrivano nell'ordine di input, quindi il progresso
+            # stampato è identico a quello della modalità sequenziale
+            results = convert_parallel(fit_files, sink, self.options, jobs,
+                                       collect_metrics=self.metrics is not None,
+                                       cache=self.cache, catalog=self.catalog)
+            for total, (fit_file, ok, detail, file_metrics) in enumerate(results, total + 1):
+                print(f"{progress(total)} Conversione di {fit_file.name}...", end=" ")
+                
+                self._update_manifest(manifest, fit_file, ok, detail)
+                if queue is not None:
+                    queue.finish(fit_file, ok, detail)
+                if self.metrics is not None:
+                    self.metrics.write(file_metrics)
+                if ok:
+                    self.log(f"✓ Convertito: {fit_file.name} -> {detail}")
+                    if file_metrics is not None:
+                        self._report_issues(fit_file.name, file_metrics['issues'])
+                    successful += 1
+                    print("✓")
+                else:
+                    self.log(f"✗ Errore con {fit_file.name}: {detail}")
+                    self._quarantine(fit_file, detail, file_metrics['error_type'],
+                                     file_metrics['issues'])
+                    failed += 1
+                    print("✗")
+            
+            return successful, failed
+        finally:
+            # Il thread della ricerca usa anche il manifest: si ferma prima di salvarlo
+            if prefetch is not None:
+                prefetch.close()
+            # Un archivio compare con il nome finale solo qui, anche se
+            # interrotto: contiene i file convertiti fino a quel momento
+            sink.close()
+            if self.catalog is not None:
+                self.catalog.flush()
+            if archive is not None and total:
+                self.log(f"Archivio: {archive} ({sink.count} file)")
+            if manifest is not None:
+                self.skipped = manifest.unchanged
+                if self.skipped:
+                    self.log(f"Saltati {self.skipped} file non modificati")
+                # Salva anche in caso di interruzione, così il lavoro fatto non va perso
+                manifest.save()
+            queued = queue.skipped + queue.busy if queue is not None else 0
+            if queued:
+                self.log(f"Coda di lavoro: {queue.skipped} file già elaborati, "
+                         f"{queue.busy} in corso in altri processi")
+            if total == 0 and self.skipped == 0 and queued == 0:
+                self.log(f"Nessun file .fit trovato in {input_path}")
+    
+    def output_options(self) -> dict:
+        """Opzioni che influenzano il contenuto dei file di output"""
+        return self.options.output_options()
+    
+    def _update_manifest(self, manifest, fit_file: Path, ok: bool,
+                         output_name: Optional[str] = None):
+        """Aggiorna il manifest dopo la conversione di un file"""
+        if manifest is None:
+            return
+        if ok:
+            manifest.record(fit_file, output_name or self.output_name(fit_file))
+        else:
+            manifest.discard(fit_file)
+
+
+def serve(converter: FitToTxtConverterCLI, output_path: Optional[Path],
+          lines: Iterable[str], out: TextIO, compression: Optional[str] = None) -> int:
+    """
+    Modalità persistente: converte i file .fit indicati uno per riga
+    
+    Interprete e fitparse vengono caricati una volta sola per tutte le
+    richieste. Per ogni riga viene scritta su `out` una riga JSON con
+    input, ok e output (path del file scritto) oppure error. Le righe vuote
+    vengono ignorate; la funzione termina a fine input.
+    
+    Args:
+        output_path: Cartella di output (None = cartella di ogni file)
+        compression: Comprime ogni file di output ('gzip' o 'zstd')
+    
+    Returns:
+        Numero di file non convertiti
+    """
+    # Il costo di import si paga all'avvio, non alla prima richiesta
+    import fit_stream  # noqa: F401
+    
+    if output_path is not None:
+        output_path.mkdir(parents=True, exist_ok=True)
+    
+    failed = 0
+    for line in lines:
+        path = line.strip()
+        if not path:
+            continue
+        
+        fit_file = Path(path)
+        if fit_file.is_file():
+            sink = DirectorySink(output_path or fit_file.parent, compression=compression)
+            ok, detail = converter.try_convert(fit_file, sink)
+        else:
+            ok, detail = False, "file non trovato"
+        
+        response = {'input': path, 'ok': ok, 'output' if ok else 'error': detail}
+        out.write(json.dumps(response) + "\n")
+        out.flush()
+        if not ok:
+            failed += 1
+    
+    return failed
+
+
+def query(argv) -> int:
+    """
+    Comando query: cerca le attività nel catalogo creato con --catalog
+    
+    Returns:
+        Exit code (0 anche se non ci sono risultati)
+    """
+    import sqlite3
+    from fit_catalog import ActivityCatalog
+    
+    parser = argparse.ArgumentParser(
+        prog=f"{Path(sys.argv[0]).name} query",
+        description='Cerca le attività nel catalogo creato con --catalog',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Esempi:
+  # Le uscite in bici del 2024
+  %(prog)s attivita.sqlite --year 2024 --sport cycling
+  
+  # Corse tra 15 e 25 km da marzo, in JSON con i lap
+  %(prog)s attivita.sqlite --sport running --min-distance 15 --max-distance 25 --since 2024-03-01 --format json --laps
+  
+  # File con la stessa attività (stesso dispositivo e stessa ora di inizio)
+  %(prog)s attivita.sqlite --duplicates
+        """
+    )
+    parser.add_argument('catalog', type=str, help='File del catalogo (SQLite)')
+    parser.add_argument('--year', type=int, default=None, help='Solo le attività di questo anno')
+    parser.add_argument('--since', type=str, default=None,
+                        help='Attività iniziate da questa data (AAAA-MM-GG[THH:MM])')
+    parser.add_argument('--until', type=str, default=None,
+                        help='Attività iniziate fino a questa data compresa (AAAA-MM-GG[THH:MM])')
+    parser.add_argument('--sport', type=str, default=None, help='Sport (es. cycling, running)')
+    parser.add_argument('--device', type=int, default=None,
+                        help='Numero di serie del dispositivo')
+    parser.add_argument('--min-distance', type=float, default=None, metavar='KM',
+                        help='Distanza minima in km')
+    parser.add_argument('--max-distance', type=float, default=None, metavar='KM',
+                        help='Distanza massima in km')
+    parser.add_argument('--limit', type=int, default=None, help='Numero massimo di attività')
+    parser.add_argument('--laps', action='store_true', help='Mostra anche i lap')
+    parser.add_argument('--duplicates', action='store_true',
+                        help='Elenca i gruppi di file con la stessa attività (stesso dispositivo '
+                             'e stessa ora di inizio)')
+    parser.add_argument('--format', choices=('table', 'json', 'csv'), default='table',
+                        help='Formato dei risultati (default: table)')
+    args = parser.parse_args(argv)
+    
+    try:
+        since = _date_bound(args.since) if args.since else None
+        until = _date_bound(args.until, end=True) if args.until else None
+    except ValueError as e:
+        parser.error(str(e))
+    if args.year is not None:
+        since = max(since or '', f"{args.year:04d}-01-01")
+        until = min(until or '9999', f"{args.year + 1:04d}-01-01")
+    
+    try:
+        with ActivityCatalog(Path(args.catalog).expanduser(), readonly=True) as catalog:
+            if args.duplicates:
+                groups = catalog.duplicates()
+                activities = [activity for group in groups for activity in group]
             else:
-                failed += 1
-                print("✗")
+                groups = None
+                activities = catalog.find(
+                    since, until, args.sport, args.device,
+                    args.min_distance * 1000 if args.min_distance is not None else None,
+                    args.max_distance * 1000 if args.max_distance is not None else None,
+                    args.limit, args.laps)
+    except (OSError, sqlite3.Error) as e:
+        print(f"Errore: catalogo non utilizzabile: {e}", file=sys.stderr)
+        return 1
+    
+    if args.format == 'json':
+        print(json.dumps(groups if groups is not None else activities, indent=2))
+    elif args.format == 'csv':
+        import csv
+        
+        fields = [key for key in (activities[0] if activities else {}) if key != 'laps']
+        writer = csv.DictWriter(sys.stdout, fields, extrasaction='ignore', lineterminator='\n')
+        writer.writeheader()
+        writer.writerows(activities)
+    else:
+        _print_activities(activities, groups)
+    return 0
+
+
+def _date_bound(value: str, end: bool = False) -> str:
+    """Data di --since/--until nel formato del catalogo; --until con solo la data include il giorno"""
+    try:
+        moment = datetime.fromisoformat(value.strip())
+    except ValueError:
+        raise ValueError(f"data non valida: {value} (usa AAAA-MM-GG[THH:MM])") from None
+    if end:
+        from datetime import timedelta
         
-        return successful, failed
+        moment += timedelta(days=1) if len(value.strip()) == 10 else timedelta(seconds=1)
+    return moment.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _print_activities(activities, groups=None):
+    """Tabella delle attività, con i totali (o con una riga vuota tra i gruppi di duplicati)"""
+    def duration(seconds):
+        if seconds is None:
+            return ''
+        seconds = int(seconds)
+        return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+    
+    def number(value, scale=1.0, digits=0):
+        return f"{value * scale:.{digits}f}" if value is not None else ''
+    
+    row = "{:<19}  {:<12}  {:>8}  {:>8}  {:>4}  {:>5}  {:>12}  {}"
+    print(row.format('Inizio', 'Sport', 'km', 'Durata', 'FC', 'W', 'Dispositivo', 'File'))
+    previous = None
+    for activity in activities:
+        key = (activity['serial_number'], activity['start_time'])
+        if groups is not None and previous is not None and key != previous:
+            print()
+        previous = key
+        print(row.format(activity['start_time'] or '', activity['sport'] or '',
+                         number(activity['total_distance'], 0.001, 2),
+                         duration(activity['total_timer_time'] or activity['total_elapsed_time']),
+                         number(activity['avg_heart_rate']), number(activity['avg_power']),
+                         activity['serial_number'] or '', activity['path']))
+        for lap in activity.get('laps', ()):
+            print(row.format(f"  lap {lap['number']}", '', number(lap['total_distance'], 0.001, 2),
+                             duration(lap['total_timer_time'] or lap['total_elapsed_time']),
+                             number(lap['avg_heart_rate']), number(lap['avg_power']), '', ''))
+    
+    if groups is not None:
+        print(f"\n{len(groups)} attività duplicate in {len(activities)} file")
+    else:
+        distance = sum(activity['total_distance'] or 0 for activity in activities)
+        seconds = sum(activity['total_timer_time'] or activity['total_elapsed_time'] or 0
+                      for activity in activities)
+        print(f"\n{len(activities)} attività, {distance / 1000:.1f} km, {duration(seconds)}")
 
 
 def main():
+    # Il comando query interroga il catalogo, senza convertire
+    if len(sys.argv) > 1 and sys.argv[1] == 'query':
+        sys.exit(query(sys.argv[2:]))
+    
     parser = argparse.ArgumentParser(
         description='Converte file .fit (Garmin/Fitness) in file .txt leggibili',
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -209,49 +612,469 @@ Esempi:
   # Converti ricorsivamente (incluse sottocartelle)
   %(prog)s -r percorso/alla/cartella/
   
+  # Solo i file del 2024 modificati negli ultimi 7 giorni, al massimo 2 livelli
+  # di sottocartelle, saltando le cartelle "backup"
+  %(prog)s --max-depth 2 --include '2024-*' --exclude backup --since 7d percorso/alla/cartella/
+  
   # Specifica cartella di output
   %(prog)s percorso/input/ -o percorso/output/
   
   # Modalità silenziosa
   %(prog)s -q percorso/alla/cartella/
+  
+  # Usa 4 processi in parallelo
+  %(prog)s -j 4 percorso/alla/cartella/
+  
+  # Converti solo i file nuovi o modificati dall'ultima esecuzione
+  %(prog)s -i percorso/alla/cartella/
+  
+  # Esporta tutti i punti dati in CSV invece del riepilogo .txt
+  %(prog)s -f csv percorso/alla/cartella/
+  
+  # Statistiche dell'attività (migliori medie, zone, NP, parziali per miglio)
+  %(prog)s --analytics --ftp 250 --hr-max 185 --split-unit mi percorso/alla/cartella/
+  
+  # Un record ogni 30 secondi, o la traccia ridotta a 300 punti
+  %(prog)s --sample interval:30 percorso/alla/cartella/
+  %(prog)s --sample lttb:300 -f csv percorso/alla/cartella/
+  
+  # Usa il decoder veloce interno invece di fitparse
+  %(prog)s --engine fast percorso/alla/cartella/
+  
+  # File danneggiati: converte la parte leggibile, salta i punti corrotti,
+  # al massimo 30 secondi per file; i file non convertibili vanno in quarantena
+  %(prog)s --engine fast --on-error resync --file-timeout 30 --quarantine quarantena/ percorso/alla/cartella/
+  
+  # Solo sessione e giri, senza decodificare i punti dati
+  %(prog)s --messages session,lap percorso/alla/cartella/
+  
+  # Archivio su NFS: una sola lettura per file invece di mmap
+  %(prog)s --input-mode bulk percorso/alla/cartella/
+  
+  # Tempi per fase e contatori di ogni file in formato JSON lines
+  %(prog)s --metrics-out metriche.jsonl percorso/alla/cartella/
+  
+  # Profilo CPU dell'intera esecuzione (report su stderr)
+  %(prog)s --profile cpu percorso/alla/cartella/
+  
+  # Processo persistente: un path per riga su stdin, una riga JSON per file su stdout
+  ls *.fit | %(prog)s --serve -o percorso/output/
+  
+  # Servizio HTTP locale: POST /convert con il file .fit nel corpo
+  %(prog)s --listen 8080
+  curl --data-binary @file.fit "http://127.0.0.1:8080/convert?format=csv"
+  
+  # Lo stesso servizio su un socket Unix, con 4 processi e timeout di 10 secondi
+  %(prog)s --listen unix:/tmp/fit.sock -j 4 --timeout 10
+  
+  # Output compresso con gzip, nelle stesse sottocartelle dell'input
+  %(prog)s -r --layout tree --compress gzip percorso/alla/cartella/ -o percorso/output/
+  
+  # Tutti i risultati in un unico archivio
+  %(prog)s -r --archive risultati.tar.gz percorso/alla/cartella/
+  
+  # Riusa i risultati dei file già convertiti (anche con nomi diversi)
+  %(prog)s --cache ~/.cache/fit_to_txt.sqlite --cache-size 500 percorso/alla/cartella/
+  %(prog)s --cache ~/.cache/fit_to_txt.sqlite --cache-stats
+  
+  # Unisce le attività divise in più file (es. dopo un cambio batteria)
+  %(prog)s --merge --merge-gap 30 percorso/alla/cartella/
+  
+  # Archivio diviso tra 4 processi (anche su macchine diverse), ripresa dopo un'interruzione
+  %(prog)s -r --shard 1/4 --queue coda.sqlite --layout tree archivio/ -o output/
+  %(prog)s --queue coda.sqlite --queue-stats
+  
+  # Catalogo delle attività convertite, interrogabile senza rileggere i file
+  %(prog)s -r --catalog attivita.sqlite percorso/alla/cartella/
+  %(prog)s query attivita.sqlite --year 2024 --sport cycling
+  %(prog)s query attivita.sqlite --duplicates
         """
     )
     
-    parser.add_argument('input', type=str, 
+    parser.add_argument('input', type=str, nargs='?', default=None,
                        help='File .fit o cartella contenente file .fit')
     parser.add_argument('-o', '--output', type=str, default=None,
                        help='Cartella di output (default: stessa cartella dell\'input)')
     parser.add_argument('-r', '--recursive', action='store_true',
                        help='Cerca file .fit anche nelle sottocartelle')
+    parser.add_argument('--include', action='append', default=[], metavar='GLOB',
+                       help='Converti solo i file che soddisfano il pattern (sul nome, o sul path '
+                            'relativo se contiene /); ripetibile')
+    parser.add_argument('--exclude', action='append', default=[], metavar='GLOB',
+                       help='Salta file e cartelle che soddisfano il pattern; ripetibile')
+    parser.add_argument('--max-depth', type=int, default=None,
+                       help='Livelli massimi di sottocartelle in cui cercare (implica -r)')
+    parser.add_argument('--since', type=str, default=None,
+                       help='Solo i file modificati dopo la data indicata (AAAA-MM-GG, '
+                            'AAAA-MM-GGTHH:MM) o nell\'ultimo periodo (es. 12h, 7d)')
+    parser.add_argument('--layout', choices=LAYOUTS, default=None,
+                       help='Disposizione dei file di output: flat (default, tutti nella cartella '
+                            'di output; i nomi ripetuti ricevono il nome della cartella come '
+                            'prefisso) o tree (stesse sottocartelle dell\'input; default e unico '
+                            'valore ammesso con --shard e --queue)')
+    parser.add_argument('--compress', choices=list(COMPRESSIONS), default=None,
+                       help='Comprime ogni file di output (.gz o .zst; zstd richiede il modulo '
+                            'zstandard)')
+    parser.add_argument('--archive', type=str, default=None, metavar='FILE',
+                       help='Scrive tutti i risultati in un unico archivio invece che in file '
+                            f'separati ({", ".join(ARCHIVE_SUFFIXES)}, dall\'estensione)')
     parser.add_argument('-q', '--quiet', action='store_true',
                        help='Modalità silenziosa (meno output)')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+                       help='Numero di processi paralleli (default: numero di core)')
+    parser.add_argument('-i', '--incremental', action='store_true',
+                       help='Converti solo i file nuovi o modificati (manifest nella cartella di output)')
+    parser.add_argument('--merge', action='store_true',
+                       help='Unisce i file della stessa attività divisa in più parti (stesso '
+                            'dispositivo, a breve distanza di tempo) in un solo output, con i '
+                            'totali della sessione ricalcolati')
+    parser.add_argument('--merge-gap', type=float, default=None, metavar='MINUTI',
+                       help='Con --merge: pausa massima tra due file della stessa attività '
+                            '(default: 10 minuti)')
+    parser.add_argument('-f', '--format', choices=['txt'] + list(EXPORT_FORMATS), default='txt',
+                       help='Formato di output: riepilogo txt (default) o tutti i record in '
+                            'formato colonnare')
+    parser.add_argument('--analytics', action='store_true',
+                       help='Aggiunge le statistiche dell\'attività calcolate su tutti i record: '
+                            'migliori medie (5 s - 60 min), zone FC e potenza, normalized '
+                            'power, parziali, dislivello e tempo in movimento (richiede numpy)')
+    parser.add_argument('--hr-max', type=float, default=None,
+                       help='Con --analytics: FC massima per le zone (default: la massima '
+                            'registrata)')
+    parser.add_argument('--ftp', type=float, default=None,
+                       help='Con --analytics: FTP in watt per zone, IF e TSS (default: 95%% '
+                            'della migliore media su 20 minuti)')
+    parser.add_argument('--split-unit', choices=list(SPLIT_UNITS), default='km',
+                       help='Con --analytics: parziali per km (default) o per miglio')
+    parser.add_argument('--sample', type=str, default=None, metavar='MODO[:N]',
+                       help='Record mostrati nel .txt (o righe esportate) al posto dei primi e '
+                            'ultimi 10: every:N (uno ogni N), interval:S (uno ogni S secondi), '
+                            'reservoir:K (K casuali), rdp:K o lttb:K (traccia ridotta a K punti '
+                            'preservandone la forma, richiedono numpy)')
+    parser.add_argument('--engine', choices=ENGINES, default='fitparse',
+                       help='Motore di decodifica: fitparse (default) o fast, il decoder '
+                            'interno per record/lap/session (ripiega su fitparse se necessario)')
+    parser.add_argument('--on-error', choices=RECOVERY_MODES, default='fail',
+                       help='File danneggiati: fail (default, il file non viene convertito), '
+                            'partial (converte i dati fino al punto danneggiato) o resync '
+                            '(salta i punti danneggiati e prosegue; richiede --engine fast)')
+    parser.add_argument('--max-size', type=float, default=None, metavar='MB',
+                       help='Non converte i file .fit più grandi di questa dimensione in MB')
+    parser.add_argument('--file-timeout', type=float, default=None, metavar='SECONDI',
+                       help='Tempo massimo di conversione per file (solo Unix)')
+    parser.add_argument('--cpu-timeout', type=float, default=None, metavar='SECONDI',
+                       help='Tempo massimo di CPU per file (solo Unix)')
+    parser.add_argument('--quarantine', type=str, default=None, metavar='CARTELLA',
+                       help='Sposta qui i file .fit non convertibili, ognuno con un report '
+                            '<nome>.error.json (errore, punti danneggiati, opzioni)')
+    parser.add_argument('--messages', type=str, default=','.join(sorted(DEFAULT_MESSAGES)),
+                       help='Messaggi da decodificare, separati da virgola (default: '
+                            'lap,record,session); gli altri vengono saltati')
+    parser.add_argument('--input-mode', choices=INPUT_MODES, default='mmap',
+                       help='Lettura dei file: mmap (default) o bulk, una sola lettura con '
+                            'read-ahead, consigliata per NFS e filesystem di rete')
+    parser.add_argument('--metrics-out', type=str, default=None,
+                       help='Scrive tempi per fase (decode, categorize, format, write) e '
+                            'contatori di ogni file in questo file JSON lines, con una riga '
+                            'finale aggregata')
+    parser.add_argument('--profile', choices=PROFILE_MODES, default=None,
+                       help='Profila l\'esecuzione con cProfile (cpu) o tracemalloc (memory) '
+                            'e stampa il report su stderr; implica -j 1')
+    parser.add_argument('--profile-out', type=str, default=None,
+                       help='Salva anche i dati grezzi del profilo (pstats o snapshot '
+                            'tracemalloc) in questo file')
+    parser.add_argument('--serve', action='store_true',
+                       help='Resta in attesa di path .fit su stdin (uno per riga) e risponde '
+                            'con una riga JSON per file su stdout, fino a fine input')
+    parser.add_argument('--cache', type=str, default=None, metavar='FILE',
+                       help='Cache dei risultati (file SQLite): i file con lo stesso contenuto '
+                            'e le stesse opzioni di output non vengono decodificati di nuovo')
+    parser.add_argument('--cache-size', type=float, default=DEFAULT_CACHE_SIZE / 2**20,
+                       help='Dimensione massima della cache in MB; oltre si eliminano i '
+                            f'risultati usati meno di recente (default: {DEFAULT_CACHE_SIZE // 2**20})')
+    parser.add_argument('--cache-age', type=float, default=None,
+                       help='Giorni dopo l\'ultimo utilizzo oltre cui un risultato viene '
+                            'eliminato dalla cache (default: nessun limite)')
+    parser.add_argument('--cache-stats', action='store_true',
+                       help='Stampa in JSON le statistiche della cache (hit, miss, '
+                            'eliminazioni, occupazione) ed esce')
+    parser.add_argument('--catalog', type=str, default=None, metavar='FILE',
+                       help='Registra sessione, lap e dispositivo di ogni file convertito in '
+                            'questo catalogo SQLite, da interrogare con il comando query')
+    parser.add_argument('--shard', type=str, default=None, metavar='I/N',
+                       help='Converte solo la parte I di N dei file (es. 1/4 ... 4/4), scelta '
+                            'con un hash stabile del path: più processi o macchine si dividono '
+                            'lo stesso archivio')
+    parser.add_argument('--queue', type=str, default=None, metavar='FILE',
+                       help='Coda di lavoro condivisa (file SQLite): i processi che la usano non '
+                            'convertono mai lo stesso file e un\'esecuzione interrotta riprende '
+                            'dai file mancanti')
+    parser.add_argument('--queue-lease', type=float, default=DEFAULT_LEASE / 60, metavar='MINUTI',
+                       help='Con --queue: minuti dopo cui un file non finito da un processo di '
+                            f'un\'altra macchina torna disponibile (default: {DEFAULT_LEASE / 60:g})')
+    parser.add_argument('--retry-failed', action='store_true',
+                       help='Con --queue: riprova i file non convertiti nelle esecuzioni precedenti')
+    parser.add_argument('--queue-stats', action='store_true',
+                       help='Stampa in JSON lo stato della coda (file convertiti, falliti, in '
+                            'corso) ed esce')
+    parser.add_argument('--listen', type=str, default=None, metavar='INDIRIZZO',
+                       help='Avvia il servizio HTTP di conversione su [HOST:]PORTA (default '
+                            'host 127.0.0.1) o su unix:PATH; -j indica i processi di conversione')
+    parser.add_argument('--timeout', type=float, default=SERVER_TIMEOUT,
+                       help=f'Con --listen: secondi massimi per richiesta (default: {SERVER_TIMEOUT:g})')
+    parser.add_argument('--max-pending', type=int, default=None,
+                       help='Con --listen: richieste accettate contemporaneamente, oltre le '
+                            'quali si risponde 503 (default: 4 per processo)')
+    parser.add_argument('--max-body', type=float, default=SERVER_MAX_BODY / 2**20,
+                       help='Con --listen: dimensione massima del file .fit in MB '
+                            f'(default: {SERVER_MAX_BODY // 2**20})')
     
     args = parser.parse_args()
     
+    if args.cache_stats and not args.cache:
+        parser.error("--cache-stats richiede --cache")
+    if (args.queue_stats or args.retry_failed) and not args.queue:
+        parser.error("--queue-stats e --retry-failed richiedono --queue")
+    if args.input is None and not (args.serve or args.listen or args.cache_stats
+                                   or args.queue_stats):
+        parser.error("indicare un file .fit o una cartella (oppure --serve o --listen)")
+    if args.listen and (args.input is not None or args.serve):
+        parser.error("--listen non accetta un input né --serve")
+    if args.listen:
+        # asyncio e il pool si importano solo per il servizio
+        from fit_server import parse_address, run_server
+        try:
+            parse_address(args.listen)
+        except ValueError as e:
+            parser.error(str(e))
+    
     # Converti i path
-    input_path = Path(args.input)
+    input_path = Path(args.input) if args.input else None
     output_path = Path(args.output) if args.output else None
     
     # Verifica che l'input esista
-    if not input_path.exists():
+    if input_path is not None and not input_path.exists():
         print(f"Errore: {input_path} non esiste")
         sys.exit(1)
     
+    since = None
+    if args.since:
+        from fit_discovery import parse_since
+        try:
+            since = parse_since(args.since)
+        except ValueError as e:
+            parser.error(str(e))
+    if args.max_depth is not None and args.max_depth < 0:
+        parser.error("--max-depth deve essere 0 o maggiore")
+    if not args.analytics and (args.hr_max is not None or args.ftp is not None
+                               or args.split_unit != 'km'):
+        parser.error("--hr-max, --ftp e --split-unit richiedono --analytics")
+    sampling = None
+    if args.sample:
+        try:
+            sampling = SamplingSettings.parse(args.sample)
+        except ValueError as e:
+            parser.error(f"--sample: {e}")
+    if args.merge_gap is not None and not args.merge:
+        parser.error("--merge-gap richiede --merge")
+    if args.merge_gap is not None and args.merge_gap < 0:
+        parser.error("--merge-gap non può essere negativo")
+    if args.merge and (args.serve or args.listen or args.incremental):
+        parser.error("--merge non è compatibile con --serve, --listen e -i")
+    shard = None
+    if args.shard:
+        try:
+            shard = parse_shard(args.shard)
+        except ValueError as e:
+            parser.error(str(e))
+    if (args.shard or args.queue) and (args.serve or args.listen or args.merge):
+        parser.error("--shard e --queue non sono compatibili con --serve, --listen e --merge")
+    if args.queue and args.incremental:
+        parser.error("--queue tiene già traccia dei file convertiti: non serve -i")
+    # Con più processi sulla stessa cartella di output i nomi non possono
+    # dipendere dai file già visti da ciascuno (vedi fit_sink.OutputSink)
+    layout = args.layout or 'flat'
+    if args.shard or args.queue:
+        if args.layout == 'flat' and not args.archive:
+            parser.error("--shard e --queue richiedono --layout tree: con flat processi "
+                         "diversi possono scegliere lo stesso nome di output")
+        layout = 'tree'
+    if args.listen and args.compress:
+        parser.error("--compress non è compatibile con --listen")
+    if args.listen and args.quarantine:
+        parser.error("--quarantine non è compatibile con --listen")
+    if args.listen and args.catalog:
+        parser.error("--catalog non è compatibile con --listen")
+    if args.archive:
+        if args.serve or args.listen:
+            parser.error("--archive non è compatibile con --serve e --listen")
+        if args.incremental:
+            parser.error("--archive non è compatibile con -i")
+        if args.compress:
+            parser.error("con --archive la compressione dipende dall'estensione dell'archivio")
+        if archive_kind(args.archive) is None:
+            parser.error(f"archivio non supportato: {args.archive} "
+                         f"(usa {', '.join(ARCHIVE_SUFFIXES)})")
+    
+    if args.cache:
+        import sqlite3
+        from fit_cache import ResultCache
+        
+        try:
+            cache = ResultCache(Path(args.cache).expanduser(), int(args.cache_size * 2**20),
+                                args.cache_age * 86400 if args.cache_age is not None else None)
+        except (OSError, ValueError, sqlite3.Error) as e:
+            print(f"Errore: cache non utilizzabile: {e}")
+            sys.exit(1)
+        if args.cache_stats:
+            cache.evict()
+            print(json.dumps(cache.stats(), indent=2))
+            sys.exit(0)
+    else:
+        cache = None
+    
+    queue = None
+    if args.queue:
+        import sqlite3
+        
+        try:
+            queue = WorkQueue(Path(args.queue).expanduser(), args.queue_lease * 60,
+                              args.retry_failed)
+        except (OSError, ValueError, sqlite3.Error) as e:
+            print(f"Errore: coda di lavoro non utilizzabile: {e}")
+            sys.exit(1)
+        if args.queue_stats:
+            print(json.dumps(queue.stats(), indent=2))
+            sys.exit(0)
+    
+    catalog = None
+    if args.catalog:
+        import sqlite3
+        from fit_catalog import ActivityCatalog
+        
+        try:
+            catalog = ActivityCatalog(Path(args.catalog).expanduser())
+        except (OSError, sqlite3.Error) as e:
+            print(f"Errore: catalogo non utilizzabile: {e}")
+            sys.exit(1)
+    
+    # I servizi e i processi di una conversione distribuita non installano
+    # pacchetti mentre lavorano: si fermano subito con l'indicazione
+    unattended = bool(args.serve or args.listen or args.queue or args.shard)
+    if not check_dependencies(install=not unattended):
+        print("Errore: fitparse non è installato (pip install fitparse)")
+        sys.exit(1)
+    
+    # Verifica le dipendenze opzionali prima di iniziare il batch
+    try:
+        check_format_dependencies(args.format)
+        check_compression_dependencies(args.compress)
+        if args.analytics:
+            check_analytics_dependencies()
+        check_sampling_dependencies(sampling)
+    except RuntimeError as e:
+        print(f"Errore: {e}")
+        sys.exit(1)
+    
     # Crea il converter
-    converter = FitToTxtConverterCLI(verbose=not args.quiet)
+    messages = [name.strip() for name in args.messages.split(',') if name.strip()]
+    try:
+        analytics = (AnalyticsSettings(args.hr_max, args.ftp, args.split_unit)
+                     if args.analytics else None)
+        limits = None
+        if any(value is not None for value in (args.max_size, args.file_timeout, args.cpu_timeout)):
+            limits = FileLimits(int(args.max_size * 2**20) if args.max_size is not None else None,
+                                args.file_timeout, args.cpu_timeout)
+        # In modalità --serve stdout è riservato alle risposte JSON
+        converter = FitToTxtConverterCLI(verbose=not (args.quiet or args.serve),
+                                         output_format=args.format,
+                                         engine=args.engine, messages=messages,
+                                         input_mode=args.input_mode, cache=cache,
+                                         analytics=analytics, on_error=args.on_error,
+                                         limits=limits,
+                                         quarantine_dir=(Path(args.quarantine)
+                                                         if args.quarantine else None),
+                                         catalog=catalog, sampling=sampling)
+    except ValueError as e:
+        print(f"Errore: {e}")
+        sys.exit(1)
+    
+    if args.metrics_out:
+        try:
+            converter.metrics = MetricsWriter(args.metrics_out)
+        except OSError as e:
+            print(f"Errore: {e}")
+            sys.exit(1)
+    
+    def run(task):
+        try:
+            if args.profile:
+                return profile_run(args.profile, task, args.profile_out)
+            return task()
+        finally:
+            if converter.metrics is not None:
+                converter.metrics.close()
+            if catalog is not None:
+                catalog.close()
+            if queue is not None:
+                queue.close()
+    
+    if args.listen:
+        sys.exit(run(lambda: run_server(converter, args.listen, args.jobs,
+                                        max_pending=args.max_pending, timeout=args.timeout,
+                                        max_body=int(args.max_body * 2**20))))
+    
+    if args.serve:
+        failed = run(lambda: serve(converter, output_path, iter(sys.stdin.readline, ''),
+                                   sys.stdout, args.compress))
+        sys.exit(0 if failed == 0 else 1)
+    
+    # Il profilo copre solo il processo principale: niente pool
+    jobs = args.jobs
+    if args.profile and jobs > 1:
+        converter.log("Profilazione attiva: conversione sequenziale")
+        jobs = 1
     
     # Esegui la conversione
     print(f"\nFIT to TXT Converter")
     print("=" * 40)
     
-    successful, failed = converter.convert_batch(input_path, output_path, args.recursive)
+    cache_before = cache.stats() if cache is not None else None
+    successful, failed = run(lambda: converter.convert_batch(
+        input_path, output_path, args.recursive, jobs=jobs, incremental=args.incremental,
+        include=args.include, exclude=args.exclude, max_depth=args.max_depth, since=since,
+        layout=layout, compression=args.compress,
+        archive=Path(args.archive) if args.archive else None,
+        merge_gap=(MERGE_GAP if args.merge_gap is None else args.merge_gap * 60)
+        if args.merge else None, shard=shard, queue=queue))
     
     # Report finale
     print("\n" + "=" * 40)
     print("CONVERSIONE COMPLETATA")
     print(f"✓ Successo: {successful} file")
+    if converter.skipped > 0:
+        print(f"↷ Invariati: {converter.skipped} file")
+    if queue is not None and queue.skipped + queue.busy > 0:
+        print(f"↷ Nella coda: {queue.skipped} file già elaborati, {queue.busy} presi da altri "
+              f"processi")
+    if converter.partial > 0:
+        print(f"⚠ Parziali: {converter.partial} file (danneggiati, convertiti in parte)")
     if failed > 0:
         print(f"✗ Falliti: {failed} file")
+    if converter.quarantined > 0:
+        print(f"→ In quarantena: {converter.quarantined} file in {args.quarantine}")
+    if converter.metrics is not None:
+        print(f"Metriche salvate in {args.metrics_out}")
+    if catalog is not None:
+        print(f"Catalogo aggiornato: {args.catalog}")
+    if cache is not None:
+        # I contatori sono cumulativi: si mostra la differenza di questa esecuzione
+        stats = cache.stats()
+        hits, misses, evictions = (stats[name] - cache_before[name]
+                                   for name in ('hits', 'misses', 'evictions'))
+        print(f"Cache: {hits} risultati riutilizzati, {misses} file decodificati, "
+              f"{evictions} eliminati ({stats['entries']} in cache, "
+              f"{stats['bytes'] / 2**20:.1f} MB)")
     
     # Exit code basato sul successo
     sys.exit(0 if failed == 0 else 1)
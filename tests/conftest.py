@@ -0,0 +1,43 @@
+"""
+Fixture comuni dei test: file .fit sintetici (fit_synth) e avvio della CLI
+in un processo separato
+"""
+
+import sys
+import subprocess
+from pathlib import Path
+
+import pytest
+
+from fit_synth import generate_fit
+
+ROOT = Path(__file__).resolve().parent.parent
+CLI = ROOT / 'fit_to_txt_converter_cli.py'
+
+
+@pytest.fixture
+def write_fit():
+    """Scrive un file .fit sintetico (opzioni di fit_synth.generate_fit) e ne restituisce il path"""
+    def write(path: Path, **options) -> Path:
+        options.setdefault('duration', 120)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(generate_fit(**options))
+        return path
+    return write
+
+
+def cli_command(*args) -> list:
+    """Riga di comando della CLI con l'interprete dei test"""
+    return [sys.executable, str(CLI), *map(str, args)]
+
+
+@pytest.fixture
+def run_cli():
+    """Esegue la CLI fino alla fine e restituisce il CompletedProcess"""
+    def run(*args, check: bool = True) -> subprocess.CompletedProcess:
+        result = subprocess.run(cli_command(*args), capture_output=True, text=True,
+                                cwd=ROOT, timeout=300)
+        if check and result.returncode != 0:
+            raise AssertionError(f"exit code {result.returncode}\n{result.stdout}\n{result.stderr}")
+        return result
+    return run
@@ -0,0 +1,52 @@
+"""Cache dei risultati (fit_cache)"""
+
+import sqlite3
+import time
+
+from fit_cache import ResultCache
+
+
+def _stored_size(path) -> int:
+    with sqlite3.connect(str(path)) as db:
+        return db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+
+
+def test_running_total_and_eviction(tmp_path):
+    path = tmp_path / 'cache.sqlite'
+    with ResultCache(path, max_size=1000) as cache:
+        for index in range(30):
+            cache.put(f"k{index}", b'x' * (50 + index), index)
+        # Sostituzione di una chiave esistente
+        cache.put('k29', b'y' * 10, 0)
+        stats = cache.stats()
+        assert stats['bytes'] == _stored_size(path) <= 1000
+        assert stats['stores'] == 31 and stats['evictions'] > 0
+        # Restano i più recenti
+        assert cache.get('k29') == (b'y' * 10, 0)
+        assert cache.get('k0') is None
+
+
+def test_expired_results(tmp_path):
+    path = tmp_path / 'cache.sqlite'
+    with ResultCache(path, max_age=60) as cache:
+        cache.put('old', b'a' * 100, 1)
+        cache.put('new', b'b' * 100, 1)
+        with sqlite3.connect(str(path)) as db:
+            db.execute("UPDATE results SET accessed = ? WHERE key = 'old'", (time.time() - 120,))
+        assert cache.get('old') is None
+        assert cache.stats()['bytes'] == _stored_size(path) == 100
+        assert cache.get('new') == (b'b' * 100, 1)
+
+
+def test_total_of_existing_cache(tmp_path):
+    path = tmp_path / 'cache.sqlite'
+    with ResultCache(path) as cache:
+        cache.put('a', b'a' * 70, 1)
+    # Cache scritta da una versione senza il totale
+    with sqlite3.connect(str(path)) as db:
+        db.execute("DELETE FROM stats WHERE name = 'bytes'")
+        for trigger in ('results_insert', 'results_update', 'results_delete'):
+            db.execute(f"DROP TRIGGER {trigger}")
+    with ResultCache(path) as cache:
+        cache.put('b', b'b' * 30, 1)
+        assert cache.stats()['bytes'] == _stored_size(path) == 100
@@ -0,0 +1,30 @@
+"""Verifica di fitparse all'avvio della CLI"""
+
+import os
+import subprocess
+
+import pytest
+
+from tests.conftest import ROOT, cli_command
+
+
+@pytest.fixture
+def without_fitparse(tmp_path):
+    """Ambiente in cui fitparse risulta non installato (sitecustomize lo nasconde)"""
+    hook = tmp_path / 'hook'
+    hook.mkdir()
+    (hook / 'sitecustomize.py').write_text("import sys\nsys.modules['fitparse'] = None\n")
+    return dict(os.environ, PYTHONPATH=str(hook))
+
+
+@pytest.mark.parametrize('mode', [['--serve'], ['--listen', '127.0.0.1:0'],
+                                  ['--shard', '1/2', 'cartella'],
+                                  ['--queue', 'coda.sqlite', 'cartella']])
+def test_unattended_modes_do_not_install(tmp_path, without_fitparse, mode):
+    mode = [str(tmp_path / arg) if arg in ('cartella', 'coda.sqlite') else arg for arg in mode]
+    (tmp_path / 'cartella').mkdir()
+    result = subprocess.run(cli_command(*mode), cwd=ROOT, env=without_fitparse,
+                            capture_output=True, text=True, timeout=60, stdin=subprocess.DEVNULL)
+    assert result.returncode == 1
+    assert 'pip install fitparse' in result.stdout
+    assert 'Installazione di fitparse' not in result.stdout
@@ -0,0 +1,74 @@
+"""Ricerca dei file .fit (fit_discovery) e progresso della conversione in batch"""
+
+import re
+import threading
+
+import pytest
+
+from fit_discovery import Prefetch, discover
+
+
+def test_discover_order_and_filters(tmp_path):
+    for name in ('b.FIT', 'a.fit', 'note.txt', 'sub/c.Fit', 'sub/deep/d.fit', 'skip/e.fit'):
+        path = tmp_path / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b'')
+    found = [path.relative_to(tmp_path).as_posix()
+             for path in discover(tmp_path, recursive=True, exclude=['skip'])]
+    assert found == ['a.fit', 'b.FIT', 'sub/c.Fit', 'sub/deep/d.fit']
+    assert [path.name for path in discover(tmp_path)] == ['a.fit', 'b.FIT']
+    assert ([path.name for path in discover(tmp_path, max_depth=1)]
+            == ['a.fit', 'b.FIT', 'e.fit', 'c.Fit'])
+
+
+def test_prefetch_total():
+    release = threading.Event()
+
+    def files():
+        yield 'a'
+        yield 'b'
+        release.wait()
+        yield 'c'
+
+    prefetch = Prefetch(files())
+    items = iter(prefetch)
+    assert next(items) == 'a'
+    assert prefetch.total is None
+    release.set()
+    assert list(items) == ['b', 'c']
+    # L'ultimo file arriva quando il totale è già noto
+    assert prefetch.total == 3
+    prefetch.close()
+
+
+def test_prefetch_error():
+    def files():
+        yield 'a'
+        raise OSError('disco sparito')
+
+    with pytest.raises(OSError, match='disco sparito'):
+        list(Prefetch(files()))
+
+
+def test_prefetch_close():
+    stop = threading.Event()
+
+    def files():
+        while not stop.is_set():
+            yield 'x'
+
+    prefetch = Prefetch(files())
+    assert next(iter(prefetch)) == 'x'
+    prefetch.close()
+    assert prefetch.total is None
+
+
+@pytest.mark.parametrize('jobs', ['1', '2'])
+def test_batch_progress_total(tmp_path, write_fit, run_cli, jobs):
+    for index in range(4):
+        write_fit(tmp_path / 'in' / f"file_{index}.fit", duration=30, seed=index)
+    output = run_cli('-j', jobs, tmp_path / 'in', '-o', tmp_path / 'out').stdout
+    counters = re.findall(r'^\[(\d+)(?:/(\d+))?\] Conversione', output, re.MULTILINE)
+    assert [int(position) for position, _ in counters] == [1, 2, 3, 4]
+    assert counters[-1] == ('4', '4')
+    assert all(total in ('', '4') for _, total in counters)
@@ -0,0 +1,62 @@
+"""Il decoder veloce (--engine fast) produce lo stesso output di fitparse"""
+
+import io
+
+import pytest
+
+from fit_core import ConversionOptions, convert
+from fit_synth import generate_fit
+from fit_stream import decode
+
+# Varianti dei file generati: campi, developer field, HRV, lap, campionamento
+VARIANTS = [
+    dict(duration=300),
+    dict(duration=300, fields=16, laps=3),
+    dict(duration=200, dev_fields=3, hrv=2),
+    dict(duration=400, sample_rate=0.25, fields=4),
+    dict(duration=100, sample_rate=4, fields=0),
+]
+
+
+def _convert(data: bytes, **options) -> bytes:
+    output = io.BytesIO()
+    result = convert(data, output, ConversionOptions(**options), name='synthetic.fit')
+    assert result.ok, result.error
+    return output.getvalue()
+
+
+def _body(text: bytes) -> bytes:
+    """Il .txt senza la data di conversione"""
+    return b'\n'.join(line for line in text.split(b'\n') if b'Data conversione' not in line)
+
+
+@pytest.mark.parametrize('variant', VARIANTS)
+@pytest.mark.parametrize('seed', [0, 7])
+def test_same_messages(variant, seed):
+    data = generate_fit(seed=seed, **variant)
+    names = {'file_id', 'session', 'lap', 'record', 'event'}
+    # fitparse restituisce anche le definizioni dei developer field, che
+    # chi consuma i messaggi ignora
+    messages = {engine: [message for message in decode(data, list, engine, names)
+                         if message[0] in names]
+                for engine in ('fast', 'fitparse')}
+    assert messages['fast'] == messages['fitparse']
+
+
+@pytest.mark.parametrize('variant', VARIANTS)
+@pytest.mark.parametrize('output_format', ['txt', 'csv'])
+def test_same_output(variant, output_format):
+    data = generate_fit(seed=3, **variant)
+    fast = _convert(data, output_format=output_format, engine='fast')
+    slow = _convert(data, output_format=output_format, engine='fitparse')
+    if output_format == 'txt':
+        fast, slow = _body(fast), _body(slow)
+    assert fast == slow
+
+
+@pytest.mark.parametrize('messages', [['session'], ['lap', 'record'], ['session', 'lap']])
+def test_same_output_with_selected_messages(messages):
+    data = generate_fit(duration=300, laps=2, hrv=1, seed=5)
+    fast = _convert(data, engine='fast', messages=messages)
+    slow = _convert(data, engine='fitparse', messages=messages)
+    assert _body(fast) == _body(slow)
@@ -0,0 +1,34 @@
+"""Esportazione colonnare dei record (fit_export)"""
+
+from fit_export import (MAX_INITIAL_CAPACITY, MIN_CAPACITY, RecordColumns, collect_records,
+                        estimate_capacity)
+from fit_stream import decode
+from fit_synth import generate_fit
+
+
+def test_capacity_is_bounded():
+    assert estimate_capacity(b'\0' * 10) == MIN_CAPACITY
+    assert estimate_capacity(b'\0' * 100_000_000) == MAX_INITIAL_CAPACITY
+
+
+def test_columns_grow_and_trim():
+    data = generate_fit(duration=3 * MAX_INITIAL_CAPACITY, hrv=2)
+    columns = decode(data, lambda messages: collect_records(messages, estimate_capacity(data)),
+                     'fast', {'record'})
+    assert columns.count == 3 * MAX_INITIAL_CAPACITY
+    assert all(len(column.values) == columns.count for column in columns.columns.values())
+    assert list(columns.values('timestamp')) == sorted(columns.values('timestamp'))
+
+    columns.select([0, 5, columns.count - 1])
+    assert columns.count == columns.capacity == 3
+    assert all(len(column.values) == 3 for column in columns.columns.values())
+
+
+def test_append_after_trim():
+    columns = RecordColumns()
+    columns.trim()
+    assert columns.capacity == 0
+    for value in range(3):
+        columns.append([('heart_rate', value), ('note', f"n{value}")])
+    assert list(columns.values('heart_rate')) == [0.0, 1.0, 2.0]
+    assert columns.values('note') == ['n0', 'n1', 'n2']
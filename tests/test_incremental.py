@@ -0,0 +1,63 @@
+"""Conversione incrementale (-i, fit_manifest)"""
+
+import os
+import re
+
+import pytest
+
+from fit_manifest import MANIFEST_NAME
+
+
+def _counts(output: str):
+    """(convertiti, invariati) dal riepilogo finale della CLI"""
+    converted = re.search(r'Successo: (\d+) file', output)
+    unchanged = re.search(r'Invariati: (\d+) file', output)
+    return (int(converted.group(1)) if converted else 0,
+            int(unchanged.group(1)) if unchanged else 0)
+
+
+@pytest.fixture
+def folder(tmp_path, write_fit):
+    for index in range(3):
+        write_fit(tmp_path / 'in' / f"file_{index}.fit", duration=30, seed=index)
+    return tmp_path / 'in', tmp_path / 'out'
+
+
+@pytest.mark.parametrize('jobs', ['1', '2'])
+def test_unchanged_files_are_skipped(folder, run_cli, write_fit, jobs):
+    source, output = folder
+
+    def run(*args):
+        return _counts(run_cli('-i', '-j', jobs, *args, source, '-o', output).stdout)
+
+    assert run() == (3, 0)
+    assert (output / MANIFEST_NAME).is_file()
+    assert run() == (0, 3)
+
+    # Nuovo file: solo lui viene convertito
+    write_fit(source / 'file_3.fit', duration=30, seed=3)
+    assert run() == (1, 3)
+
+    # Stesso contenuto con un altro mtime: decide l'hash
+    stat = os.stat(source / 'file_0.fit')
+    os.utime(source / 'file_0.fit', ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert run() == (0, 4)
+
+    # Contenuto cambiato (stessa dimensione) e output cancellato
+    write_fit(source / 'file_1.fit', duration=30, seed=11)
+    (output / 'file_2.txt').unlink()
+    assert run() == (2, 2)
+
+    # Altre opzioni di output: tutto da riconvertire
+    assert run('-f', 'csv') == (4, 0)
+    assert run('-f', 'csv') == (0, 4)
+
+
+def test_failed_files_are_retried(folder, run_cli):
+    source, output = folder
+    (source / 'broken.fit').write_bytes(b'non un file fit')
+    first = run_cli('-i', '-j', '1', source, '-o', output, check=False).stdout
+    assert _counts(first) == (3, 0)
+    second = run_cli('-i', '-j', '1', source, '-o', output, check=False).stdout
+    assert _counts(second) == (0, 3)
+    assert 'broken.fit' in second
@@ -0,0 +1,99 @@
+"""Unione delle attività divise in più file (fit_merge)"""
+
+from datetime import timedelta
+
+import pytest
+
+from fit_cache import ResultCache
+from fit_catalog import ActivityCatalog
+from fit_core import ConversionOptions, convert
+from fit_merge import MergedActivity, group_files
+from fit_synth import START_TIMESTAMP
+
+SERIAL = 3_900_000_000
+
+
+@pytest.fixture
+def split_activity(tmp_path, write_fit):
+    """
+    Attività divisa in due file dello stesso dispositivo (il secondo riparte
+    da distanza zero), più una copia del primo e un file di un altro
+    dispositivo
+    """
+    folder = tmp_path / 'attivita'
+    first = write_fit(folder / 'a.fit', duration=60, seed=1, serial_number=SERIAL)
+    write_fit(folder / 'b.fit', duration=60, seed=2, serial_number=SERIAL,
+              start=START_TIMESTAMP + 90)
+    (folder / 'a_copia.fit').write_bytes(first.read_bytes())
+    write_fit(folder / 'altro.fit', duration=60, seed=3)
+    return folder
+
+
+def _merged(folder) -> MergedActivity:
+    groups = group_files(sorted(folder.glob('*.fit')))
+    merged = [group for group in groups if len(group) > 1]
+    assert len(merged) == 1
+    return MergedActivity(merged[0])
+
+
+def test_groups(split_activity):
+    groups = group_files(sorted(split_activity.glob('*.fit')))
+    assert sorted(sorted(span.path.name for span in group) for group in groups) == [
+        ['a.fit', 'a_copia.fit', 'b.fit'], ['altro.fit']]
+
+
+def test_records_in_order_without_duplicates(split_activity):
+    activity = _merged(split_activity)
+    records = [dict(fields) for name, fields in activity.messages()
+               if name == 'record']
+    assert len(records) == 120
+    assert activity.duplicates == 60
+    timestamps = [record['timestamp'] for record in records]
+    assert timestamps == sorted(timestamps) and len(set(timestamps)) == 120
+    assert timestamps[60] - timestamps[59] == timedelta(seconds=31)
+    # La distanza del secondo file prosegue da quella del primo
+    distances = [record['distance'] for record in records]
+    assert distances == sorted(distances)
+
+
+def test_session_totals_without_records(split_activity):
+    activity = _merged(split_activity)
+    full = dict(activity.messages())
+    messages = list(activity.messages(names={'session', 'lap'}))
+    assert {name for name, _ in messages} == {'session', 'lap'}
+    session = dict(messages[-1][1])
+    assert session == dict(full['session'])
+    assert session['total_distance'] > 0
+    assert session['avg_heart_rate'] > 0
+    assert session['num_laps'] == 2
+
+
+def test_cache_hit(split_activity, tmp_path):
+    output = tmp_path / 'out'
+    output.mkdir()
+    options = ConversionOptions(catalog=True)
+    with ResultCache(tmp_path / 'cache.sqlite') as cache:
+        first = convert(_merged(split_activity), output, options, cache=cache)
+        text = first.output.read_text(encoding='utf-8')
+        second = convert(_merged(split_activity), output, options, cache=cache)
+    assert first.ok and second.ok
+    assert not first.cached and second.cached
+    assert second.summary.session['total_distance'] == first.summary.session['total_distance']
+    assert first.output.name == 'a_merged.txt'
+    # Uguali a parte la data di conversione nell'intestazione
+    assert (second.output.read_text(encoding='utf-8').splitlines()[3:]
+            == text.splitlines()[3:])
+    assert 'a.fit, a_copia.fit, b.fit' in text
+
+
+def test_cli_catalog(split_activity, tmp_path, run_cli):
+    catalog_path = tmp_path / 'catalogo.sqlite'
+    run_cli('--merge', '--messages', 'session,lap', '--catalog', catalog_path,
+            split_activity, '-o', tmp_path / 'out')
+    with ActivityCatalog(catalog_path, readonly=True) as catalog:
+        activities = {activity['name']: activity for activity in catalog.find()}
+    assert set(activities) == {'a_merged.fit', 'altro.fit'}
+    merged = activities['a_merged.fit']
+    assert merged['records'] == 0
+    assert merged['total_distance'] > 0 and merged['avg_heart_rate'] > 0
+    assert merged['output'].endswith('a_merged.txt')
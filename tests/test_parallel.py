@@ -0,0 +1,34 @@
+"""Conversione in un pool di processi (fit_core.convert_parallel)"""
+
+import threading
+
+from fit_core import ConversionOptions, convert_parallel
+
+
+def test_convert_parallel(tmp_path, write_fit):
+    files = [write_fit(tmp_path / 'in' / f"file_{index}.fit", duration=30, seed=index)
+             for index in range(5)]
+    output = tmp_path / 'out'
+    output.mkdir()
+    results = list(convert_parallel(iter(files), output, ConversionOptions(), 2))
+    assert [fit_file for fit_file, _, _, _ in results] == files
+    assert all(ok for _, ok, _, _ in results)
+    assert sorted(path.name for path in output.iterdir()) == [f"file_{index}.txt"
+                                                              for index in range(5)]
+
+
+def test_cancel_does_not_wait_for_next_result(tmp_path, write_fit):
+    files = [write_fit(tmp_path / 'in' / f"file_{index}.fit", duration=4000, seed=index)
+             for index in range(8)]
+    output = tmp_path / 'out'
+    output.mkdir()
+    cancel = threading.Event()
+    # Annullata mentre si attende ancora il primo risultato
+    timer = threading.Timer(0.2, cancel.set)
+    timer.start()
+    results = list(convert_parallel(files, output, ConversionOptions(), 1, cancel=cancel))
+    timer.join()
+    assert results == []
+    # Vengono completati solo i file già avviati o già passati alla coda
+    # interna del pool (un processo più i due in attesa)
+    assert len(list(output.iterdir())) <= 3
@@ -0,0 +1,85 @@
+"""Shard e coda di lavoro condivisa tra più processi (fit_queue)"""
+
+import json
+import subprocess
+
+import pytest
+
+from fit_queue import parse_shard, shard_of
+from fit_sink import DirectorySink
+from tests.conftest import ROOT, cli_command
+
+
+@pytest.fixture
+def archive(tmp_path, write_fit):
+    """
+    Cartella con nomi ripetuti tra cartelle diverse e nella stessa cartella
+    (maiuscole e minuscole), oltre ad alcuni file normali
+    """
+    root = tmp_path / 'archivio'
+    names = ['run.Fit', 'run.fit', 'RUN.FIT', 'a/run.fit', 'a/Run.fit', 'b/run.fit', 'run_2.fit']
+    names += [f"c/ride_{index}.fit" for index in range(6)]
+    for seed, name in enumerate(names):
+        write_fit(root / name, duration=60, seed=seed)
+    return root, len(names)
+
+
+def _outputs(directory):
+    return sorted(str(path.relative_to(directory)) for path in directory.rglob('*.txt'))
+
+
+def _assert_distinct(outputs, count):
+    assert len(outputs) == count
+    assert len({name.lower() for name in outputs}) == count
+
+
+def test_parse_shard():
+    assert parse_shard('2/4') == (2, 4)
+    for spec in ('0/4', '5/4', '1/0', 'x', '1/'):
+        with pytest.raises(ValueError):
+            parse_shard(spec)
+    assert {shard_of(f"file_{index}.fit", 4) for index in range(200)} == {1, 2, 3, 4}
+
+
+def test_shared_names_do_not_depend_on_order(archive, tmp_path):
+    root, _ = archive
+    files = sorted(root.rglob('*'), key=str)
+    files = [path for path in files if path.is_file()]
+    first = DirectorySink(tmp_path / 'out', 'tree', root, shared=True)
+    second = DirectorySink(tmp_path / 'out', 'tree', root, shared=True)
+    names = [first.name(path, path.stem + '.txt') for path in files]
+    assert names == [second.name(path, path.stem + '.txt') for path in reversed(files)][::-1]
+    _assert_distinct(names, len(files))
+
+
+def test_two_processes_on_one_queue(archive, tmp_path):
+    root, count = archive
+    output, queue = tmp_path / 'out', tmp_path / 'coda.sqlite'
+    workers = [subprocess.Popen(cli_command('-r', '-j', '1', '--queue', queue, root, '-o', output),
+                                cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+               for _ in range(2)]
+    for worker in workers:
+        worker.communicate(timeout=300)
+        assert worker.returncode == 0
+
+    stats = subprocess.run(cli_command('--queue', queue, '--queue-stats'), cwd=ROOT,
+                           capture_output=True, text=True, check=True)
+    stats = json.loads(stats.stdout)
+    assert stats['done'] == count and stats['failed'] == stats['running'] == 0
+    _assert_distinct(_outputs(output), count)
+
+
+def test_shards_write_distinct_outputs(archive, tmp_path, run_cli):
+    root, count = archive
+    output = tmp_path / 'out'
+    for index in (1, 2):
+        run_cli('-r', '-j', '1', '--shard', f"{index}/2", root, '-o', output)
+    _assert_distinct(_outputs(output), count)
+
+
+def test_flat_layout_rejected(archive, tmp_path, run_cli):
+    root, _ = archive
+    result = run_cli('--queue', tmp_path / 'coda.sqlite', '--layout', 'flat', root,
+                     '-o', tmp_path / 'out', check=False)
+    assert result.returncode != 0
+    assert '--layout tree' in result.stderr
@@ -0,0 +1,78 @@
+"""Lettura dei file danneggiati: --on-error partial e resync (fit_decoder)"""
+
+import random
+
+import pytest
+
+from fit_decoder import FitCorrupt, fast_messages
+from fit_stream import decode
+from fit_synth import generate_fit
+
+RECORDS = 1200
+
+
+@pytest.fixture(scope='module')
+def activity():
+    return generate_fit(duration=RECORDS, seed=3)
+
+
+def _count_records(messages):
+    return sum(1 for name, _ in messages if name == 'record')
+
+
+def _corrupt(data: bytes, seed: int, length: int = 40) -> bytes:
+    """Sovrascrive length byte casuali a metà file (dopo header e definizioni)"""
+    rnd = random.Random(seed)
+    data = bytearray(data)
+    start = rnd.randrange(200, len(data) - 200)
+    data[start:start + length] = bytes(rnd.randrange(256) for _ in range(length))
+    return bytes(data)
+
+
+@pytest.mark.parametrize('seed', range(40))
+def test_resync_skips_only_the_damaged_bytes(activity, seed):
+    issues = []
+    records = decode(_corrupt(activity, seed), _count_records, 'fast',
+                     recovery='resync', issues=issues)
+    # I byte casuali possono ridefinire per un tratto un tipo locale:
+    # si tollera qualche record perso
+    assert records >= RECORDS * 0.98
+    # Nessun ripiego su fitparse (che non sa quanti byte salta)
+    assert all(issue['skipped'] is not None for issue in issues)
+
+
+def test_partial_stops_at_the_damaged_point(activity):
+    issues = []
+    records = decode(_corrupt(activity, 4), _count_records, 'fast', recovery='partial',
+                     issues=issues)
+    assert 0 < records < RECORDS // 2
+    assert len(issues) == 1 and 'non valida' in issues[0]['error']
+
+
+def test_truncated_file(activity):
+    issues = []
+    truncated = activity[:len(activity) // 2]
+    records = decode(truncated, _count_records, 'fast', recovery='resync', issues=issues)
+    assert 0 < records < RECORDS
+    assert 'troncato' in issues[-1]['error']
+    with pytest.raises(Exception):
+        decode(truncated, _count_records, 'fast')
+
+
+@pytest.mark.parametrize('data', [b'', b'.FIT', generate_fit(duration=10)[:11]])
+def test_short_files_are_corrupt(data):
+    with pytest.raises(FitCorrupt):
+        list(fast_messages(data))
+
+
+def test_bad_definition_is_corrupt(activity):
+    # Il primo messaggio dopo l'header (14 byte) è la definizione di file_id:
+    # una dimensione di campo non multipla del tipo non è un file valido
+    damaged = bytearray(activity)
+    assert damaged[14] & 0x40
+    damaged[14 + 6 + 3 * 1 + 1] = 3
+    with pytest.raises(FitCorrupt):
+        list(fast_messages(bytes(damaged)))
+    issues = []
+    records = decode(bytes(damaged), _count_records, 'fast', recovery='resync', issues=issues)
+    assert records == RECORDS and issues
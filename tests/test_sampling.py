@@ -0,0 +1,47 @@
+"""Campionamento dei record (fit_sampling)"""
+
+import pytest
+
+from fit_sampling import SAMPLE_FIELDS, SamplingSettings
+from fit_stream import decode
+from fit_synth import generate_fit
+
+
+@pytest.fixture(scope='module')
+def records():
+    data = generate_fit(duration=900, fields=16, seed=5)
+    return decode(data, lambda messages: [fields for name, fields in messages if name == 'record'],
+                  'fast')
+
+
+@pytest.mark.parametrize('spec', ['rdp:50', 'lttb:50'])
+def test_track_samples_keep_the_printed_fields(records, spec):
+    sampler = SamplingSettings.parse(spec).sampler()
+    for fields in records:
+        sampler.add(fields)
+    samples = sampler.samples()
+    assert len(samples) == 50
+    assert samples[0][0] == 0 and samples[-1][0] == len(records) - 1
+    for index, fields in samples:
+        expected = [(name, value) for name, value in records[index] if name in SAMPLE_FIELDS]
+        assert fields == expected
+        assert [type(value) for _, value in fields] == [type(value) for _, value in expected]
+
+
+@pytest.mark.parametrize('spec, count', [('every:100', 10), ('interval:60', 16),
+                                         ('reservoir:25', 25)])
+def test_stream_samplers(records, spec, count):
+    sampler = SamplingSettings.parse(spec).sampler()
+    for fields in records:
+        sampler.add(fields)
+    indices = sampler.indices()
+    assert len(indices) == count and indices == sorted(indices)
+    if not spec.startswith('reservoir'):
+        # L'ultimo record viene sempre tenuto
+        assert indices[-1] == len(records) - 1
+
+
+@pytest.mark.parametrize('spec', ['every:0', 'every:1.5', 'lttb:1', 'median', 'rdp:x'])
+def test_invalid_settings(spec):
+    with pytest.raises(ValueError):
+        SamplingSettings.parse(spec)
@@ -0,0 +1,91 @@
+"""Servizio HTTP su localhost (fit_server): 200, 422, 503 e 504"""
+
+import json
+import time
+import threading
+import subprocess
+import http.client
+
+import pytest
+
+from fit_synth import generate_fit
+from tests.conftest import ROOT, cli_command
+
+TIMEOUT = 1.0
+
+
+@pytest.fixture(scope='module')
+def server():
+    """Servizio con un processo, una sola richiesta alla volta e timeout di un secondo"""
+    process = subprocess.Popen(
+        cli_command('--listen', '127.0.0.1:0', '-j', '1', '--max-pending', '1',
+                    '--timeout', TIMEOUT, '-q'),
+        cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    try:
+        line = process.stdout.readline()
+        assert 'In ascolto su http://' in line, line
+        yield int(line.split('http://', 1)[1].split()[0].rsplit(':', 1)[1])
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+
+def request(port, method, path, body=None):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    try:
+        connection.request(method, path, body=body)
+        response = connection.getresponse()
+        return response.status, dict(response.getheaders()), response.read()
+    finally:
+        connection.close()
+
+
+def _health(port):
+    return json.loads(request(port, 'GET', '/health')[2])
+
+
+def test_convert(server):
+    status, headers, body = request(server, 'POST', '/convert?name=corsa.fit',
+                                    generate_fit(duration=60))
+    assert status == 200
+    assert headers['X-Fit-Records'] == '60'
+    assert 'corsa.txt' in headers['Content-Disposition']
+    assert 'Totale punti: 60' in body.decode('utf-8')
+
+    status, headers, body = request(server, 'POST', '/convert?format=csv',
+                                    generate_fit(duration=60))
+    assert status == 200 and headers['Content-Type'].startswith('text/csv')
+    assert len(body.decode('utf-8').splitlines()) == 61
+
+
+def test_invalid_file(server):
+    status, _, body = request(server, 'POST', '/convert', b'non un file fit')
+    assert status == 422
+    assert json.loads(body)['ok'] is False
+
+
+def test_busy_and_timeout(server):
+    # Un file che richiede qualche secondo: va in timeout
+    slow = generate_fit(duration=10000, fields=16)
+    result = {}
+    thread = threading.Thread(
+        target=lambda: result.update(slow=request(server, 'POST', '/convert', slow)))
+    thread.start()
+    deadline = time.monotonic() + 10
+    while _health(server)['pending'] == 0:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+    # Oltre --max-pending: rifiutata subito
+    status, headers, _ = request(server, 'POST', '/convert', generate_fit(duration=60))
+    assert status == 503 and headers['Retry-After'] == '1'
+
+    thread.join()
+    assert result['slow'][0] == 504
+
+    # Il processo ha smesso di convertire allo scadere del timeout:
+    # la richiesta successiva non trova il pool ancora occupato
+    status, _, _ = request(server, 'POST', '/convert', generate_fit(duration=60))
+    assert status == 200
+    health = _health(server)
+    assert health['timed_out'] == 1 and health['rejected'] == 1
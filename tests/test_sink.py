@@ -0,0 +1,107 @@
+"""Destinazioni dell'output (fit_sink): cartelle, compressione e archivi"""
+
+import base64
+import gzip
+import io
+import json
+import tarfile
+import zipfile
+
+import pytest
+
+from fit_sink import ArchiveSink, atomic_writer
+
+
+@pytest.fixture
+def folder(tmp_path, write_fit):
+    """File con lo stesso nome in cartelle diverse"""
+    root = tmp_path / 'in'
+    for seed, name in enumerate(['run.fit', 'a/run.fit', 'b/ride.fit']):
+        write_fit(root / name, duration=30, seed=seed)
+    return root
+
+
+def _body(text: str) -> str:
+    """Il .txt senza la data di conversione"""
+    return '\n'.join(line for line in text.splitlines() if 'Data conversione' not in line)
+
+
+def _read_archive(path) -> dict:
+    """Nome -> contenuto dei file di un archivio"""
+    name = path.name
+    if name.endswith(('.tar', '.tar.gz', '.tgz')):
+        with tarfile.open(path) as archive:
+            return {member.name: archive.extractfile(member).read()
+                    for member in archive.getmembers()}
+    if name.endswith('.zip'):
+        with zipfile.ZipFile(path) as archive:
+            return {member: archive.read(member) for member in archive.namelist()}
+    opener = gzip.open if name.endswith('.gz') else open
+    contents = {}
+    with opener(path, 'rb') as f:
+        for line in f:
+            entry = json.loads(line)
+            contents[entry['output']] = (entry['content'].encode('utf-8') if 'content' in entry
+                                         else base64.b64decode(entry['content_base64']))
+    return contents
+
+
+@pytest.mark.parametrize('suffix', ['.tar', '.tar.gz', '.tgz', '.zip', '.jsonl', '.jsonl.gz'])
+@pytest.mark.parametrize('jobs', ['1', '2'])
+def test_archive_matches_directory(folder, tmp_path, run_cli, suffix, jobs):
+    run_cli('-r', '-j', '1', folder, '-o', tmp_path / 'dir')
+    archive = tmp_path / f"risultati{suffix}"
+    run_cli('-r', '-j', jobs, '--archive', archive, folder)
+    contents = _read_archive(archive)
+    expected = {path.name: path.read_text(encoding='utf-8')
+                for path in (tmp_path / 'dir').iterdir()}
+    assert sorted(contents) == sorted(expected) == ['a_run.txt', 'ride.txt', 'run.txt']
+    for name, data in contents.items():
+        assert _body(data.decode('utf-8')) == _body(expected[name])
+    # Nessun file temporaneo rimasto accanto all'archivio
+    assert [path.name for path in tmp_path.iterdir() if path.name.startswith('.')] == []
+
+
+def test_binary_formats_in_jsonl(folder, tmp_path, run_cli):
+    archive = tmp_path / 'risultati.jsonl'
+    run_cli('-r', '-f', 'npz', '--archive', archive, folder)
+    contents = _read_archive(archive)
+    assert sorted(contents) == ['a_run.npz', 'ride.npz', 'run.npz']
+    for data in contents.values():
+        with zipfile.ZipFile(io.BytesIO(data)) as npz:
+            assert 'timestamp.npy' in npz.namelist()
+
+
+def test_tree_layout_in_archive(folder, tmp_path, run_cli):
+    archive = tmp_path / 'risultati.zip'
+    run_cli('-r', '--layout', 'tree', '--archive', archive, folder)
+    assert sorted(_read_archive(archive)) == ['a/run.txt', 'b/ride.txt', 'run.txt']
+
+
+def test_gzip_outputs(folder, tmp_path, run_cli):
+    run_cli('-r', folder, '-o', tmp_path / 'plain')
+    run_cli('-r', '--compress', 'gzip', folder, '-o', tmp_path / 'gz')
+    names = sorted(path.name for path in (tmp_path / 'gz').iterdir())
+    assert names == ['a_run.txt.gz', 'ride.txt.gz', 'run.txt.gz']
+    for name in names:
+        text = gzip.decompress((tmp_path / 'gz' / name).read_bytes()).decode('utf-8')
+        assert _body(text) == _body((tmp_path / 'plain' / name[:-3]).read_text(encoding='utf-8'))
+
+
+def test_archive_appears_on_close(tmp_path):
+    path = tmp_path / 'risultati.tar'
+    with ArchiveSink(path) as sink:
+        sink.add('uno.txt', b'1')
+        assert not path.exists()
+    assert _read_archive(path) == {'uno.txt': b'1'}
+
+
+def test_atomic_writer_discards_failed_writes(tmp_path):
+    path = tmp_path / 'output.txt'
+    path.write_bytes(b'vecchio')
+    with pytest.raises(RuntimeError):
+        with atomic_writer(path) as f:
+            f.write(b'nuovo')
+            raise RuntimeError('interrotto')
+    assert path.read_bytes() == b'vecchio'
+    assert [entry.name for entry in tmp_path.iterdir()] == ['output.txt']